@@ -15,10 +15,49 @@
   const exportMenu = document.getElementById('exportMenu');
   let isTransposed = false;
 
+  // 列式格式（/api/data?format=columnar 或 export_from_db.py --format columnar）：
+  // 共享日期轴 + 每指标数组，标记/状态/阶段为整数编码，此处还原为逐点对象
+  function decodePayload(payload) {
+    if (!payload || payload.format !== 'columnar') return payload;
+    const dates = payload.dates || [];
+    const flags = payload.flags || [];
+    const statuses = payload.statuses || [];
+    const phases = payload.phases || [];
+    const indicators = {};
+    Object.keys(payload.indicators || {}).forEach((name) => {
+      const col = payload.indicators[name];
+      const series = new Array(col.d.length);
+      for (let i = 0; i < col.d.length; i++) {
+        series[i] = {
+          date: dates[col.d[i]],
+          value: col.v[i],
+          status: statuses[col.s[i]],
+          flag: flags[col.f[i]],
+          phase: phases[col.p[i]]
+        };
+      }
+      indicators[name] = { unit: col.unit, ref: col.ref, series };
+    });
+    return {
+      start_date: payload.start_date,
+      cycle_length_days: payload.cycle_length_days,
+      cycle_starts: payload.cycle_starts,
+      dates,
+      indicators,
+      trends: payload.trends
+    };
+  }
+
   async function loadData() {
     const fallback = async () => {
-      const resp2 = await fetch('../data.json');
-      return await resp2.json();
+      // 构建产物（build_static.py）中 data.json 带内容哈希、长期缓存，由短缓存的 data-manifest.json 指明文件名
+      let dataUrl = '../data.json';
+      try {
+        const m = await fetch('../data-manifest.json');
+        if (m && m.ok) dataUrl = new URL((await m.json()).data, m.url).href;
+      } catch (_) {}
+      const resp2 = await fetch(dataUrl);
+      return decodePayload(await resp2.json());
     };
     let apiBase = window.__API_BASE__ || '';
     if (!apiBase) {
@@ -26,11 +65,24 @@
       if (meta && meta.content) apiBase = meta.content.trim();
     }
     if (apiBase) {
-      const apiUrl = apiBase.replace(/\/$/, '') + '/api/data';
+      const root = apiBase.replace(/\/$/, '');
+      // 先只取指标元数据（/api/indicators），序列在需要显示时按指标从 /api/series 拉取
+      try {
+        const resp = await fetch(root + '/api/indicators', { mode: 'cors' });
+        if (resp && resp.ok) {
+          const meta = await resp.json();
+          const indicators = {};
+          Object.keys(meta.indicators || {}).forEach((name) => {
+            const m = meta.indicators[name];
+            indicators[name] = { unit: m.unit, ref: m.ref, series: [] };
+          });
+          return Object.assign({}, meta, { indicators, seriesBase: root, trendsBase: root });
+        }
+      } catch (_) {}
       try {
-        const resp = await fetch(apiUrl, { mode: 'cors' });
+        const resp = await fetch(root + '/api/data?format=columnar', { mode: 'cors' });
         if (resp && resp.ok) {
-          return await resp.json();
+          return Object.assign(decodePayload(await resp.json()), { trendsBase: root });
         }
       } catch (_) {}
     }
@@ -91,10 +143,100 @@
     return merged;
   };
 
+  // 懒加载模式：记录每个规范名对应的服务端指标名，首次显示时再请求其序列
+  const lazySources = {};
+  if (data.seriesBase) {
+    Object.keys(data.indicators || {}).forEach((name) => {
+      const canon = canonicalName(name);
+      (lazySources[canon] = lazySources[canon] || []).push(name);
+    });
+  }
   data.indicators = normalizeIndicatorsObject(data.indicators || {});
 
-  const startDate = new Date(data.start_date);
+  // 趋势线由服务端按数据版本预计算（scripts/trends.py：LOESS，span 0.6），
+  // 静态 data.json 内嵌 trends，API 模式下首次勾选时从 /api/trends 获取；前端只按日期取点绘制
+  let trendsByName = null;
+  let trendsRequest = null;
+  function indexTrends(trends) {
+    const out = {};
+    Object.keys((trends && trends.indicators) || {}).forEach((name) => {
+      const canon = canonicalName(name);
+      if (!out[canon]) out[canon] = new Map(trends.indicators[name].loess || []);
+    });
+    return out;
+  }
+  if (data.trends) trendsByName = indexTrends(data.trends);
+  function ensureTrends() {
+    if (trendsByName || !data.trendsBase) return Promise.resolve();
+    if (!trendsRequest) {
+      trendsRequest = fetch(data.trendsBase + '/api/trends', { mode: 'cors' })
+        .then((resp) => {
+          if (!resp.ok) throw new Error('HTTP ' + resp.status);
+          return resp.json();
+        })
+        .then((trends) => { trendsByName = indexTrends(trends); })
+        .catch(() => { trendsRequest = null; });
+    }
+    return trendsRequest;
+  }
+  function trendSeries(name, seriesData) {
+    const byDate = (trendsByName && trendsByName[name]) || new Map();
+    return seriesData.map(pt => [pt.date, byDate.has(pt.date) ? byDate.get(pt.date) : null]);
+  }
+
+  const seriesRequests = {};
+  function ensureSeries(names) {
+    const missing = names.filter(n => lazySources[n] && !seriesRequests[n]);
+    if (missing.length) {
+      const srcNames = [];
+      missing.forEach((n) => { srcNames.push(...lazySources[n]); });
+      const url = data.seriesBase + '/api/series?format=columnar&names=' + encodeURIComponent(srcNames.join(','));
+      const req = fetch(url, { mode: 'cors' })
+        .then((resp) => {
+          if (!resp.ok) throw new Error('HTTP ' + resp.status);
+          return resp.json();
+        })
+        .then((payload) => {
+          const part = normalizeIndicatorsObject(decodePayload(payload).indicators || {});
+          missing.forEach((n) => {
+            if (part[n]) data.indicators[n].series = part[n].series;
+            delete lazySources[n];
+          });
+        })
+        .catch(() => {
+          // 失败时允许下次 update 重试
+          missing.forEach((n) => { delete seriesRequests[n]; });
+        });
+      missing.forEach((n) => { seriesRequests[n] = req; });
+    }
+    return Promise.all(names.filter(n => seriesRequests[n]).map(n => seriesRequests[n]));
+  }
+
   const cycleLen = Number(data.cycle_length_days || 21);
+
+  // 各周期实际开始日期（升序）；数据中没有时以 start_date 为第一周期，之后按周期长度顺延
+  const cycleStarts = (data.cycle_starts && data.cycle_starts.length ? data.cycle_starts : [data.start_date])
+    .map(d => new Date(d));
+
+  // 与 chemo_cycles.CycleSchedule.locate 一致：二分查找不晚于该日期的最后一个周期起点
+  function cycleOf(dtStr) {
+    const d = new Date(dtStr);
+    let lo = 0;
+    let hi = cycleStarts.length;
+    while (lo < hi) {
+      const mid = (lo + hi) >> 1;
+      if (cycleStarts[mid] <= d) lo = mid + 1; else hi = mid;
+    }
+    if (lo === 0) return { cycle: 0, day: 0 };
+    let offset = Math.floor((d - cycleStarts[lo - 1]) / (24 * 3600 * 1000));
+    let cycle = lo;
+    if (lo === cycleStarts.length) {
+      cycle += Math.floor(offset / cycleLen);
+      offset %= cycleLen;
+    }
+    return { cycle, day: offset + 1 };
+  }
+
   const BASELINE_DATE = '2025-08-06';
   const BASELINE_CATEGORY = '-2';
   const BASELINE_PHASE = '化疗前2天';
@@ -130,12 +272,7 @@
   const maxCycle = (function () {
     let m = 1;
     for (const d of data.dates) {
-      const dt = new Date(d);
-      const deltaDays = Math.floor((dt - startDate) / (24 * 3600 * 1000));
-      if (deltaDays >= 0) {
-        const c = Math.floor(deltaDays / cycleLen) + 1;
-        m = Math.max(m, c);
-      }
+      m = Math.max(m, cycleOf(d).cycle);
     }
     return m;
   })();
@@ -153,12 +290,9 @@
 
   function computePhaseLabel(dtStr) {
     try {
-      const d = new Date(dtStr);
-      const deltaDays = Math.floor((d - startDate) / (24 * 3600 * 1000));
-      if (deltaDays < 0) return '首次化疗前';
-      const cycle = Math.floor(deltaDays / cycleLen) + 1;
-      const dayInCycle = (deltaDays % cycleLen) + 1;
-      return `第${cycle}次化疗d${dayInCycle}`;
+      const { cycle, day } = cycleOf(dtStr);
+      if (cycle === 0) return '首次化疗前';
+      return `第${cycle}次化疗d${day}`;
     } catch (e) {
       return '';
     }
@@ -186,32 +320,6 @@
     }
   }
 
-  function computeTrendLoess(seriesData) {
-    const valid = seriesData.filter(pt => typeof pt.value === 'number');
-    if (valid.length < 3) return seriesData.map(pt => [pt.date, null]);
-    const baseDateStr = (seriesData && seriesData.length) ? seriesData[0].date : (data.dates && data.dates[0]);
-    const dayDiff = (dateStr) => { const base = new Date(baseDateStr); const d = new Date(dateStr); return (d - base) / (24 * 3600 * 1000); };
-    const xValid = valid.map(pt => dayDiff(pt.date));
-    const yValid = valid.map(pt => pt.value);
-    const span = 0.6; const k = Math.max(3, Math.floor(span * valid.length));
-    function predictAt(x0) {
-      const dist = xValid.map((x, idx) => ({ idx, d: Math.abs(x - x0) }));
-      dist.sort((a, b) => a.d - b.d);
-      const kIdxs = dist.slice(0, k);
-      const dmax = kIdxs[kIdxs.length - 1].d || 1e-6;
-      let Sw = 0, Swx = 0, Swx2 = 0, Swy = 0, Swxy = 0;
-      for (const { idx, d } of kIdxs) {
-        const u = d / dmax; const w = Math.pow(1 - Math.pow(u, 3), 3);
-        const x = xValid[idx]; const y = yValid[idx];
-        Sw += w; Swx += w * x; Swx2 += w * x * x; Swy += w; Swxy += w * x * y;
-      }
-      const denom = (Sw * Swx2 - Swx * Swx);
-      if (Math.abs(denom) < 1e-12) { const a = Swy / (Sw || 1e-12); return a; }
-      const b = (Sw * Swxy - Swx * Swy) / denom; const a = (Swy - b * Swx) / Sw; return a + b * x0;
-    }
-    return seriesData.map(pt => { const x0 = dayDiff(pt.date); const yhat = predictAt(x0); return [pt.date, yhat]; });
-  }
-
   let chartInstancesCore = [];
   let chartInstancesExt = [];
   function disposeChartsIn(container, instancesArr) {
@@ -244,16 +352,16 @@
       series: (function () { const arr = []; if (ref && typeof ref.lower === 'number') { const lowerData = xData.map(d => [d, ref.lower]); arr.push({ name: '参考下限', type: 'line', data: lowerData, connectNulls: true, symbol: 'none', lineStyle: { width: 1.5, type: 'dashed', color: '#1a73e8' }, silent: true, tooltip: { show: false }, endLabel: { show: true, formatter: () => `下限 ${formatY(unit, ref.lower)}`, color: '#1a73e8', backgroundColor: 'rgba(255,255,255,0.8)', padding: [2, 4], borderRadius: 3 }, z: 0 }); }
         if (ref && typeof ref.upper === 'number') { const upperData = xData.map(d => [d, ref.upper]); arr.push({ name: '参考上限', type: 'line', data: upperData, connectNulls: true, symbol: 'none', lineStyle: { width: 1.5, type: 'dashed', color: '#d93025' }, silent: true, tooltip: { show: false }, endLabel: { show: true, formatter: () => `上限 ${formatY(unit, ref.upper)}`, color: '#d93025', backgroundColor: 'rgba(255,255,255,0.8)', padding: [2, 4], borderRadius: 3 }, z: 0 }); }
         arr.push({ name: indicatorName, type: 'line', data: seriesPoints, connectNulls: true, symbolSize: RS.symbolSize, lineStyle: { width: RS.lineWidth }, smooth: false, emphasis: { focus: 'series', scale: 1.5, itemStyle: { borderWidth: 2, borderColor: '#fff', shadowBlur: 5, shadowColor: 'rgba(0,0,0,0.3)' } }, z: 2 });
-        if (showTrendInput && showTrendInput.checked) { const trend = computeTrendLoess(seriesData.filter(pt => pt.date !== BASELINE_CATEGORY)); arr.push({ name: '趋势拟合', type: 'line', data: trend, connectNulls: true, symbol: 'none', lineStyle: { width: 1.5, type: 'dashed', color: 'rgba(120,120,120,0.55)' }, smooth: true, emphasis: { focus: 'none' }, tooltip: { show: false }, silent: true, z: 0 }); }
+        if (showTrendInput && showTrendInput.checked) { const trend = trendSeries(indicatorName, seriesData); arr.push({ name: '趋势拟合', type: 'line', data: trend, connectNulls: true, symbol: 'none', lineStyle: { width: 1.5, type: 'dashed', color: 'rgba(120,120,120,0.55)' }, smooth: true, emphasis: { focus: 'none' }, tooltip: { show: false }, silent: true, z: 0 }); }
         return arr; })()
     };
     function onAxisPointerUpdate(event) { if (event && event.axesInfo && event.axesInfo.length) { const xInfo = event.axesInfo.find(info => info.axisDim === 'x'); if (xInfo) { const xVal = xInfo.value; currentXIndex = xData.indexOf(xVal); } } }
     return { option, onAxisPointerUpdate };
   }
 
-  function renderCoreCharts(names) { disposeChartsIn(chartsCore, chartInstancesCore); const startC = Number(startCycleInput.value); const endC = Number(endCycleInput.value); names.forEach((name) => { const ind = data.indicators[name]; if (!ind) return; const unit = ind.unit || ''; const seriesAll = ind.series || []; const filtered = seriesAll.filter((pt) => { const d = new Date(pt.date); const deltaDays = Math.floor((d - startDate) / (24 * 3600 * 1000)); const cycle = deltaDays >= 0 ? Math.floor(deltaDays / cycleLen) + 1 : 0; return cycle >= startC && cycle <= endC; }); const baselinePt = seriesAll.find(pt => pt.date === BASELINE_DATE); const withBaseline = baselinePt ? [{ date: BASELINE_CATEGORY, value: baselinePt.value, phaseLabel: BASELINE_PHASE }].concat(filtered) : filtered; const card = document.createElement('div'); card.className = 'chart-card'; const title = document.createElement('div'); title.className = 'chart-title'; title.textContent = name + (unit ? `（${unit}）` : ''); const chartDiv = document.createElement('div'); chartDiv.className = 'chart'; card.appendChild(title); card.appendChild(chartDiv); chartsCore.appendChild(card); const chart = echarts.init(chartDiv); const built = buildOption(name, withBaseline, unit, ind.ref || null); chart.setOption(built.option); chart.on('updateAxisPointer', built.onAxisPointerUpdate); chart.resize(); chartInstancesCore.push({ name, chart, el: chartDiv }); }); }
+  function renderCoreCharts(names) { disposeChartsIn(chartsCore, chartInstancesCore); const startC = Number(startCycleInput.value); const endC = Number(endCycleInput.value); names.forEach((name) => { const ind = data.indicators[name]; if (!ind) return; const unit = ind.unit || ''; const seriesAll = ind.series || []; const filtered = seriesAll.filter((pt) => { const cycle = cycleOf(pt.date).cycle; return cycle >= startC && cycle <= endC; }); const baselinePt = seriesAll.find(pt => pt.date === BASELINE_DATE); const withBaseline = baselinePt ? [{ date: BASELINE_CATEGORY, value: baselinePt.value, phaseLabel: BASELINE_PHASE }].concat(filtered) : filtered; const card = document.createElement('div'); card.className = 'chart-card'; const title = document.createElement('div'); title.className = 'chart-title'; title.textContent = name + (unit ? `（${unit}）` : ''); const chartDiv = document.createElement('div'); chartDiv.className = 'chart'; card.appendChild(title); card.appendChild(chartDiv); chartsCore.appendChild(card); const chart = echarts.init(chartDiv); const built = buildOption(name, withBaseline, unit, ind.ref || null); chart.setOption(built.option); chart.on('updateAxisPointer', built.onAxisPointerUpdate); chart.resize(); chartInstancesCore.push({ name, chart, el: chartDiv }); }); }
 
-  function renderExtCharts(selectedInds) { disposeChartsIn(chartsContainer, chartInstancesExt); const startC = Number(startCycleInput.value); const endC = Number(endCycleInput.value); selectedInds.forEach((name) => { const ind = data.indicators[name]; if (!ind) return; const unit = ind.unit || ''; const seriesAll = ind.series || []; const filtered = seriesAll.filter((pt) => { const d = new Date(pt.date); const deltaDays = Math.floor((d - startDate) / (24 * 3600 * 1000)); const cycle = deltaDays >= 0 ? Math.floor(deltaDays / cycleLen) + 1 : 0; return cycle >= startC && cycle <= endC; }); const baselinePt = seriesAll.find(pt => pt.date === BASELINE_DATE); const withBaseline = baselinePt ? [{ date: BASELINE_CATEGORY, value: baselinePt.value, phaseLabel: BASELINE_PHASE }].concat(filtered) : filtered; const card = document.createElement('div'); card.className = 'chart-card'; const title = document.createElement('div'); title.className = 'chart-title'; title.textContent = name + (unit ? `（${unit}）` : ''); const chartDiv = document.createElement('div'); chartDiv.className = 'chart'; card.appendChild(title); card.appendChild(chartDiv); chartsContainer.appendChild(card); const chart = echarts.init(chartDiv); const built = buildOption(name, withBaseline, unit, ind.ref || null); chart.setOption(built.option); chart.on('updateAxisPointer', built.onAxisPointerUpdate); chart.resize(); chartInstancesExt.push({ name, chart, el: chartDiv }); }); }
+  function renderExtCharts(selectedInds) { disposeChartsIn(chartsContainer, chartInstancesExt); const startC = Number(startCycleInput.value); const endC = Number(endCycleInput.value); selectedInds.forEach((name) => { const ind = data.indicators[name]; if (!ind) return; const unit = ind.unit || ''; const seriesAll = ind.series || []; const filtered = seriesAll.filter((pt) => { const cycle = cycleOf(pt.date).cycle; return cycle >= startC && cycle <= endC; }); const baselinePt = seriesAll.find(pt => pt.date === BASELINE_DATE); const withBaseline = baselinePt ? [{ date: BASELINE_CATEGORY, value: baselinePt.value, phaseLabel: BASELINE_PHASE }].concat(filtered) : filtered; const card = document.createElement('div'); card.className = 'chart-card'; const title = document.createElement('div'); title.className = 'chart-title'; title.textContent = name + (unit ? `（${unit}）` : ''); const chartDiv = document.createElement('div'); chartDiv.className = 'chart'; card.appendChild(title); card.appendChild(chartDiv); chartsContainer.appendChild(card); const chart = echarts.init(chartDiv); const built = buildOption(name, withBaseline, unit, ind.ref || null); chart.setOption(built.option); chart.on('updateAxisPointer', built.onAxisPointerUpdate); chart.resize(); chartInstancesExt.push({ name, chart, el: chartDiv }); }); }
 
   function renderPivotTable(selectedInds) {
     pivotWrapper.innerHTML = '';
@@ -285,7 +393,8 @@
     table.appendChild(thead); table.appendChild(tbody); pivotWrapper.appendChild(table);
   }
 
-  function update() { const selected = getSelectedIndicators(); renderCoreCharts(coreNames); renderExtCharts(selected); const allShown = coreNames.concat(selected); renderPivotTable(allShown); }
+  let updateSeq = 0;
+  async function update() { const seq = ++updateSeq; const selected = getSelectedIndicators(); await ensureSeries(coreNames.concat(selected)); if (seq !== updateSeq) return; renderCoreCharts(coreNames); renderExtCharts(selected); const allShown = coreNames.concat(selected); renderPivotTable(allShown); }
   indicatorPanel.addEventListener('change', update);
   startCycleInput.addEventListener('change', update);
   endCycleInput.addEventListener('change', update);
@@ -293,7 +402,7 @@
 
   if (extendCollapse) { const header = extendCollapse.querySelector('.collapse-header'); if (header) { header.addEventListener('click', () => { const expanded = header.getAttribute('aria-expanded') === 'true'; header.setAttribute('aria-expanded', expanded ? 'false' : 'true'); }); } }
 
-  update();
+  await update();
   window.addEventListener('resize', () => { chartInstancesCore.forEach((obj) => { try { obj.chart && obj.chart.resize(); } catch (_) {} }); chartInstancesExt.forEach((obj) => { try { obj.chart && obj.chart.resize(); } catch (_) {} }); });
 
   if (toggleOrientationBtn) {
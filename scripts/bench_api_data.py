@@ -0,0 +1,124 @@
+"""
+Benchmark /api/data payload assembly against synthetic databases.
+
+Builds throwaway SQLite files with a growing number of indicators (fixed
+number of dates per indicator) and times server_scf._query_payload on each.
+For comparison it also times the previous per-indicator (N+1) query loop.
+
+Usage:
+    python scripts/bench_api_data.py [--dates 30] [--repeat 5] [--sizes 50,200,800]
+"""
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import migrate_to_db  # noqa: E402
+import server_scf  # noqa: E402
+
+
+def build_db(path: Path, n_indicators: int, n_dates: int):
+    conn = sqlite3.connect(path)
+    try:
+        migrate_to_db.ensure_schema(conn)
+        cur = conn.cursor()
+        cur.execute('INSERT OR REPLACE INTO patient_meta(patient_id, key, value) VALUES(1,?,?)', ('start_date', '2025-08-08'))
+        cur.execute('INSERT OR REPLACE INTO patient_meta(patient_id, key, value) VALUES(1,?,?)', ('cycle_length_days', '21'))
+        start = date(2025, 8, 6)
+        cur.executemany('INSERT INTO dates(date) VALUES(?)',
+                        [((start + timedelta(days=3 * i)).isoformat(),) for i in range(n_dates)])
+        cur.executemany('INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES(?,?,?,?)',
+                        [(f'指标{i:05d}', '10^9/L', 3.5, 9.5) for i in range(n_indicators)])
+        rows = []
+        for ind_id in range(1, n_indicators + 1):
+            for date_id in range(1, n_dates + 1):
+                v = 2.0 + (ind_id * 7 + date_id * 3) % 10
+                # 约三分之一的点不带标记，走参考范围派生路径
+                flag = None if date_id % 3 == 0 else '-'
+                rows.append((ind_id, date_id, v, flag, flag, None))
+        cur.executemany('INSERT INTO measurements(indicator_id, date_id, value, status, flag, phase) VALUES(?,?,?,?,?,?)', rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def legacy_query_payload(db_path: Path):
+    # 旧实现：逐指标查询 measurements（仅用于对照）
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute('SELECT key, value FROM meta')
+        cur.fetchall()
+        cur.execute('SELECT date FROM dates ORDER BY date')
+        cur.fetchall()
+        cur.execute('SELECT id, name, unit, ref_lower, ref_upper FROM indicators ORDER BY name')
+        indicators = {}
+        for ind in cur.fetchall():
+            cur.execute('''
+                SELECT d.date as date, m.value as value, m.status as status, m.flag as flag, m.phase as phase
+                FROM measurements m JOIN dates d ON m.date_id = d.id
+                WHERE m.indicator_id = ?
+                ORDER BY d.date
+            ''', (ind['id'],))
+            indicators[ind['name']] = [dict(row) for row in cur.fetchall()]
+        return indicators
+    finally:
+        conn.close()
+
+
+def count_statements(fn):
+    # 统计一次调用中执行的 SQL 语句数量
+    counter = {'n': 0}
+    real_connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = real_connect(*args, **kwargs)
+        conn.set_trace_callback(lambda _sql: counter.__setitem__('n', counter['n'] + 1))
+        return conn
+
+    sqlite3.connect = traced_connect
+    try:
+        fn()
+    finally:
+        sqlite3.connect = real_connect
+    return counter['n']
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--dates', type=int, default=30)
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--sizes', default='50,200,800')
+    args = ap.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+
+    print(f'{"indicators":>10} {"points":>8} {"stmts":>6} {"ms":>9} {"us/point":>9} {"legacy stmts":>13} {"legacy ms":>10}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            db_path = Path(tmp) / f'bench_{n}.sqlite3'
+            build_db(db_path, n, args.dates)
+            server_scf.DB_PATH = db_path
+            stmts = count_statements(server_scf._query_payload)
+            t = best_of(server_scf._query_payload, args.repeat)
+            legacy_stmts = count_statements(lambda: legacy_query_payload(db_path))
+            t_legacy = best_of(lambda: legacy_query_payload(db_path), args.repeat)
+            points = n * args.dates
+            print(f'{n:>10} {points:>8} {stmts:>6} {t * 1000:>9.2f} {t * 1e6 / points:>9.2f} {legacy_stmts:>13} {t_legacy * 1000:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Benchmark date_normalizer against the previous date handling.
+
+Generates a million-row stream of raw report dates (few distinct days, spelled
+as YYYY/MM/DD, YYYY.M.D, YYYYMMDD, M/D/YY, with times, padded, invalid and
+free-text values), checks that normalize_date() returns exactly what the
+importer's previous strptime chain returned, and that date_ordinal() agrees
+with the previous datetime sort key wherever that key parsed. Then reports
+the per-row cost of: the previous importer normalizer, the regex dispatch
+without the cache, the memoized normalizer, and sorting by the previous
+datetime key versus the integer key.
+
+Usage:
+    python scripts/bench_dates.py [--rows 1000000] [--days 400] [--repeat 3]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import date_normalizer  # noqa: E402
+
+LEGACY_DATE_FORMATS = [
+    '%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d',
+    '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M', '%Y.%m.%d %H:%M',
+    '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y.%m.%d %H:%M:%S',
+    '%m/%d/%y', '%m/%d/%Y', '%m/%d/%y %H:%M', '%m/%d/%Y %H:%M'
+]
+LEGACY_DATE_RE = re.compile(r'^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:\s+(\d{1,2})(?::(\d{1,2})(?::(\d{1,2}))?)?)?$')
+LEGACY_FALLBACK_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d', '%m/%d/%y', '%m/%d/%Y')
+
+
+def legacy_normalize_date(s: str) -> str:
+    # 旧实现（import_csvs_to_db.normalize_date），仅用于对照
+    s = (s or '').strip()
+    for fmt in LEGACY_DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).strftime('%Y-%m-%d')
+        except Exception:
+            pass
+    m = re.match(r'^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:\s+(\d{1,2})(?::(\d{1,2})(?::(\d{1,2}))?)?)?$', s)
+    if m:
+        y, mo, d, *_ = m.groups()
+        try:
+            return datetime(int(y), int(mo), int(d)).strftime('%Y-%m-%d')
+        except Exception:
+            pass
+    m = re.search(r'(\d{1,2})/(\d{1,2})/(\d{2,4})', s)
+    if m:
+        mm, dd, yy = m.groups()
+        year = int(yy)
+        if year < 100:
+            year = 2000 + year
+        try:
+            return datetime(year, int(mm), int(dd)).strftime('%Y-%m-%d')
+        except Exception:
+            pass
+    return s
+
+
+def legacy_date_key(s: str):
+    # 旧实现（payload_builder.normalize_date_str + date_key），仅用于对照
+    s = (s or '').strip()
+    v = s
+    m = LEGACY_DATE_RE.match(s)
+    if m:
+        try:
+            v = datetime(int(m.group(1)), int(m.group(2)), int(m.group(3))).strftime('%Y-%m-%d')
+        except Exception:
+            m = None
+    if not m:
+        for fmt in LEGACY_FALLBACK_FORMATS:
+            try:
+                v = datetime.strptime(s, fmt).strftime('%Y-%m-%d')
+                break
+            except Exception:
+                continue
+    try:
+        return datetime.strptime(v, '%Y-%m-%d')
+    except Exception:
+        return datetime.max
+
+
+def raw_dates(n: int, n_days: int, seed: int = 5):
+    rnd = random.Random(seed)
+    start = date(2025, 8, 6)
+    variants = set()
+    for i in range(n_days):
+        d = start + timedelta(days=i)
+        variants.update({
+            d.strftime('%Y/%m/%d'), d.isoformat(), '%d.%d.%d' % (d.year, d.month, d.day), d.strftime('%Y%m%d'),
+            '%d/%d/%s' % (d.month, d.day, d.strftime('%y')), d.strftime('%m/%d/%Y'),
+            d.strftime('%Y-%m-%d 08:30'), '%d-%d-%d 8:5:7' % (d.year, d.month, d.day),
+            '%d/%d/%s 8:45' % (d.month, d.day, d.strftime('%y')), ' %s ' % d.isoformat(),
+        })
+    # 无效或非日期写法：走原有 strptime 链或原样返回
+    variants.update({'2025-02-30', '2025/13/01', '20251301', '1/2/70', '1/2/70 25:00', '2025-08- 6',
+                     '采样 10/24/25 8:45', '报告日期', '', '2025年8月6日', '99/99/99'})
+    variants = sorted(variants)
+    # 真实报告中同一批日期反复出现
+    return [rnd.choice(variants) for _ in range(n)], variants
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', type=int, default=1000000)
+    ap.add_argument('--days', type=int, default=400)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    stream, variants = raw_dates(args.rows, args.days)
+    cached = date_normalizer.normalize_date
+    uncached = cached.__wrapped__
+    ordinal = date_normalizer.date_ordinal
+    mismatches = [v for v in variants if uncached(v) != legacy_normalize_date(v)]
+    # 旧排序键只认导出端的格式子集；其余（如 "10/24/25 8:45"）原先一律排在最后
+    key_mismatches = newly_parsed = 0
+    for v in variants:
+        old = legacy_date_key(v)
+        if old == datetime.max:
+            newly_parsed += ordinal(v) != date_normalizer.UNPARSED_ORDINAL
+        elif old.toordinal() != ordinal(v):
+            key_mismatches += 1
+    print(f'{len(variants)} distinct raw dates, {args.rows} rows, normalize mismatches: {len(mismatches)}, '
+          f'sort key mismatches: {key_mismatches} ({newly_parsed} previously unsortable now ordered)')
+
+    def run(fn):
+        for s in stream:
+            fn(s)
+
+    def run_cached():
+        cached.cache_clear()
+        run(cached)
+
+    def sort_legacy():
+        sorted(stream, key=legacy_date_key)
+
+    def sort_ordinal():
+        ordinal.cache_clear()
+        sorted(stream, key=ordinal)
+
+    for label, fn in (('legacy normalize', lambda: run(legacy_normalize_date)),
+                      ('dispatch, no cache', lambda: run(uncached)),
+                      ('dispatch + lru_cache', run_cached),
+                      ('sort, datetime key', sort_legacy),
+                      ('sort, int key cached', sort_ordinal)):
+        t = best_of(fn, args.repeat)
+        print(f'{label:>22}: {t * 1e9 / args.rows:8.0f} ns/row')
+
+
+if __name__ == '__main__':
+    main()
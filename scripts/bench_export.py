@@ -0,0 +1,91 @@
+"""
+Benchmark export_from_db on synthetic databases of growing history.
+
+For each size, builds a throwaway database (bench_api_data.build_db: N
+indicators x --dates dates) and exports it twice into a temp directory:
+with the previous path (build_payload plus trends, then json.dumps(indent=2)
+once per target) and with the streaming export_to_json. Reports wall time and
+tracemalloc peak for both and checks that the written files are identical.
+
+Usage:
+    python scripts/bench_export.py [--dates 365] [--sizes 50,200,800] [--repeat 3]
+"""
+import argparse
+import contextlib
+import io
+import json
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import export_from_db  # noqa: E402
+from export_from_db import with_trends  # noqa: E402
+from bench_api_data import build_db  # noqa: E402
+from payload_builder import build_payload  # noqa: E402
+
+
+def legacy_export(db_path: Path, targets):
+    # 旧实现：整体构建 payload，每个目标各序列化、写入一次（仅用于对照）
+    conn = sqlite3.connect(db_path)
+    try:
+        payload = with_trends(build_payload(conn))
+    finally:
+        conn.close()
+    for path in targets:
+        text = json.dumps(payload, ensure_ascii=False, indent=2)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def streaming_export(db_path: Path, targets):
+    export_from_db.DB_PATH = db_path
+    export_from_db.MANIFEST_PATH = targets[0].with_name('manifest.json')
+    export_from_db.OUT_JSON_DASH, export_from_db.OUT_JSON_DOCS = targets
+    with contextlib.redirect_stdout(io.StringIO()):
+        export_from_db.export_to_json()
+
+
+def measure(fn, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--dates', type=int, default=365)
+    ap.add_argument('--sizes', default='50,200,800')
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for n in [int(s) for s in args.sizes.split(',') if s.strip()]:
+            db_path = tmp / f'bench_{n}.sqlite3'
+            build_db(db_path, n, args.dates)
+            outputs = {}
+            for label, fn in (('legacy', legacy_export), ('streaming', streaming_export)):
+                targets = (tmp / f'{label}_dash.json', tmp / f'{label}_docs.json')
+                best, peak = measure(lambda: fn(db_path, targets), args.repeat)
+                outputs[label] = [p.read_bytes() for p in targets]
+                print(f'{n:5d} indicators x {args.dates} dates  {label:>9}: '
+                      f'{best * 1000:9.1f} ms  peak {peak / 2 ** 20:8.1f} MiB')
+            same = outputs['legacy'][0] == outputs['streaming'][0] == outputs['streaming'][1]
+            print(f'{"":29}identical: {same}, {len(outputs["streaming"][0]) / 2 ** 20:.1f} MiB per file')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Benchmark import_csvs_to_db on a generated corpus of OCR-style CSVs.
+
+Writes --files CSVs (one lab report per file: one date, --rows indicators,
+mixed utf-8-sig/gbk encodings, overlapping dates across files), imports them
+into a fresh database and reports rows/second and SQL statements executed
+per row (parsing is shared by both paths). For comparison it re-runs the
+import with the previous write path: upsert_date()/upsert_indicator() per
+row and the database's default pragmas. Both databases are compared at the end.
+The bulk path is timed once per --jobs value (parser worker processes).
+Finally the incremental path is timed: a re-run with nothing changed, and a
+re-run after one new and one modified report.
+
+Usage:
+    python scripts/bench_import.py [--files 2000] [--rows 30] [--repeat 3] [--jobs 1,2,4]
+"""
+import argparse
+import contextlib
+import csv
+import io
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import import_csvs_to_db  # noqa: E402
+import indicator_names  # noqa: E402
+import migrate_to_db  # noqa: E402
+
+HEADER = ['报告日期', '检测指标', '结果', '单位', '参考值', '状态']
+
+
+def write_corpus(csv_dir: Path, n_files: int, n_rows: int, seed: int = 7):
+    rnd = random.Random(seed)
+    names = sorted(set(indicator_names.INDICATOR_SYNONYMS.values()))
+    names += [f'指标{i:03d}' for i in range(max(0, n_rows - len(names)))]
+    start = date(2024, 1, 1)
+    for i in range(n_files):
+        # 约 1/3 的文件与其他文件同日（补录/复查），走 REPLACE 路径
+        day = start + timedelta(days=rnd.randrange(n_files * 2 // 3 or 1))
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(HEADER)
+        for name in rnd.sample(names, n_rows):
+            v = round(rnd.uniform(0.5, 15.0), 2)
+            status = '↑' if v > 9.5 else ('↓' if v < 3.5 else '')
+            w.writerow([day.strftime('%Y/%m/%d'), name, v, '10^9/L', '3.5-9.5', status])
+        enc = 'gbk' if i % 10 == 0 else 'utf-8-sig'
+        (csv_dir / f'report_{i:05d}.csv').write_bytes(buf.getvalue().encode(enc))
+
+
+class LegacyIds(import_csvs_to_db.IdResolver):
+    # 旧写入路径：每行 upsert_date + upsert_indicator（仅用于对照）；患者解析沿用 IdResolver
+
+    def date_id(self, date_str):
+        return import_csvs_to_db.upsert_date(self.conn, date_str)
+
+    def indicator_id(self, name, unit, ref_lower, ref_upper):
+        return import_csvs_to_db.upsert_indicator(self.conn, name, unit, ref_lower, ref_upper)
+
+
+@contextlib.contextmanager
+def default_pragmas(conn):
+    yield
+
+
+def run_import(db_path: Path, legacy: bool, counter=None, jobs: int = 1, fresh: bool = True) -> float:
+    if fresh:
+        if db_path.exists():
+            db_path.unlink()
+        conn = sqlite3.connect(db_path)
+        migrate_to_db.ensure_schema(conn)
+        conn.close()
+    import_csvs_to_db.DB_PATH = db_path
+    real_connect = sqlite3.connect
+
+    def traced_connect(*a, **kw):
+        # 统计导入过程中执行的 SQL 语句（executemany 的每一行计一次）
+        c = real_connect(*a, **kw)
+        c.set_trace_callback(lambda _sql: counter.__setitem__('n', counter['n'] + 1))
+        return c
+
+    if counter is not None:
+        sqlite3.connect = traced_connect
+    patches = [('IdResolver', LegacyIds), ('bulk_import_pragmas', default_pragmas)] if legacy else []
+    saved = [(name, getattr(import_csvs_to_db, name)) for name, _ in patches]
+    for name, value in patches:
+        setattr(import_csvs_to_db, name, value)
+    try:
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            import_csvs_to_db.import_csvs(jobs=jobs)
+        return time.perf_counter() - t0
+    finally:
+        sqlite3.connect = real_connect
+        for name, value in saved:
+            setattr(import_csvs_to_db, name, value)
+
+
+def dump(db_path: Path):
+    # 按自然键比较：旧路径的 INSERT OR IGNORE 会消耗 AUTOINCREMENT 序号，id 本身不可比
+    conn = sqlite3.connect(db_path)
+    try:
+        return (
+            conn.execute('SELECT name, unit, ref_lower, ref_upper FROM indicators ORDER BY name').fetchall(),
+            conn.execute('SELECT date FROM dates ORDER BY date').fetchall(),
+            conn.execute('''
+                SELECT i.name, d.date, m.value, m.status, m.flag, m.phase
+                FROM measurements m
+                JOIN indicators i ON m.indicator_id = i.id
+                JOIN dates d ON m.date_id = d.id
+                ORDER BY i.name, d.date
+            ''').fetchall(),
+        )
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--files', type=int, default=2000)
+    ap.add_argument('--rows', type=int, default=30)
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--jobs', default='1')
+    args = ap.parse_args()
+    jobs_list = [int(j) for j in args.jobs.split(',') if j.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        csv_dir = tmp / 'csv'
+        csv_dir.mkdir()
+        write_corpus(csv_dir, args.files, args.rows)
+        import_csvs_to_db.CSV_DIR = csv_dir
+        rows = args.files * args.rows
+        print(f'{args.files} files, {rows} rows')
+        results = {}
+        runs = [(f'bulk j={j}' if len(jobs_list) > 1 else 'bulk', False, j) for j in jobs_list]
+        runs.append(('legacy', True, 1))
+        for label, legacy, jobs in runs:
+            db_path = tmp / f'{label.replace(" ", "_").replace("=", "")}.sqlite3'
+            best = min(run_import(db_path, legacy, jobs=jobs) for _ in range(args.repeat))
+            counter = {'n': 0}
+            run_import(db_path, legacy, counter, jobs=jobs)
+            results[label] = db_path
+            print(f'{label:>10}: {best:8.3f} s  {rows / best:10.0f} rows/s  {counter["n"] / rows:5.2f} stmts/row')
+        legacy_dump = dump(results.pop('legacy'))
+        print('identical:', all(dump(p) == legacy_dump for p in results.values()))
+
+        db_path = next(iter(results.values()))
+        t = run_import(db_path, False, fresh=False)
+        print(f'incremental, unchanged: {t * 1000:8.1f} ms')
+        extra = tmp / 'extra'
+        extra.mkdir()
+        write_corpus(extra, 2, args.rows, seed=11)
+        (extra / 'report_00000.csv').replace(csv_dir / 'report_99999.csv')
+        (extra / 'report_00001.csv').replace(csv_dir / 'report_00001.csv')
+        t = run_import(db_path, False, fresh=False)
+        print(f'incremental, +1 new +1 modified: {t * 1000:8.1f} ms')
+        full_path = tmp / 'full.sqlite3'
+        run_import(full_path, False)
+        print('incremental matches full re-import:', dump(db_path) == dump(full_path))
+
+
+if __name__ == '__main__':
+    main()
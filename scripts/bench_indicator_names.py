@@ -0,0 +1,101 @@
+"""
+Microbenchmark indicator_names.canonical_indicator_name.
+
+Generates a stream of raw OCR indicator names (aliases, instrument codes,
+star marks, "(新版)" notes, full-width characters, spacing/case variants),
+checks that the shared canonicalizer returns exactly what the previous
+per-script implementation returned, and reports the per-row cost for the
+previous implementation, the compiled matcher without the cache, and the
+memoized function.
+
+Usage:
+    python scripts/bench_indicator_names.py [--rows 200000] [--repeat 3]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+import unicodedata
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import indicator_names  # noqa: E402
+
+LEGACY_CODES = ['NEUT#', 'NEUT%', 'LYMPH#', 'LYMPH%', 'LYM#', 'LYM%', 'EO#', 'EO%', 'BASO#', 'BASO%', 'MONO#',
+                'MONO%', 'NRBC#', 'NRBC%', 'WBC', 'RBC', 'HGB', 'HCT', 'MCH', 'MCHC', 'MCV', 'PLT', 'MPV', 'PDW',
+                'P-LCR', 'PCT', 'ANC', 'RDW-CV', 'RDW-SD']
+LEGACY_STAR_RE = re.compile(r'[★☆＊*※✱﹡]')
+
+
+def legacy_canonical_indicator_name(name: str) -> str:
+    # 旧实现（import_csvs_to_db / normalize_db_indicators 各自一份），仅用于对照
+    if not name:
+        return ''
+    s = unicodedata.normalize('NFKC', name).strip()
+    s = LEGACY_STAR_RE.sub('', s)
+    s = re.sub(r'（[^）]*?(?:新版|星标|标星)[^）]*）', '', s)
+    s = re.sub(r'\([^)]*?(?:新版|星标|标星)[^)]*\)', '', s)
+    s = s.strip()
+    token = s.upper().replace(' ', '')
+    for code in LEGACY_CODES:
+        if code in token:
+            return indicator_names.INDICATOR_SYNONYMS.get(code.lower(), s)
+    return indicator_names.INDICATOR_SYNONYMS.get(s.lower(), s)
+
+
+def raw_names(n: int, seed: int = 3):
+    rnd = random.Random(seed)
+    base = list(indicator_names.INDICATOR_SYNONYMS) + ['不典型淋巴细胞绝对数', '巨大未成熟细胞绝对值', 'C反应蛋白']
+    variants = set()
+    for name in base:
+        variants.update({
+            name, name.upper(), ' %s ' % name, '★' + name, name + '(新版)', name + '（星标）',
+            # 全角字符，经 NFKC 还原
+            ''.join(chr(ord(c) + 0xFEE0) if '!' <= c <= '~' else c for c in name),
+        })
+    for code in LEGACY_CODES:
+        variants.update({'%s 检测' % code, '*%s' % code.lower(), '%s(新版)' % code})
+    variants = sorted(variants)
+    # 真实数据中同一批名称反复出现
+    return [rnd.choice(variants) for _ in range(n)], variants
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', type=int, default=200000)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    stream, variants = raw_names(args.rows)
+    cached = indicator_names.canonical_indicator_name
+    uncached = cached.__wrapped__
+    mismatches = [v for v in variants if uncached(v) != legacy_canonical_indicator_name(v)]
+    print(f'{len(variants)} distinct raw names, {args.rows} rows, mismatches: {len(mismatches)}')
+
+    def run(fn):
+        for name in stream:
+            fn(name)
+
+    def run_cached():
+        cached.cache_clear()
+        run(cached)
+
+    for label, fn in (('legacy', lambda: run(legacy_canonical_indicator_name)),
+                      ('compiled, no cache', lambda: run(uncached)),
+                      ('compiled + lru_cache', run_cached)):
+        t = best_of(fn, args.repeat)
+        print(f'{label:>22}: {t * 1e9 / args.rows:8.0f} ns/row')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Benchmark normalize_db_indicators.normalize_db on a synthetic database.
+
+Builds --indicators canonical indicators (a third of them missing, so the
+merge has to create them) plus three starred/annotated aliases of each
+("★X", "X(新版)", "X（星标）") with overlapping dates. The conflicts mix
+numeric, text and NULL values with and without arrows, and units and
+reference ranges are partly missing. Runs the set-based merge and the previous
+per-row loop on copies of the same database, checks the results match on
+natural keys, and reports both timings.
+
+Usage:
+    python scripts/bench_normalize_db.py [--indicators 1000] [--dates 60] [--repeat 3]
+"""
+import argparse
+import contextlib
+import io
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import indicator_names  # noqa: E402
+import migrate_to_db  # noqa: E402
+import normalize_db_indicators  # noqa: E402
+
+
+def legacy_score(flag):
+    return 1 if flag in ('↑', '↓') else 0
+
+
+def legacy_normalize(conn):
+    # 旧实现（逐指标、逐行查询），仅用于对照
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+
+    cur.execute('SELECT id, name, unit, ref_lower, ref_upper FROM indicators')
+    inds = cur.fetchall()
+    moved_count = 0
+    deleted_inds = 0
+
+    for ind in inds:
+        ind_id = ind['id']
+        name = ind['name']
+        canon = indicator_names.canonical_indicator_name(name)
+        if canon == name:
+            continue
+
+        # 找到或创建目标标准指标
+        cur.execute('SELECT id, unit, ref_lower, ref_upper FROM indicators WHERE name=?', (canon,))
+        target = cur.fetchone()
+        if target:
+            tgt_id = target['id']
+            tgt_unit, tgt_lower, tgt_upper = target['unit'], target['ref_lower'], target['ref_upper']
+            # 填补缺失的单位与参考范围
+            updates = []
+            if (not tgt_unit) and ind['unit']:
+                updates.append(('unit', ind['unit']))
+            if (tgt_lower is None and tgt_upper is None) and (ind['ref_lower'] is not None or ind['ref_upper'] is not None):
+                updates.append(('ref', (ind['ref_lower'], ind['ref_upper'])))
+            if updates:
+                if any(u[0] == 'unit' for u in updates):
+                    cur.execute('UPDATE indicators SET unit=? WHERE id=?', (ind['unit'], tgt_id))
+                if any(u[0] == 'ref' for u in updates):
+                    cur.execute('UPDATE indicators SET ref_lower=?, ref_upper=? WHERE id=?', (ind['ref_lower'], ind['ref_upper'], tgt_id))
+        else:
+            cur.execute('INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES(?,?,?,?)',
+                        (canon, ind['unit'], ind['ref_lower'], ind['ref_upper']))
+            tgt_id = cur.lastrowid
+
+        # 迁移测量数据：同日冲突时进行优选
+        cur.execute('''
+            SELECT m.id as mid, d.date as date, m.value as value, m.status as status, m.flag as flag, m.phase as phase
+            FROM measurements m JOIN dates d ON m.date_id = d.id
+            WHERE m.indicator_id = ?
+        ''', (ind_id,))
+        src_rows = cur.fetchall()
+        for r in src_rows:
+            # 目标是否已有同日记录
+            cur.execute('''
+                SELECT m.id as mid, d.date as date, m.value as value, m.status as status, m.flag as flag, m.phase as phase
+                FROM measurements m JOIN dates d ON m.date_id = d.id
+                WHERE m.indicator_id = ? AND d.date = ?
+            ''', (tgt_id, r['date']))
+            tgt_row = cur.fetchone()
+            # 获取该日期 id
+            cur.execute('SELECT id FROM dates WHERE date=?', (r['date'],))
+            date_id = cur.fetchone()['id']
+            if not tgt_row:
+                # 直接插入到目标
+                cur.execute('''
+                    INSERT OR REPLACE INTO measurements(indicator_id, date_id, value, status, flag, phase)
+                    VALUES(?,?,?,?,?,?)
+                ''', (tgt_id, date_id, r['value'], r['status'], r['flag'], r['phase']))
+            else:
+                # 优选覆盖策略
+                tgt_is_num = isinstance(tgt_row['value'], (int, float))
+                src_is_num = isinstance(r['value'], (int, float))
+                choose_src = False
+                if src_is_num and not tgt_is_num:
+                    choose_src = True
+                elif src_is_num and tgt_is_num:
+                    if legacy_score(r['flag']) > legacy_score(tgt_row['flag']):
+                        choose_src = True
+                    else:
+                        choose_src = True  # 默认用来源记录更新（认为来源更近）
+                elif not src_is_num and not tgt_is_num:
+                    # 都非数值，优先带箭头
+                    if legacy_score(r['flag']) > legacy_score(tgt_row['flag']):
+                        choose_src = True
+                if choose_src:
+                    cur.execute('''
+                        UPDATE measurements SET value=?, status=?, flag=?, phase=?
+                        WHERE id=?
+                    ''', (r['value'], r['status'], r['flag'], r['phase'], tgt_row['mid']))
+            # 删除源记录
+            cur.execute('DELETE FROM measurements WHERE id=?', (r['mid'],))
+            moved_count += 1
+
+        # 删除源指标
+        cur.execute('DELETE FROM indicators WHERE id=?', (ind_id,))
+        deleted_inds += 1
+
+    conn.commit()
+
+
+def build_db(path: Path, n_indicators: int, n_dates: int, seed: int = 13):
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        migrate_to_db.ensure_schema(conn)
+        conn.executemany('INSERT INTO dates(date) VALUES(?)', [(f'2025-{8 + i // 28:02d}-{1 + i % 28:02d}',)
+                                                               for i in range(n_dates)])
+        ind_id = 0
+        rows = []
+        for i in range(n_indicators):
+            base = f'指标{i:05d}'
+            names = ['★' + base, base + '(新版)', base + '（星标）']
+            if i % 3:
+                names.insert(rnd.randrange(4), base)
+            for name in names:
+                unit = rnd.choice([None, '', 'g/L'])
+                ref = rnd.choice([(None, None), (3.5, None), (3.5, 9.5)])
+                conn.execute('INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES(?,?,?,?)',
+                             (name, unit) + ref)
+                ind_id += 1
+                for date_id in rnd.sample(range(1, n_dates + 1), n_dates // 2):
+                    value = rnd.choice([round(rnd.uniform(1, 12), 2), '阴性', None])
+                    flag = rnd.choice(['↑', '↓', '-', None])
+                    rows.append((ind_id, date_id, value, flag or '', flag, rnd.choice([None, 'C1'])))
+        conn.executemany('INSERT INTO measurements(indicator_id, date_id, value, status, flag, phase) '
+                         'VALUES(?,?,?,?,?,?)', rows)
+        conn.commit()
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def dump(path: Path):
+    conn = sqlite3.connect(path)
+    try:
+        return (
+            conn.execute('SELECT name, unit, ref_lower, ref_upper FROM indicators ORDER BY name').fetchall(),
+            conn.execute('''
+                SELECT i.name, d.date, m.value, m.status, m.flag, m.phase
+                FROM measurements m
+                JOIN indicators i ON m.indicator_id = i.id
+                JOIN dates d ON m.date_id = d.id
+                ORDER BY i.name, d.date
+            ''').fetchall(),
+        )
+    finally:
+        conn.close()
+
+
+def run_legacy(path: Path):
+    conn = sqlite3.connect(path)
+    try:
+        legacy_normalize(conn)
+    finally:
+        conn.close()
+
+
+def run_set_based(path: Path):
+    normalize_db_indicators.DB_PATH = path
+    with contextlib.redirect_stdout(io.StringIO()):
+        normalize_db_indicators.normalize_db()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--indicators', type=int, default=1000)
+    ap.add_argument('--dates', type=int, default=60)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        src = tmp / 'src.sqlite3'
+        n = build_db(src, args.indicators, args.dates)
+        print(f'{args.indicators} canonical indicators, {n} measurements before merge')
+        results = {}
+        for label, fn in (('legacy', run_legacy), ('set-based', run_set_based)):
+            best = float('inf')
+            for _ in range(args.repeat):
+                work = tmp / f'{label}.sqlite3'
+                shutil.copyfile(src, work)
+                t0 = time.perf_counter()
+                fn(work)
+                best = min(best, time.perf_counter() - t0)
+            results[label] = work
+            print(f'{label:>10}: {best * 1000:9.1f} ms')
+        print('identical:', dump(results['legacy']) == dump(results['set-based']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""
+Benchmark process_blood_data.process on a synthetic export with many dates.
+
+Writes a source CSV in the 化疗周期血常规数据.csv layout (--indicators
+indicators x --dates report dates, with some text results, "-" cells, both
+date spellings and varying reference strings), then runs the previous
+dict-based implementation and the matrix-based process() (and, when numpy is
+installed, the same process() on its pure-Python fallback) into separate temp
+directories. Reports the best wall time of --repeat runs and checks that all
+four outputs are byte-identical.
+
+Usage:
+    python scripts/bench_process_blood.py [--indicators 40] [--dates 3000] [--repeat 3]
+"""
+import argparse
+import contextlib
+import csv
+import functools
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict, Counter
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import process_blood_data  # noqa: E402
+from output_manifest import write_outputs as _write_outputs  # noqa: E402
+from process_blood_data import (  # noqa: E402
+    CHEMO_START_DATE, CYCLE_LENGTH_DAYS, FIELDS, REF_RE, canonical_indicator_name, chemo_phase_label,
+    parse_value,
+)
+
+OUTPUT_NAMES = ("化疗周期血常规数据_透视表.csv", "化疗周期血常规数据_异常标记.csv", "参考区间标准化.csv", "data.json")
+STATUSES = ("-", "↑", "↓", "", "↑H", "↓L")
+# main() 中替换为把哈希清单写到临时目录的版本
+write_outputs = _write_outputs
+
+
+def write_source(path: Path, n_indicators: int, n_dates: int, seed: int = 11):
+    rnd = random.Random(seed)
+    start = date(2025, 8, 8) - timedelta(days=n_dates // 2)
+    days = sorted(rnd.sample(range(n_dates * 2), n_dates))
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(FIELDS)
+        for k, off in enumerate(days):
+            d = start + timedelta(days=off)
+            # 两种日期写法都会出现
+            dt = d.strftime("%Y.%m.%d") if k % 7 == 0 else d.isoformat()
+            for i in range(n_indicators):
+                if rnd.random() < 0.1:
+                    continue
+                r = rnd.random()
+                if r < 0.03:
+                    value = "-"
+                elif r < 0.05:
+                    value = "阴性"
+                else:
+                    value = str(round(rnd.uniform(0.1, 20.0), rnd.choice((1, 2, 3))))
+                ref = "3.5~9.5" if rnd.random() < 0.9 else ("4.0~10.0" if i % 3 else "")
+                unit = "10^9/L" if rnd.random() < 0.95 else "g/L"
+                w.writerow([f"R{k:05d}", dt, f"指标{i:03d}", value, rnd.choice(STATUSES), ref, unit])
+
+
+def legacy_parse_date(s: str) -> str:
+    s = s.strip()
+    try:
+        return datetime.strptime(s, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        try:
+            return datetime.strptime(s, "%Y.%m.%d").date().isoformat()
+        except ValueError:
+            return s
+
+
+def legacy_parse_ref_interval(ref_str: str):
+    if not ref_str:
+        return None
+    m = REF_RE.match(ref_str.strip())
+    if not m:
+        return None
+    return float(m.group(1)), float(m.group(2))
+
+
+def legacy_load_rows(src_path):
+    rows = []
+    with open(src_path, "r", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        # Validate header
+        if reader.fieldnames != FIELDS:
+            # try to map by position if header differs slightly
+            mapping = {FIELDS[i]: name for i, name in enumerate(reader.fieldnames or [])}
+        for r in reader:
+            # normalize fields
+            rec = {key: r.get(key, "").strip() for key in FIELDS}
+            rows.append(rec)
+    return rows
+
+
+def legacy_process(src_path, out_dir, dash_path):
+    # 旧实现：按 (指标, 日期) 字典三次遍历，逐点 strptime 推算阶段（仅用于对照）
+    rows = legacy_load_rows(src_path)
+    # Collect sets
+    indicators = []
+    indicator_set = set()
+    dates = set()
+
+    # Data map: (indicator, date) -> {value, status, unit, ref_str}
+    data_map = {}
+
+    # For ref and unit unification
+    unit_counter_by_ind = defaultdict(Counter)
+    ref_counter_by_ind = defaultdict(Counter)
+
+    for r in rows:
+        # 归并到标准指标名称
+        ind = canonical_indicator_name(r["检测指标"].strip())
+        dt_str = legacy_parse_date(r["报告日期"])  # normalized
+        val = parse_value(r["结果"])  # float or str
+        status = r["状态"].strip()
+        ref_str = r["参考值"].strip()
+        unit = r["单位"].strip()
+
+        if ind not in indicator_set:
+            indicator_set.add(ind)
+            indicators.append(ind)
+        dates.add(dt_str)
+
+        key = (ind, dt_str)
+        data_map[key] = {
+            "value": val,
+            "status": status,
+            "unit": unit,
+            "ref_str": ref_str,
+        }
+        if unit:
+            unit_counter_by_ind[ind][unit] += 1
+        if ref_str and legacy_parse_ref_interval(ref_str):
+            ref_counter_by_ind[ind][ref_str] += 1
+
+    sorted_dates = sorted(list(dates))
+
+    # Build unified ref per indicator
+    unified_ref = {}
+    unified_unit = {}
+    for ind in indicators:
+        # unit: most common
+        if unit_counter_by_ind[ind]:
+            unit_common = unit_counter_by_ind[ind].most_common(1)[0][0]
+        else:
+            unit_common = ""
+        unified_unit[ind] = unit_common
+
+        # ref: most common parseable interval
+        ref_common = None
+        if ref_counter_by_ind[ind]:
+            ref_common = ref_counter_by_ind[ind].most_common(1)[0][0]
+        ref_interval = legacy_parse_ref_interval(ref_common) if ref_common else None
+        unified_ref[ind] = {
+            "ref_str": ref_common,
+            "lower": ref_interval[0] if ref_interval else None,
+            "upper": ref_interval[1] if ref_interval else None,
+        }
+
+    # Write pivot CSV
+    pivot_path = os.path.join(out_dir, "化疗周期血常规数据_透视表.csv")
+    with io.StringIO(newline="") as f:
+        writer = csv.writer(f)
+        header = ["检测指标"] + sorted_dates
+        writer.writerow(header)
+        for ind in indicators:
+            row = [ind]
+            for dt_str in sorted_dates:
+                entry = data_map.get((ind, dt_str))
+                if not entry:
+                    row.append("")
+                else:
+                    val = entry["value"]
+                    # keep numeric as string for CSV
+                    if isinstance(val, float):
+                        row.append(f"{val}")
+                    else:
+                        row.append(f"{val}")
+            writer.writerow(row)
+        changed = write_outputs([pivot_path], [f.getvalue().encode("utf-8-sig")])
+
+    # Write abnormal-flag CSV
+    abn_path = os.path.join(out_dir, "化疗周期血常规数据_异常标记.csv")
+    with io.StringIO(newline="") as f:
+        writer = csv.writer(f)
+        header = ["检测指标"] + sorted_dates
+        writer.writerow(header)
+        for ind in indicators:
+            lower = unified_ref[ind]["lower"]
+            upper = unified_ref[ind]["upper"]
+            row = [ind]
+            for dt_str in sorted_dates:
+                entry = data_map.get((ind, dt_str))
+                if not entry:
+                    row.append("")
+                    continue
+                val = entry["value"]
+                status = entry["status"]
+                flag = "-"
+                if isinstance(val, float) and lower is not None and upper is not None:
+                    if val < lower:
+                        flag = "↓"
+                    elif val > upper:
+                        flag = "↑"
+                    else:
+                        flag = "-"
+                else:
+                    # fallback to provided status
+                    flag = status if status in {"-", "↑", "↓"} else "-"
+                row.append(flag)
+            writer.writerow(row)
+        changed += write_outputs([abn_path], [f.getvalue().encode("utf-8-sig")])
+
+    # Write unified reference ranges CSV
+    ref_out_path = os.path.join(out_dir, "参考区间标准化.csv")
+    with io.StringIO(newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["检测指标", "参考下限", "参考上限", "单位", "参考值来源"])
+        for ind in indicators:
+            ur = unified_ref[ind]
+            unit = unified_unit[ind]
+            writer.writerow([
+                ind,
+                ur["lower"] if ur["lower"] is not None else "",
+                ur["upper"] if ur["upper"] is not None else "",
+                unit,
+                ur["ref_str"] if ur["ref_str"] else "",
+            ])
+        changed += write_outputs([ref_out_path], [f.getvalue().encode("utf-8-sig")])
+
+    # Build dashboard JSON
+    dash = {
+        "start_date": CHEMO_START_DATE.isoformat(),
+        "cycle_length_days": CYCLE_LENGTH_DAYS,
+        "dates": sorted_dates,
+        "indicators": {},
+    }
+
+    # Prepare series per indicator
+    for ind in indicators:
+        unit = unified_unit[ind]
+        ur = unified_ref[ind]
+        series = []
+        for dt_str in sorted_dates:
+            entry = data_map.get((ind, dt_str))
+            if not entry:
+                continue
+            val = entry["value"]
+            status = entry["status"]
+            # compute flag using unified ref when available
+            lower = ur["lower"]
+            upper = ur["upper"]
+            flag = status if status in {"-", "↑", "↓"} else "-"
+            if isinstance(val, float) and lower is not None and upper is not None:
+                if val < lower:
+                    flag = "↓"
+                elif val > upper:
+                    flag = "↑"
+                else:
+                    flag = "-"
+            # phase
+            try:
+                d = datetime.strptime(dt_str, "%Y-%m-%d").date()
+                phase = chemo_phase_label(d)
+            except Exception:
+                phase = ""
+            series.append({
+                "date": dt_str,
+                "value": val,
+                "status": status,
+                "flag": flag,
+                "phase": phase,
+            })
+        dash["indicators"][ind] = {
+            "unit": unit,
+            "ref": {
+                "lower": ur["lower"],
+                "upper": ur["upper"],
+            },
+            "series": series,
+        }
+
+    changed += write_outputs([dash_path], [json.dumps(dash, ensure_ascii=False, indent=2)])
+    return changed
+
+
+def run_current(src_path, out_dir, dash_path):
+    process_blood_data.SRC_PATH = str(src_path)
+    process_blood_data.OUT_DIR = str(out_dir)
+    process_blood_data.DASHBOARD_DATA_PATH = str(dash_path)
+    process_blood_data.parse_date.cache_clear()
+    process_blood_data.parse_ref_interval.cache_clear()
+    process_blood_data.process()
+
+
+def run_without_numpy(src_path, out_dir, dash_path):
+    # 同一 process()，走无 numpy 的逐格回退路径
+    process_blood_data._HAS_NUMPY = False
+    try:
+        run_current(src_path, out_dir, dash_path)
+    finally:
+        process_blood_data._HAS_NUMPY = True
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    global write_outputs
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--indicators", type=int, default=40)
+    ap.add_argument("--dates", type=int, default=3000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        src = tmp / "source.csv"
+        write_source(src, args.indicators, args.dates)
+        # 哈希清单写入临时目录，不触碰仓库的 dist/manifest.json；每轮前删除输出，强制完整写入
+        write_outputs = functools.partial(_write_outputs, manifest_path=tmp / "manifest.json")
+        process_blood_data.write_outputs = write_outputs
+        runs = [("legacy", legacy_process), ("current", run_current)]
+        if process_blood_data._HAS_NUMPY:
+            runs.append(("no-numpy", run_without_numpy))
+        results = {}
+        for label, fn in runs:
+            out_dir = tmp / label
+            out_dir.mkdir()
+            dash = out_dir / "data.json"
+
+            def run():
+                for name in OUTPUT_NAMES:
+                    if (out_dir / name).exists():
+                        os.remove(out_dir / name)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    fn(src, out_dir, dash)
+            results[label] = best_of(run, args.repeat)
+            print(f"{label:>8}: {results[label] * 1000:9.1f} ms")
+        for label in list(results)[1:]:
+            same = all((tmp / "legacy" / n).read_bytes() == (tmp / label / n).read_bytes() for n in OUTPUT_NAMES)
+            print(f"{label}: {args.indicators} indicators x {args.dates} dates, "
+                  f"{results['legacy'] / results[label]:.1f}x faster, outputs identical: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Compare query plans and timings before/after migrate_to_db's schema migrations.
+
+Builds a synthetic database with the original (version 0) tables, runs the
+read paths the servers use, then applies migrate_to_db.apply_migrations and
+runs them again. The integer-day variants need the version 2 `dates.day`
+column and only run after migrating.
+
+Usage:
+    python scripts/bench_schema.py [--indicators 200] [--dates 500] [--repeat 5]
+"""
+import argparse
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import migrate_to_db  # noqa: E402
+from payload_builder import SERIES_BY_IDS_SQL, SERIES_SQL  # noqa: E402
+
+PER_INDICATOR_SQL = '''
+    SELECT d.date, m.value, m.status, m.flag, m.phase
+    FROM measurements m JOIN dates d ON m.date_id = d.id
+    WHERE m.indicator_id = ?
+    ORDER BY d.date
+'''
+PER_INDICATOR_DAY_SQL = PER_INDICATOR_SQL.replace('ORDER BY d.date', 'ORDER BY d.day')
+RANGE_SQL = '''
+    SELECT d.date, m.value, m.status, m.flag, m.phase
+    FROM measurements m JOIN dates d ON m.date_id = d.id
+    WHERE m.indicator_id = ? AND d.date BETWEEN ? AND ?
+    ORDER BY d.date
+'''
+RANGE_DAY_SQL = '''
+    SELECT d.date, m.value, m.status, m.flag, m.phase
+    FROM measurements m JOIN dates d ON m.date_id = d.id
+    WHERE m.indicator_id = ? AND d.day BETWEEN ? AND ?
+    ORDER BY d.day
+'''
+
+
+def build_db(path: Path, n_indicators: int, n_dates: int):
+    conn = sqlite3.connect(path)
+    try:
+        # 只建原始表（user_version 0），迁移在计时之间单独执行
+        for ddl in migrate_to_db.SCHEMA['tables']:
+            conn.execute(ddl)
+        start = date(2025, 8, 6)
+        # 日期乱序插入，使 date_id 顺序与日期顺序不一致（接近真实导入）
+        days = [(start + timedelta(days=(i * 7919) % n_dates)).isoformat() for i in range(n_dates)]
+        conn.executemany('INSERT INTO dates(date) VALUES(?)', [(d,) for d in days])
+        conn.executemany('INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES(?,?,?,?)',
+                         [(f'指标{i:05d}', '10^9/L', 3.5, 9.5) for i in range(n_indicators)])
+        rows = ((ind_id, date_id, 2.0 + (ind_id * 7 + date_id * 3) % 10, '-', '-', None)
+                for ind_id in range(1, n_indicators + 1)
+                for date_id in range(1, n_dates + 1))
+        conn.executemany('INSERT INTO measurements(indicator_id, date_id, value, status, flag, phase) VALUES(?,?,?,?,?,?)', rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def plan(conn, sql, params):
+    return '; '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params))
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run_cases(conn, cases, repeat):
+    results = {}
+    for label, sql, params, loops in cases:
+        def run():
+            for _ in range(loops):
+                conn.execute(sql, params).fetchall()
+        results[label] = (plan(conn, sql, params), best_of(run, repeat) * 1000 / loops)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--indicators', type=int, default=200)
+    ap.add_argument('--dates', type=int, default=500)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    lo, hi = '2025-09-01', '2025-10-31'
+    ids = list(range(1, 5))
+    common = [
+        ('full scan (SERIES_SQL)', SERIES_SQL, (), 1),
+        ('4 indicators (SERIES_BY_IDS_SQL)', SERIES_BY_IDS_SQL.format(placeholders=','.join('?' * len(ids))), ids, 20),
+        ('one indicator, ORDER BY date', PER_INDICATOR_SQL, (7,), 100),
+        ('one indicator, date range', RANGE_SQL, (7, lo, hi), 100),
+    ]
+    after_only = [
+        ('one indicator, ORDER BY day', PER_INDICATOR_DAY_SQL, (7,), 100),
+        ('one indicator, day range', RANGE_DAY_SQL, (7, migrate_to_db.date_day(lo), migrate_to_db.date_day(hi)), 100),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / 'bench.sqlite3'
+        build_db(db_path, args.indicators, args.dates)
+        conn = sqlite3.connect(db_path)
+        try:
+            n = conn.execute('SELECT COUNT(*) FROM measurements').fetchone()[0]
+            print(f'{n} measurements ({args.indicators} indicators x {args.dates} dates)\n')
+            before = run_cases(conn, common, args.repeat)
+            t0 = time.perf_counter()
+            migrate_to_db.apply_migrations(conn)
+            print(f'migrated to user_version {conn.execute("PRAGMA user_version").fetchone()[0]} '
+                  f'in {(time.perf_counter() - t0) * 1000:.1f} ms\n')
+            after = run_cases(conn, common + after_only, args.repeat)
+        finally:
+            conn.close()
+
+    for label, (plan_after, ms_after) in after.items():
+        print(label)
+        if label in before:
+            plan_before, ms_before = before[label]
+            print(f'  before {ms_before:9.3f} ms  {plan_before}')
+        print(f'  after  {ms_after:9.3f} ms  {plan_after}')
+
+
+if __name__ == '__main__':
+    main()
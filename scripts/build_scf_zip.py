@@ -3,21 +3,97 @@ Package SCF function code into a zip for upload.
 
 Outputs dist/scf.zip containing:
 - scripts/server_scf.py (entry: main_handler)
-- db/zhl.sqlite3 (data file)
+- scripts/payload_builder.py (shared payload assembly)
+- scripts/http_encoding.py (Accept-Encoding negotiation)
+- scripts/date_normalizer.py (date normalization and sort keys)
+- scripts/chemo_cycles.py (cycle schedule and phase labels)
+- scripts/trends.py (LOESS / linear trends; pure-Python path, no NumPy in the zip)
+- scripts/cycle_summary.py (/api/cycles, read from the cycle_summaries table)
+- scripts/patients.py (patients dimension; /api/patients)
+- scripts/indicator_names.py + indicator_synonyms.json (name canonicalization)
+- db/zhl.sqlite3 (data file; a consistent snapshot upgraded to the current
+  schema and switched to rollback-journal mode, since the function opens it
+  read-only/immutable with no -wal/-shm files)
+- db/api_data.json[.gz|.br] + db/api_data.etag (/api/data response of the
+  default patient rendered at build time; the DB in the zip is immutable, so
+  the function serves these bytes directly instead of querying SQLite; other
+  patients are built from the DB on first request)
+- db/api_data.<format>.json[.gz|.br] + .etag for the other formats
+  (e.g. ?format=columnar) and for the /api/indicators metadata view
+  (db/api_data.indicators.*) and the /api/trends view (db/api_data.trends.*)
 
 You can upload this zip via Tencent Cloud SCF console or API.
 """
 import os
+import sqlite3
+import tempfile
 from pathlib import Path
 import zipfile
 
+from cycle_summary import refresh_stale_cycle_summaries
+from http_encoding import compress_variants
+from migrate_to_db import apply_migrations
+from payload_builder import VIEWS, CachedPayload, build_payload, serialize_payload
+
 BASE = Path(__file__).resolve().parent.parent
 DIST = BASE / 'dist'
 
 FILES = [
     (BASE / 'scripts' / 'server_scf.py', 'server_scf.py'),
-    (BASE / 'db' / 'zhl.sqlite3', 'db/zhl.sqlite3'),
+    (BASE / 'scripts' / 'payload_builder.py', 'payload_builder.py'),
+    (BASE / 'scripts' / 'http_encoding.py', 'http_encoding.py'),
+    (BASE / 'scripts' / 'date_normalizer.py', 'date_normalizer.py'),
+    (BASE / 'scripts' / 'chemo_cycles.py', 'chemo_cycles.py'),
+    (BASE / 'scripts' / 'trends.py', 'trends.py'),
+    (BASE / 'scripts' / 'cycle_summary.py', 'cycle_summary.py'),
+    (BASE / 'scripts' / 'patients.py', 'patients.py'),
+    (BASE / 'scripts' / 'indicator_names.py', 'indicator_names.py'),
+    (BASE / 'scripts' / 'indicator_synonyms.json', 'indicator_synonyms.json'),
 ]
+DB_PATH = BASE / 'db' / 'zhl.sqlite3'
+DB_ARC = 'db/zhl.sqlite3'
+PREBUILT_ARC = 'db/api_data'
+
+def snapshot_db(dst: Path):
+    """Copy the DB (including pages still in its WAL) into one self-contained
+    file at the current schema version."""
+    src = sqlite3.connect(DB_PATH.resolve().as_uri() + '?mode=ro', uri=True)
+    out = sqlite3.connect(dst)
+    try:
+        src.backup(out)
+        # 本地库可能尚未升级：在副本上补齐迁移，函数端只读打开无法迁移
+        apply_migrations(out)
+        # 从未生成过周期汇总的旧库在副本上补建
+        refresh_stale_cycle_summaries(out)
+        out.commit()
+        # 本地库为 WAL 模式；打包副本改回 rollback journal，只读打开时无需 -wal/-shm
+        out.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        out.close()
+        src.close()
+
+def render_api_data(db_path: Path):
+    """Render /api/data (and derived views) from the DB being packaged: {format: (CachedPayload, {encoding: bytes})}."""
+    conn = sqlite3.connect(db_path.resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        payload = build_payload(conn)
+    finally:
+        conn.close()
+    rendered = {}
+    for fmt, transform in VIEWS.items():
+        entry = CachedPayload(serialize_payload(transform(payload)))
+        rendered[fmt] = (entry, compress_variants(entry.body))
+    return rendered
+
+def prebuilt_files(rendered):
+    """(archive name, bytes, already compressed) of every prebuilt response file."""
+    exts = {'gzip': '.json.gz', 'br': '.json.br'}
+    for fmt, (entry, variants) in rendered.items():
+        stem = PREBUILT_ARC if fmt == 'full' else f'{PREBUILT_ARC}.{fmt}'
+        yield stem + '.json', entry.body, False
+        yield stem + '.etag', entry.etag.encode('utf-8'), False
+        for enc, data in variants.items():
+            yield stem + exts[enc], data, True
 
 def main():
     DIST.mkdir(exist_ok=True)
@@ -27,6 +103,18 @@ def main():
             if not src.exists():
                 raise FileNotFoundError(f'Missing: {src}')
             z.write(src, arcname=arc)
+        if not DB_PATH.exists():
+            raise FileNotFoundError(f'Missing: {DB_PATH}')
+        with tempfile.TemporaryDirectory() as tmp:
+            snap = Path(tmp) / DB_PATH.name
+            snapshot_db(snap)
+            z.write(snap, arcname=DB_ARC)
+            rendered = render_api_data(snap)
+        for arc, data, compressed in prebuilt_files(rendered):
+            # 已压缩的内容直接存储，避免二次 deflate
+            z.writestr(arc, data, compress_type=zipfile.ZIP_STORED if compressed else zipfile.ZIP_DEFLATED)
+            if not arc.endswith('.etag'):
+                print(f'Prebuilt {arc}:', len(data), 'bytes')
     print('Built:', out)
 
 if __name__ == '__main__':
@@ -0,0 +1,114 @@
+"""
+Build a fingerprinted copy of the static site for long-lived caching.
+
+Copies SRC (default docs/) to OUT and:
+- renames *.js / *.css to name.<hash>.ext (first 10 hex of the sha256 of the
+  content) and rewrites the matching src/href references in every *.html;
+- renames data.json to data.<hash>.json and writes a small data-manifest.json
+  next to it ({"data": "data.<hash>.json"}), which app.js reads before falling
+  back to ./data.json;
+- leaves api_base.js (replaced per environment at deploy time), *.html and
+  everything else under their original names.
+
+Fingerprinted files never change under a given name, so deploy_cos serves
+them with IMMUTABLE_CACHE_CONTROL. The HTML pages and data-manifest.json stay
+no-cache, so a repeat visit only revalidates those.
+
+Usage:
+    python scripts/build_static.py [SRC] [OUT]    # default: docs/ -> dist/site/
+"""
+import argparse
+import hashlib
+import json
+import posixpath
+import re
+import shutil
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent.parent
+DOCS_DIR = BASE / 'docs'
+OUT_DIR = BASE / 'dist' / 'site'
+
+HASH_LEN = 10
+FINGERPRINT_EXTS = {'.js', '.css'}
+# 按环境覆盖的配置脚本，必须保持原名且短缓存
+UNHASHED_NAMES = {'api_base.js', 'api_base.template.js'}
+DATA_NAME = 'data.json'
+DATA_MANIFEST_NAME = 'data-manifest.json'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SHORT_CACHE_CONTROL = 'no-cache'
+
+FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{%d}\.(?:js|css|json)$' % HASH_LEN)
+# 相对路径引用（不含协议、协议相对 // 与 data: 等）
+REF_RE = re.compile(r'''(\b(?:src|href)\s*=\s*["'])(?!(?:[a-zA-Z][\w+.-]*:|//|#))([^"'?#]+)([^"']*["'])''')
+
+
+def cache_control_for(key: str) -> str:
+    """Cache-Control for an object key produced by build()."""
+    return IMMUTABLE_CACHE_CONTROL if FINGERPRINT_RE.search(key) else SHORT_CACHE_CONTROL
+
+
+def fingerprint_name(name: str, data: bytes) -> str:
+    stem, _dot, ext = name.rpartition('.')
+    return '%s.%s.%s' % (stem, hashlib.sha256(data).hexdigest()[:HASH_LEN], ext)
+
+
+def rewrite_html(text: str, html_rel: str, renamed: dict) -> str:
+    base_dir = posixpath.dirname(html_rel)
+
+    def repl(m):
+        ref = m.group(2)
+        target = posixpath.normpath(posixpath.join(base_dir, ref))
+        new = renamed.get(target)
+        if new is None:
+            return m.group(0)
+        head, _sep, _old = ref.rpartition('/')
+        return m.group(1) + (head + '/' if head else '') + posixpath.basename(new) + m.group(3)
+    return REF_RE.sub(repl, text)
+
+
+def build(src: Path = DOCS_DIR, out: Path = OUT_DIR) -> dict:
+    """Build src into out (replacing it); returns {original rel path: built rel path}."""
+    src, out = Path(src), Path(out)
+    if out.exists():
+        shutil.rmtree(out)
+    out.mkdir(parents=True)
+    renamed = {}
+    pages = []
+    for p in sorted(src.rglob('*')):
+        if not p.is_file():
+            continue
+        rel = p.relative_to(src).as_posix()
+        if p.suffix == '.html':
+            pages.append(rel)
+            continue
+        data = p.read_bytes()
+        name = p.name
+        if (p.suffix in FINGERPRINT_EXTS and name not in UNHASHED_NAMES) or name == DATA_NAME:
+            name = fingerprint_name(name, data)
+            renamed[rel] = posixpath.join(posixpath.dirname(rel), name)
+        dst = out / posixpath.dirname(rel) / name
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        dst.write_bytes(data)
+        if p.name == DATA_NAME:
+            (dst.parent / DATA_MANIFEST_NAME).write_text(json.dumps({'data': name}) + '\n', encoding='utf-8')
+    for rel in pages:
+        text = (src / rel).read_text(encoding='utf-8')
+        (out / rel).parent.mkdir(parents=True, exist_ok=True)
+        (out / rel).write_text(rewrite_html(text, rel, renamed), encoding='utf-8')
+    return renamed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('src', nargs='?', type=Path, default=DOCS_DIR)
+    ap.add_argument('out', nargs='?', type=Path, default=OUT_DIR)
+    args = ap.parse_args()
+    renamed = build(args.src, args.out)
+    for old, new in sorted(renamed.items()):
+        print(f'{old} -> {new}')
+    print(f'Built: {args.out}')
+
+
+if __name__ == '__main__':
+    main()
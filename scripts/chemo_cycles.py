@@ -0,0 +1,204 @@
+"""
+Chemotherapy schedule: actual cycle start dates and the phase labels derived
+from them.
+
+Phase labels ("第N次化疗dM") used to be start_date + k * cycle_length_days
+arithmetic, stored on every measurements row, so a delayed cycle or a dose
+hold meant wrong labels and an UPDATE per point to fix them. The cycles
+table records the date each cycle was actually given; a date's cycle is the
+last start on or before it, found by bisecting the sorted starts (NumPy
+searchsorted for many dates at once). Past the last recorded start, further
+cycles are projected every cycle_length_days, so a schedule holding only
+start_date reproduces the old arithmetic exactly.
+
+Labels are assigned when a payload is built (payload_builder), so editing
+the schedule re-labels every point with no write to measurements; the stored
+measurements.phase is only used when there is no schedule at all. Each
+patient has their own schedule (cycles.patient_id, patient_meta).
+
+Usage:
+    python scripts/chemo_cycles.py                       # print the schedule
+    python scripts/chemo_cycles.py --set 2025-08-08 2025-08-29 2025-09-22
+    python scripts/chemo_cycles.py --add 2025-10-14
+    python scripts/chemo_cycles.py --remove 2025-10-14
+    python scripts/chemo_cycles.py --patient 2 --set 2025-09-01 --cycle-length 14
+
+Kept compatible with the SCF Python 3.7 runtime (the module ships in the zip).
+"""
+import argparse
+import sqlite3
+from bisect import bisect_right
+from datetime import date
+from pathlib import Path
+
+from date_normalizer import UNPARSED_ORDINAL, date_ordinal
+from patients import DEFAULT_PATIENT_ID, patient_meta, set_patient_meta
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+BASE = Path(__file__).resolve().parent.parent
+DB_PATH = BASE / 'db' / 'zhl.sqlite3'
+
+PRE_CHEMO_LABEL = '首次化疗前'
+
+CYCLE_STARTS_SQL = 'SELECT start_date FROM cycles WHERE patient_id=?'
+
+
+def phase_label(cycle: int, day: int) -> str:
+    return PRE_CHEMO_LABEL if cycle == 0 else '第%d次化疗d%d' % (cycle, day)
+
+
+class CycleSchedule:
+    """Sorted cycle start ordinals plus the nominal cycle length used to
+    project cycles after the last recorded start (None: the last cycle runs
+    on indefinitely)."""
+
+    __slots__ = ('starts', 'length')
+
+    def __init__(self, starts, length=None):
+        self.starts = sorted(set(starts))
+        self.length = length if length and length > 0 else None
+
+    @classmethod
+    def from_conn(cls, conn: sqlite3.Connection, patient_id: int = DEFAULT_PATIENT_ID):
+        """A patient's schedule from the cycles table, falling back to their
+        start_date when no cycle is recorded; None without either."""
+        meta = patient_meta(conn, patient_id)
+        try:
+            length = int(meta.get('cycle_length_days') or 0)
+        except ValueError:
+            length = 0
+        starts = [date_ordinal(d) for (d,) in conn.execute(CYCLE_STARTS_SQL, (patient_id,))]
+        if not starts:
+            starts = [date_ordinal(meta.get('start_date') or '')]
+        starts = [o for o in starts if o != UNPARSED_ORDINAL]
+        return cls(starts, length) if starts else None
+
+    def start_dates(self) -> list:
+        return [date.fromordinal(o).isoformat() for o in self.starts]
+
+    def locate(self, ordinal: int):
+        """(cycle, day in cycle) of a date ordinal; (0, 0) before the first start."""
+        i = bisect_right(self.starts, ordinal)
+        if i == 0:
+            return 0, 0
+        offset = ordinal - self.starts[i - 1]
+        if i == len(self.starts) and self.length:
+            extra, offset = divmod(offset, self.length)
+            return i + extra, offset + 1
+        return i, offset + 1
+
+    def locate_many(self, ordinals):
+        """locate() over a sequence of ordinals in one vectorized pass;
+        returns (cycles, days) lists."""
+        if not _HAS_NUMPY:
+            pairs = [self.locate(o) for o in ordinals]
+            return [c for c, _d in pairs], [d for _c, d in pairs]
+        starts = np.asarray(self.starts, dtype=np.int64)
+        x = np.asarray(ordinals, dtype=np.int64)
+        i = np.searchsorted(starts, x, side='right')
+        offset = x - starts[np.maximum(i - 1, 0)]
+        cycles = i.copy()
+        if self.length:
+            # 最后一个已记录周期之后按名义周期长度顺延
+            last = i == len(starts)
+            cycles = np.where(last, i + offset // self.length, i)
+            offset = np.where(last, offset % self.length, offset)
+        days = np.where(i == 0, 0, offset + 1)
+        return cycles.tolist(), days.tolist()
+
+    def bounds(self, cycle: int):
+        """(first, last) ordinal of a cycle >= 1, inclusive; last is None
+        for an open-ended final cycle."""
+        n = len(self.starts)
+        if cycle < n:
+            return self.starts[cycle - 1], self.starts[cycle] - 1
+        if not self.length:
+            return self.starts[-1], None
+        first = self.starts[-1] + (cycle - n) * self.length
+        return first, first + self.length - 1
+
+    def labels(self, date_strs) -> dict:
+        """{date string: phase label} for the parseable ones."""
+        dated = [(s, date_ordinal(s)) for s in date_strs]
+        dated = [(s, o) for s, o in dated if o != UNPARSED_ORDINAL]
+        cycles, days = self.locate_many([o for _s, o in dated])
+        return {s: phase_label(c, d) for (s, _o), c, d in zip(dated, cycles, days)}
+
+    def basis(self) -> str:
+        """Text identifying the schedule; cached results derived from it are
+        stale when this changes."""
+        return '%s:%s' % (','.join(str(o) for o in self.starts), self.length or '')
+
+
+def seed_cycles(conn: sqlite3.Connection, patient_id: int = DEFAULT_PATIENT_ID):
+    """Record the patient's start_date as their first cycle when no cycle is
+    recorded yet."""
+    if conn.execute('SELECT 1 FROM cycles WHERE patient_id=? LIMIT 1', (patient_id,)).fetchone():
+        return
+    start = patient_meta(conn, patient_id).get('start_date')
+    if start and date_ordinal(start) != UNPARSED_ORDINAL:
+        conn.execute('INSERT INTO cycles(patient_id, start_date) VALUES(?,?)',
+                     (patient_id, date.fromordinal(date_ordinal(start)).isoformat()))
+
+
+def set_schedule(conn: sqlite3.Connection, start_dates, patient_id: int = DEFAULT_PATIENT_ID):
+    """Replace a patient's recorded cycle starts; their start_date follows
+    the first one."""
+    ordinals = sorted({date_ordinal(s) for s in start_dates})
+    if not ordinals or ordinals[-1] == UNPARSED_ORDINAL:
+        raise ValueError('invalid cycle start date in %r' % (list(start_dates),))
+    conn.execute('DELETE FROM cycles WHERE patient_id=?', (patient_id,))
+    conn.executemany('INSERT INTO cycles(patient_id, start_date) VALUES(?,?)',
+                     [(patient_id, date.fromordinal(o).isoformat()) for o in ordinals])
+    set_patient_meta(conn, patient_id, 'start_date', date.fromordinal(ordinals[0]).isoformat())
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Show or edit the chemotherapy cycle start dates.')
+    group = ap.add_mutually_exclusive_group()
+    group.add_argument('--set', nargs='+', metavar='DATE', help='replace the schedule with these start dates')
+    group.add_argument('--add', nargs='+', metavar='DATE', help='record additional start dates')
+    group.add_argument('--remove', nargs='+', metavar='DATE', help='drop recorded start dates')
+    ap.add_argument('--patient', type=int, default=DEFAULT_PATIENT_ID, help='patient id (default: %(default)s)')
+    ap.add_argument('--cycle-length', type=int, metavar='DAYS', help='nominal cycle length used past the last start')
+    args = ap.parse_args()
+
+    # 迁移与汇总依赖本模块，延迟导入避免循环
+    from cycle_summary import update_cycle_summaries
+    from migrate_to_db import apply_migrations
+    from patients import patient_exists, touch_patients
+    pid = args.patient
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        apply_migrations(conn)
+        if not patient_exists(conn, pid):
+            raise SystemExit('unknown patient id: %d' % pid)
+        current = [d for (d,) in conn.execute(CYCLE_STARTS_SQL, (pid,))]
+        if args.set or args.add or args.remove or args.cycle_length:
+            if args.set:
+                set_schedule(conn, args.set, pid)
+            elif args.add:
+                set_schedule(conn, current + args.add, pid)
+            elif args.remove:
+                drop = {date_ordinal(d) for d in args.remove}
+                set_schedule(conn, [d for d in current if date_ordinal(d) not in drop], pid)
+            if args.cycle_length:
+                set_patient_meta(conn, pid, 'cycle_length_days', str(args.cycle_length))
+            # 阶段标签在读取时计算，无需改写 measurements；周期汇总随新排期重建
+            update_cycle_summaries(conn, pid)
+            touch_patients(conn, [pid])
+            conn.commit()
+        schedule = CycleSchedule.from_conn(conn, pid)
+        for i, d in enumerate(schedule.start_dates() if schedule else [], 1):
+            print('cycle %d: %s' % (i, d))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Per-cycle summaries of every indicator, materialized in SQLite.
+
+Phase labels ("第N次化疗dM") only exist as strings on each point, so any
+per-cycle question meant re-scanning whole series. cycle_summaries keeps one
+row per (patient, indicator, cycle):
+
+- n_points, first_day / last_day: numeric measurements in the cycle and the
+  day-in-cycle (1-based, the dM of the phase label) of the first and last;
+- nadir_value / nadir_day: lowest value and its day (earliest on ties);
+- days_below: days under the reference lower limit, interpolating linearly
+  between measurements (nothing is extrapolated past the first or last
+  measurement of the cycle);
+- recovery_days: days from the nadir until the interpolated series is back
+  at the lower limit within the same cycle (None if it is not, or if the
+  nadir is not below the limit);
+- auc: trapezoidal area under the measured values, in value x days.
+
+Cycles follow the patient's chemo_cycles schedule, the same one the phase
+labels use; points before the first cycle are not summarized. A row depends
+only on its own cycle's points, so imports refresh just the (indicator,
+cycle) pairs they touched (update_cycle_summaries). A changed schedule is
+detected from the basis stored in patient_meta and triggers a rebuild of
+that patient; a changed lower limit re-summarizes that indicator. Schema
+migrations never call into this module: readers of a freshly upgraded
+database run refresh_stale_cycle_summaries() first.
+
+cycles_view() renders /api/cycles from the table in O(cycles). Kept
+compatible with the SCF Python 3.7 runtime (the module ships in the zip).
+"""
+import sqlite3
+from datetime import date
+
+from chemo_cycles import CycleSchedule
+from date_normalizer import JULIAN_DAY_OFFSET, UNPARSED_ORDINAL
+from patients import DEFAULT_PATIENT_ID, patient_meta, set_patient_meta
+from payload_builder import ABNORMAL_FLAGS, canonical_name, derive_flag, normalize_flag, normalize_ref
+
+# patient_meta 中记录汇总所依据的排期（CycleSchedule.basis），与当前排期不一致时重建该患者
+BASIS_KEY = 'cycle_summary_basis'
+SUMMARY_DECIMALS = 4
+MAX_DAY = UNPARSED_ORDINAL + JULIAN_DAY_OFFSET
+
+INSERT_SQL = '''
+    INSERT OR REPLACE INTO cycle_summaries(patient_id, indicator_id, cycle, n_points, first_day, last_day,
+        nadir_value, nadir_day, days_below, recovery_days, auc, ref_lower)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
+'''
+# 同日多行（日期写法不同）按 d.date 排序后再按 build_payload 的规则取舍
+POINTS_SQL = '''
+    SELECT m.indicator_id, d.day, m.value, m.flag
+    FROM measurements m
+    JOIN dates d ON d.id = m.date_id
+    WHERE m.patient_id = ? AND d.day >= ? AND typeof(m.value) IN ('integer', 'real')
+    ORDER BY m.indicator_id, d.day, d.date
+'''
+RANGE_POINTS_SQL = '''
+    SELECT m.indicator_id, d.day, m.value, m.flag
+    FROM measurements m
+    JOIN dates d ON d.id = m.date_id
+    WHERE m.patient_id = ? AND m.indicator_id = ? AND d.day BETWEEN ? AND ?
+      AND typeof(m.value) IN ('integer', 'real')
+    ORDER BY d.day, d.date
+'''
+CYCLES_SQL = '''
+    SELECT i.name, i.unit, i.ref_lower, i.ref_upper, s.cycle, s.n_points, s.first_day, s.last_day,
+           s.nadir_value, s.nadir_day, s.days_below, s.recovery_days, s.auc
+    FROM cycle_summaries s
+    JOIN indicators i ON i.id = s.indicator_id
+    WHERE s.patient_id = ?
+    ORDER BY i.name, s.cycle
+'''
+
+
+def _round(v):
+    return None if v is None else round(v, SUMMARY_DECIMALS)
+
+
+def _time_below(x0, y0, x1, y1, lower):
+    # 线段 (x0, y0)-(x1, y1) 中低于下限的时长
+    if y0 < lower and y1 < lower:
+        return x1 - x0
+    if y0 >= lower and y1 >= lower:
+        return 0.0
+    t = (lower - y0) / (y1 - y0) * (x1 - x0)
+    return t if y0 < lower else (x1 - x0) - t
+
+
+def summarize_cycle(points, lower=None):
+    """Summary of one cycle's numeric points [(day_in_cycle, value), ...]
+    sorted by day, as a dict of the cycle_summaries columns; None if empty."""
+    if not points:
+        return None
+    nadir_day, nadir = min(points, key=lambda p: (p[1], p[0]))
+    auc = 0.0
+    below = None if lower is None else 0.0
+    recovery = None
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        auc += (y0 + y1) / 2 * (x1 - x0)
+        if lower is None:
+            continue
+        below += _time_below(x0, y0, x1, y1, lower)
+        # 谷值之后首次回到下限的插值时刻
+        if recovery is None and x0 >= nadir_day and y0 < lower <= y1:
+            recovery = x0 + (lower - y0) / (y1 - y0) * (x1 - x0) - nadir_day
+    return {
+        'n_points': len(points),
+        'first_day': points[0][0],
+        'last_day': points[-1][0],
+        'nadir_value': nadir,
+        'nadir_day': nadir_day,
+        'days_below': _round(below),
+        'recovery_days': _round(recovery),
+        'auc': _round(auc),
+    }
+
+
+def _basis_text(schedule):
+    return '' if schedule is None else schedule.basis()
+
+
+def _cycle_days(schedule, cycle):
+    # 周期的首末儒略日（含）；开放的最后一个周期末日为 MAX_DAY
+    first, last = schedule.bounds(cycle)
+    return first + JULIAN_DAY_OFFSET, MAX_DAY if last is None else last + JULIAN_DAY_OFFSET
+
+
+def _refs(conn) -> dict:
+    return {ind_id: normalize_ref(lower, upper)
+            for ind_id, lower, upper in conn.execute('SELECT id, ref_lower, ref_upper FROM indicators')}
+
+
+def _abnormal(value, flag, ref) -> bool:
+    # 与 build_payload 一致：原始标记为空时按参考范围推断
+    norm = normalize_flag(flag)
+    if not norm:
+        norm = derive_flag(value, ref.get('lower'), ref.get('upper'))
+    return norm in ABNORMAL_FLAGS
+
+
+def _rows(patient_id, points, schedule, refs):
+    """A patient's cycle_summaries rows from (indicator_id, day, value, flag)
+    tuples ordered by indicator and day, all on or after the first cycle start."""
+    out = []
+    group = None
+    by_day = {}
+
+    def flush():
+        if group is None:
+            return
+        ind_id, cycle = group
+        ref = refs.get(ind_id) or {}
+        first = _cycle_days(schedule, cycle)[0]
+        s = summarize_cycle([(day - first + 1, v) for day, (v, _f) in sorted(by_day.items())], ref.get('lower'))
+        out.append((patient_id, ind_id, cycle, s['n_points'], s['first_day'], s['last_day'], s['nadir_value'],
+                    s['nadir_day'], s['days_below'], s['recovery_days'], s['auc'], ref.get('lower')))
+
+    for ind_id, day, value, flag in points:
+        key = (ind_id, schedule.locate(day - JULIAN_DAY_OFFSET)[0])
+        if key != group:
+            flush()
+            group = key
+            by_day = {}
+        prev = by_day.get(day)
+        ref = refs.get(ind_id) or {}
+        # 同日两点均为数值：带异常标记者优先，同等时取后者（同 payload_builder._prefer）
+        if prev is None or _abnormal(value, flag, ref) >= _abnormal(prev[0], prev[1], ref):
+            by_day[day] = (value, flag)
+    flush()
+    return out
+
+
+def _rebuild_patient(conn, patient_id, refs) -> int:
+    conn.execute('DELETE FROM cycle_summaries WHERE patient_id=?', (patient_id,))
+    schedule = CycleSchedule.from_conn(conn, patient_id)
+    set_patient_meta(conn, patient_id, BASIS_KEY, _basis_text(schedule))
+    if schedule is None:
+        return 0
+    points = conn.execute(POINTS_SQL, (patient_id, _cycle_days(schedule, 1)[0]))
+    rows = _rows(patient_id, points, schedule, refs)
+    conn.executemany(INSERT_SQL, rows)
+    return len(rows)
+
+
+def rebuild_cycle_summaries(conn: sqlite3.Connection, patient_id: int = None) -> int:
+    """Recompute a patient's summaries (every patient's when None) from
+    measurements; returns the row count. Runs in the caller's transaction."""
+    refs = _refs(conn)
+    if patient_id is not None:
+        return _rebuild_patient(conn, patient_id, refs)
+    conn.execute('DELETE FROM cycle_summaries')
+    return sum(_rebuild_patient(conn, pid, refs) for (pid,) in conn.execute('SELECT id FROM patients').fetchall())
+
+
+def refresh_stale_cycle_summaries(conn: sqlite3.Connection) -> list:
+    """Rebuild every patient whose summaries were not made from their current
+    schedule (e.g. never built on a freshly upgraded database); returns their
+    ids. Runs in the caller's transaction."""
+    stale = [pid for (pid,) in conn.execute('SELECT id FROM patients').fetchall()
+             if patient_meta(conn, pid).get(BASIS_KEY) != _basis_text(CycleSchedule.from_conn(conn, pid))]
+    for pid in stale:
+        rebuild_cycle_summaries(conn, pid)
+    return stale
+
+
+def update_cycle_summaries(conn: sqlite3.Connection, patient_id: int = DEFAULT_PATIENT_ID,
+                           keys=(), indicator_ids=()) -> int:
+    """Refresh a patient's cycles touched by ``keys`` ((indicator_id, Julian
+    day) of changed or deleted measurements) and every cycle of
+    ``indicator_ids``.
+
+    Rebuilds the patient when their cycle schedule changed since the last
+    refresh, re-summarizes indicators whose lower limit changed and drops
+    rows of deleted indicators. Returns the number of (indicator, cycle)
+    pairs refreshed; runs in the caller's transaction.
+    """
+    schedule = CycleSchedule.from_conn(conn, patient_id)
+    if patient_meta(conn, patient_id).get(BASIS_KEY) != _basis_text(schedule):
+        return rebuild_cycle_summaries(conn, patient_id)
+    if schedule is None:
+        return 0
+    start = _cycle_days(schedule, 1)[0]
+    conn.execute('DELETE FROM cycle_summaries WHERE indicator_id NOT IN (SELECT id FROM indicators)')
+    refs = _refs(conn)
+    whole = set(indicator_ids)
+    whole.update(ind_id for ind_id, lower in conn.execute(
+        'SELECT DISTINCT indicator_id, ref_lower FROM cycle_summaries WHERE patient_id=?', (patient_id,))
+        if (refs.get(ind_id) or {}).get('lower') != lower)
+    pairs = {(ind_id, schedule.locate(day - JULIAN_DAY_OFFSET)[0]) for ind_id, day in keys
+             if day is not None and day >= start and ind_id not in whole}
+
+    refreshed = 0
+    for ind_id in sorted(whole):
+        conn.execute('DELETE FROM cycle_summaries WHERE patient_id=? AND indicator_id=?', (patient_id, ind_id))
+        points = conn.execute(RANGE_POINTS_SQL, (patient_id, ind_id, start, MAX_DAY))
+        rows = _rows(patient_id, points, schedule, refs)
+        conn.executemany(INSERT_SQL, rows)
+        refreshed += len(rows)
+    for ind_id, cycle in sorted(pairs):
+        # 该周期已无数值点时只删除，不再写回
+        conn.execute('DELETE FROM cycle_summaries WHERE patient_id=? AND indicator_id=? AND cycle=?',
+                     (patient_id, ind_id, cycle))
+        first, last = _cycle_days(schedule, cycle)
+        points = conn.execute(RANGE_POINTS_SQL, (patient_id, ind_id, first, last))
+        conn.executemany(INSERT_SQL, _rows(patient_id, points, schedule, refs))
+        refreshed += 1
+    return refreshed
+
+
+def has_cycle_summaries(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='cycle_summaries'").fetchone() is not None
+
+
+def cycles_view(conn: sqlite3.Connection, names=None, patient_id: int = DEFAULT_PATIENT_ID) -> dict:
+    """/api/cycles payload of a patient read from cycle_summaries: per
+    canonical indicator, unit, ref and one entry per cycle; ``names``
+    restricts the indicators.
+
+    Source indicators sharing a canonical name are merged per cycle, keeping
+    the summary with more points (the first one on ties)."""
+    meta = patient_meta(conn, patient_id)
+    schedule = CycleSchedule.from_conn(conn, patient_id)
+    wanted = None if names is None else {canonical_name(n) for n in names}
+    indicators = {}
+    for (name, unit, ref_lower, ref_upper, cycle, n_points, first_day, last_day,
+         nadir, nadir_day, days_below, recovery_days, auc) in conn.execute(CYCLES_SQL, (patient_id,)):
+        canon = canonical_name(name)
+        if wanted is not None and canon not in wanted:
+            continue
+        entry = indicators.get(canon)
+        if entry is None:
+            entry = indicators[canon] = {'unit': unit or '', 'ref': normalize_ref(ref_lower, ref_upper), 'cycles': {}}
+        elif not entry['unit'] and unit:
+            entry['unit'] = unit
+        prev = entry['cycles'].get(cycle)
+        if prev is not None and prev['n'] >= n_points:
+            continue
+        # 周期第 1 天的序数
+        first = schedule.bounds(cycle)[0] if schedule else None
+        entry['cycles'][cycle] = {
+            'cycle': cycle,
+            'start': date.fromordinal(first).isoformat() if first else None,
+            'n': n_points,
+            'first_day': first_day,
+            'last_day': last_day,
+            'nadir': nadir,
+            'nadir_day': nadir_day,
+            'nadir_date': date.fromordinal(first + nadir_day - 1).isoformat() if first else None,
+            'days_below': days_below,
+            'recovery_days': recovery_days,
+            'auc': auc,
+        }
+    for entry in indicators.values():
+        entry['cycles'] = [entry['cycles'][c] for c in sorted(entry['cycles'])]
+    return {
+        'start_date': meta.get('start_date'),
+        'cycle_length_days': schedule.length if schedule else None,
+        'indicators': indicators,
+    }
@@ -0,0 +1,112 @@
+"""
+Date normalization shared by the importer, payload_builder and migrate_to_db.
+
+normalize_date() maps the spellings found in OCR lab reports to YYYY-MM-DD.
+The common shapes (YYYY-M-D with optional time, YYYYMMDD, M/D/YY[YY]) are
+recognized by one regex each; anything else goes through the original
+strptime chain, so results are unchanged. Lab reports reuse a handful of
+dates, so both functions memoize per raw string. date_ordinal() gives an
+integer sort key and date_day() the matching Julian day number stored in
+dates.day.
+
+Compatible with Python 3.7 (ships in the SCF zip via payload_builder).
+"""
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+DATE_FORMATS = (
+    # 仅日期
+    '%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d',
+    # 含时间
+    '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M', '%Y.%m.%d %H:%M',
+    '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y.%m.%d %H:%M:%S',
+    # 美式月/日/年（两位或四位年），可能带时间
+    '%m/%d/%y', '%m/%d/%Y', '%m/%d/%y %H:%M', '%m/%d/%Y %H:%M',
+)
+
+YMD_RE = re.compile(r'^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:\s+(\d{1,2})(?::(\d{1,2})(?::(\d{1,2}))?)?)?$')
+COMPACT_RE = re.compile(r'^(\d{4})(\d{2})(\d{2})$')
+MDY_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})$')
+MDY_SEARCH_RE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{2,4})')
+ISO_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})$')
+
+# 无法解析的日期排在最后（与 datetime.max 作为排序键时一致）
+UNPARSED_ORDINAL = date.max.toordinal() + 1
+# 序数 + 该偏移 = 儒略日，与 SQLite 的 CAST(julianday(date) + 0.5 AS INTEGER) 一致
+JULIAN_DAY_OFFSET = 1721425
+
+
+def _ymd(y, m, d):
+    try:
+        return date(int(y), int(m), int(d)).isoformat()
+    except ValueError:
+        return None
+
+
+def _fast(s: str):
+    # 按形状分派到唯一的解析方式；失败时返回 None 交给原有逻辑
+    m = YMD_RE.match(s)
+    if m:
+        return _ymd(m.group(1), m.group(2), m.group(3))
+    m = COMPACT_RE.match(s)
+    if m:
+        return _ymd(*m.groups())
+    m = MDY_RE.match(s)
+    if m:
+        mm, dd, yy = m.groups()
+        year = int(yy)
+        if len(yy) == 2:
+            # 与 strptime 的 %y 一致：69-99 -> 19xx，00-68 -> 20xx
+            year += 1900 if year >= 69 else 2000
+        return _ymd(year, mm, dd)
+    return None
+
+
+def _slow(s: str) -> str:
+    # 原有的逐格式尝试，只在形状未识别或日期无效时走到
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    # 兼容类似 "10/24/25 8:45" 的写法：提取日期部分并规范为 YYYY-MM-DD
+    m = MDY_SEARCH_RE.search(s)
+    if m:
+        mm, dd, yy = m.groups()
+        year = int(yy)
+        if year < 100:
+            year = 2000 + year
+        v = _ymd(year, mm, dd)
+        if v:
+            return v
+    # 回退：原样返回（后续逻辑会丢弃空日期）
+    return s
+
+
+@lru_cache(maxsize=65536)
+def normalize_date(s: str) -> str:
+    s = (s or '').strip()
+    if not s:
+        return s
+    return _fast(s) or _slow(s)
+
+
+@lru_cache(maxsize=65536)
+def date_ordinal(s: str) -> int:
+    """Integer sort key: proleptic ordinal of the normalized date, unparseable last."""
+    m = ISO_RE.match(normalize_date(s))
+    if not m:
+        return UNPARSED_ORDINAL
+    try:
+        return date(int(m.group(1)), int(m.group(2)), int(m.group(3))).toordinal()
+    except ValueError:
+        return UNPARSED_ORDINAL
+
+
+def date_day(s: str):
+    """Julian day number of a date string (any accepted spelling), or None."""
+    ordinal = date_ordinal(s)
+    if ordinal == UNPARSED_ORDINAL:
+        return None
+    return ordinal + JULIAN_DAY_OFFSET
@@ -1,71 +1,107 @@
 """
-Upload static site in docs/ to Tencent COS and enable static website hosting.
+Sync the static site in docs/ to Tencent COS and enable static website hosting.
 
 Prerequisites:
 - pip install cos-python-sdk-v5
 - Set env vars: COS_SECRET_ID, COS_SECRET_KEY, COS_REGION, COS_BUCKET
 - Optional: COS_PREFIX (e.g., "zhl/")
+- Optional: COS_ENDPOINT (e.g., a local S3-compatible stand-in for testing)
 
 This script will:
 1) Create the bucket if it does not exist (best-effort);
 2) Enable static website (index.html, error.html);
-3) Upload all files under docs/ recursively with public-read ACL.
+3) Build a fingerprinted copy of docs/ (build_static.py: app.<hash>.js etc.)
+   in a temp directory;
+4) List the objects under the prefix and compare each ETag with the local
+   file's MD5;
+5) Upload only new or changed files with public-read ACL, in parallel:
+   fingerprinted assets with a one-year immutable Cache-Control, HTML,
+   api_base.js and data-manifest.json with no-cache. All non-HTML files
+   are uploaded first; the HTML pages go up only after they have all
+   succeeded;
+6) With --delete, remove remote keys that are not in the build (including
+   superseded fingerprinted assets), after every upload has finished.
+
+Usage:
+    python scripts/deploy_cos.py [--jobs 8] [--delete] [--dry-run]
 """
+import argparse
+import hashlib
+import mimetypes
 import os
 import sys
-import mimetypes
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-try:
-    from qcloud_cos import CosConfig, CosS3Client
-except Exception:
-    print("Please install SDK: pip install cos-python-sdk-v5", file=sys.stderr)
-    sys.exit(1)
+from build_static import build, cache_control_for
+from output_manifest import CHUNK_SIZE
 
 BASE = Path(__file__).resolve().parent.parent
 DOCS_DIR = BASE / 'docs'
+LIST_PAGE_SIZE = 1000
+DELETE_BATCH = 1000
+
+# 优先使用显式的类型映射，避免浏览器将文件下载而不是渲染
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.htm': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp'
+}
+
+def load_settings() -> dict:
+    # 尝试读取本地机密文件 .secrets/cos.env 并注入环境变量
+    try:
+        import cos_secrets as _cos
+        _cos.export_to_environ(_cos.load_cos_env(), overwrite=False)
+    except Exception:
+        pass
+    prefix = os.environ.get('COS_PREFIX', '').strip()
+    if prefix and not prefix.endswith('/'):
+        prefix = prefix + '/'
+    return {
+        'secret_id': os.environ.get('COS_SECRET_ID'),
+        'secret_key': os.environ.get('COS_SECRET_KEY'),
+        'region': os.environ.get('COS_REGION'),
+        'bucket': os.environ.get('COS_BUCKET'),
+        'prefix': prefix,
+        'endpoint': os.environ.get('COS_ENDPOINT') or None,
+    }
 
-# 尝试读取本地机密文件 .secrets/cos.env 并注入环境变量
-try:
-    import sys as _sys
-    _sys.path.insert(0, str(Path(__file__).resolve().parent))
-    import cos_secrets as _cos
-    _cfg = _cos.load_cos_env()
-    _cos.export_to_environ(_cfg, overwrite=False)
-except Exception:
-    pass
-
-SID = os.environ.get('COS_SECRET_ID')
-SKEY = os.environ.get('COS_SECRET_KEY')
-REGION = os.environ.get('COS_REGION')
-BUCKET = os.environ.get('COS_BUCKET')
-PREFIX = os.environ.get('COS_PREFIX', '').strip()
-if PREFIX and not PREFIX.endswith('/'):
-    PREFIX = PREFIX + '/'
-
-if not (SID and SKEY and REGION and BUCKET):
-    print('Missing env: COS_SECRET_ID/COS_SECRET_KEY/COS_REGION/COS_BUCKET', file=sys.stderr)
-    sys.exit(2)
-
-config = CosConfig(Region=REGION, SecretId=SID, SecretKey=SKEY)
-client = CosS3Client(config)
-
-def ensure_bucket():
+def make_client(settings: dict):
     try:
-        client.head_bucket(Bucket=BUCKET)
+        from qcloud_cos import CosConfig, CosS3Client
+    except Exception:
+        print("Please install SDK: pip install cos-python-sdk-v5", file=sys.stderr)
+        sys.exit(1)
+    config = CosConfig(Region=settings['region'], SecretId=settings['secret_id'],
+                       SecretKey=settings['secret_key'], Endpoint=settings['endpoint'])
+    return CosS3Client(config)
+
+def ensure_bucket(client, bucket):
+    try:
+        client.head_bucket(Bucket=bucket)
         return True
     except Exception:
         try:
-            client.create_bucket(Bucket=BUCKET)
+            client.create_bucket(Bucket=bucket)
             return True
         except Exception as e:
             print('Create bucket failed:', e, file=sys.stderr)
             return False
 
-def enable_static_website():
+def enable_static_website(client, bucket):
     try:
         client.put_bucket_website(
-            Bucket=BUCKET,
+            Bucket=bucket,
             WebsiteConfiguration={
                 'IndexDocument': {'Suffix': 'index.html'},
                 'ErrorDocument': {'Key': 'index.html'}
@@ -76,50 +112,129 @@ def enable_static_website():
         print('Enable website failed:', e, file=sys.stderr)
         return False
 
-def upload_file(local: Path):
-    rel = local.relative_to(DOCS_DIR).as_posix()
-    key = PREFIX + rel
-    # 优先使用显式的类型映射，避免浏览器将文件下载而不是渲染
+def list_remote(client, bucket, prefix) -> dict:
+    """{key: etag (unquoted)} of every object under prefix, following pagination."""
+    remote = {}
+    marker = ''
+    while True:
+        resp = client.list_objects(Bucket=bucket, Prefix=prefix, Marker=marker, MaxKeys=LIST_PAGE_SIZE)
+        contents = resp.get('Contents') or []
+        for obj in contents:
+            remote[obj['Key']] = (obj.get('ETag') or '').strip('"')
+        if str(resp.get('IsTruncated', 'false')).lower() != 'true' or not contents:
+            return remote
+        marker = resp.get('NextMarker') or contents[-1]['Key']
+
+def local_md5(path: Path) -> str:
+    # 每次按内容现算：大小相同而内容不同的文件不能靠清单记录判断
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def plan_sync(local_dir: Path, prefix: str, remote: dict):
+    """(uploads, deletes): local files whose key is missing remotely or whose
+    ETag differs from their MD5, and remote keys with no local file."""
+    uploads = []
+    local_keys = set()
+    for p in sorted(local_dir.rglob('*')):
+        if not p.is_file():
+            continue
+        rel = p.relative_to(local_dir).as_posix()
+        key = prefix + rel
+        local_keys.add(key)
+        # 分块上传的 ETag 不是内容 md5（带 -N 后缀），按已变化处理
+        if remote.get(key) != local_md5(p):
+            uploads.append((p, key))
+    deletes = sorted(k for k in remote if k not in local_keys)
+    return uploads, deletes
+
+def is_page(key: str) -> bool:
+    return key.lower().endswith(('.html', '.htm'))
+
+def upload_file(client, bucket, local: Path, key: str):
     ext = local.suffix.lower()
-    explicit_map = {
-        '.html': 'text/html; charset=utf-8',
-        '.htm': 'text/html; charset=utf-8',
-        '.css': 'text/css; charset=utf-8',
-        '.js': 'application/javascript; charset=utf-8',
-        '.json': 'application/json; charset=utf-8',
-        '.svg': 'image/svg+xml',
-        '.png': 'image/png',
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.gif': 'image/gif',
-        '.webp': 'image/webp'
-    }
-    ct = explicit_map.get(ext) or mimetypes.guess_type(local.name)[0] or 'application/octet-stream'
+    ct = CONTENT_TYPES.get(ext) or mimetypes.guess_type(local.name)[0] or 'application/octet-stream'
     with open(local, 'rb') as f:
         data = f.read()
-    # 为避免被网站端强制下载，显式设置为 inline
+    # 为避免被网站端强制下载，显式设置为 inline；带内容哈希的文件长期缓存，其余每次校验
     client.put_object(
-        Bucket=BUCKET,
+        Bucket=bucket,
         Body=data,
         Key=key,
         ACL='public-read',
         ContentType=ct,
-        CacheControl='no-cache',
+        CacheControl=cache_control_for(key),
         ContentDisposition='inline'
     )
-    print('Uploaded:', key)
+    return key
+
+def delete_keys(client, bucket, keys):
+    for i in range(0, len(keys), DELETE_BATCH):
+        batch = keys[i:i + DELETE_BATCH]
+        client.delete_objects(Bucket=bucket, Delete={'Object': [{'Key': k} for k in batch], 'Quiet': 'true'})
+
+def sync(client, bucket, prefix='', local_dir=DOCS_DIR, jobs=8, delete=False, dry_run=False):
+    """Upload new/changed files under local_dir and optionally delete orphaned
+    keys; returns (uploaded keys, deleted keys)."""
+    remote = list_remote(client, bucket, prefix)
+    uploads, deletes = plan_sync(local_dir, prefix, remote)
+    if not delete:
+        deletes = []
+    if dry_run:
+        return [key for _p, key in uploads], deletes
+    uploaded = []
+    # 先传资源、全部完成后再传 HTML：页面上线时其引用的指纹资源已在远端；删除放在最后，
+    # 旧页面在被替换前仍能取到旧资源。有界线程池并发上传，任一失败时异常在 result() 处抛出，
+    # 后续阶段不再进行
+    pages = [(p, key) for p, key in uploads if is_page(key)]
+    assets = [(p, key) for p, key in uploads if not is_page(key)]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for batch in (assets, pages):
+            futures = [pool.submit(upload_file, client, bucket, p, key) for p, key in batch]
+            for fut in futures:
+                key = fut.result()
+                uploaded.append(key)
+                print('Uploaded:', key)
+    if deletes:
+        delete_keys(client, bucket, deletes)
+        for key in deletes:
+            print('Deleted:', key)
+    return uploaded, deletes
 
 def main():
+    ap = argparse.ArgumentParser(description='Sync docs/ to Tencent COS (changed files only)')
+    ap.add_argument('--jobs', type=int, default=8, help='parallel uploads')
+    ap.add_argument('--delete', action='store_true', help='delete remote keys under the prefix that are not in the build')
+    ap.add_argument('--dry-run', action='store_true', help='print the plan without uploading or deleting')
+    args = ap.parse_args()
+
+    settings = load_settings()
+    if not (settings['secret_id'] and settings['secret_key'] and settings['region'] and settings['bucket']):
+        print('Missing env: COS_SECRET_ID/COS_SECRET_KEY/COS_REGION/COS_BUCKET', file=sys.stderr)
+        sys.exit(2)
     if not DOCS_DIR.exists():
         print('docs/ not found', file=sys.stderr)
         sys.exit(3)
-    if not ensure_bucket():
-        sys.exit(4)
-    enable_static_website()
-    for p in DOCS_DIR.rglob('*'):
-        if p.is_file():
-            upload_file(p)
-    print('All files uploaded to COS bucket:', BUCKET)
+    client = make_client(settings)
+    bucket = settings['bucket']
+    if not args.dry_run:
+        if not ensure_bucket(client, bucket):
+            sys.exit(4)
+        enable_static_website(client, bucket)
+    with tempfile.TemporaryDirectory() as tmp:
+        site = Path(tmp) / 'site'
+        build(DOCS_DIR, site)
+        uploaded, deleted = sync(client, bucket, settings['prefix'], site, jobs=args.jobs,
+                                 delete=args.delete, dry_run=args.dry_run)
+    if args.dry_run:
+        for key in uploaded:
+            print('Would upload:', key)
+        for key in deleted:
+            print('Would delete:', key)
+        return
+    print(f'Synced COS bucket {bucket}: {len(uploaded)} uploaded, {len(deleted)} deleted')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
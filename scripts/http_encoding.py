@@ -0,0 +1,76 @@
+"""
+Accept-Encoding negotiation and body compression.
+
+Shared by server.py, server_scf.py and build_scf_zip.py. Kept import-light
+(gzip/brotli are loaded on first compression) so the SCF cold path, which only
+negotiates against prebuilt bodies, stays cheap. Compatible with Python 3.7.
+"""
+import io
+
+# 同等 q 值时的偏好顺序：brotli 压缩率更高
+PREFERENCE = ('br', 'gzip')
+
+
+def brotli_available() -> bool:
+    try:
+        import brotli  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+def parse_accept_encoding(header) -> dict:
+    """Parse an Accept-Encoding header into {coding: q}."""
+    result = {}
+    for part in (header or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        coding, _, params = part.partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        result[coding.strip().lower()] = q
+    return result
+
+
+def choose_encoding(header, available):
+    """Pick the best coding from ``available`` for the request, or None for identity."""
+    accepted = parse_accept_encoding(header)
+    if not accepted:
+        return None
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for coding in PREFERENCE:
+        if coding not in available:
+            continue
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, coding: str) -> bytes:
+    if coding == 'gzip':
+        import gzip
+        buf = io.BytesIO()
+        # 固定 mtime，使相同内容得到相同的压缩字节
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as gz:
+            gz.write(body)
+        return buf.getvalue()
+    if coding == 'br':
+        import brotli
+        return brotli.compress(body, quality=11)
+    raise ValueError('unsupported content coding: %s' % coding)
+
+
+def compress_variants(body: bytes) -> dict:
+    """Return {content-coding: bytes} for the body; brotli only when installed."""
+    codings = ['gzip']
+    if brotli_available():
+        codings.append('br')
+    return {coding: compress(body, coding) for coding in codings}
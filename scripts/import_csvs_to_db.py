@@ -1,58 +1,27 @@
+import argparse
 import csv
+import hashlib
+import os
 import re
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
 from datetime import datetime
-from io import StringIO
-import unicodedata
+import codecs
+import io
+import itertools
+
+from cycle_summary import update_cycle_summaries
+from date_normalizer import date_day, normalize_date
+from indicator_names import canonical_indicator_name
+from migrate_to_db import apply_migrations
+from patients import DEFAULT_PATIENT_ID, touch_patients
 
 BASE = Path(__file__).resolve().parent.parent
 DB_PATH = BASE / 'db' / 'zhl.sqlite3'
 CSV_DIR = BASE / 'origin_ocr_csv_files'
 
-DATE_FORMATS = [
-    # 仅日期
-    '%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d',
-    # 含时间
-    '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M', '%Y.%m.%d %H:%M',
-    '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y.%m.%d %H:%M:%S',
-    # 美式月/日/年（两位或四位年），可能带时间
-    '%m/%d/%y', '%m/%d/%Y', '%m/%d/%y %H:%M', '%m/%d/%Y %H:%M'
-]
-
-def normalize_date(s: str) -> str:
-    s = (s or '').strip()
-    # 先尝试常见格式
-    for fmt in DATE_FORMATS:
-        try:
-            dt = datetime.strptime(s, fmt)
-            return dt.strftime('%Y-%m-%d')
-        except Exception:
-            pass
-    # 处理形如 YYYY-M-D [HH:MM[:SS]] 的非零填充格式
-    m = re.match(r'^(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})(?:\s+(\d{1,2})(?::(\d{1,2})(?::(\d{1,2}))?)?)?$', s)
-    if m:
-        y, mo, d, *_ = m.groups()
-        try:
-            dt = datetime(int(y), int(mo), int(d))
-            return dt.strftime('%Y-%m-%d')
-        except Exception:
-            pass
-    # 兼容类似 "10/24/25 8:45" 的写法：提取日期部分并规范为 YYYY-MM-DD
-    m = re.search(r'(\d{1,2})/(\d{1,2})/(\d{2,4})', s)
-    if m:
-        mm, dd, yy = m.groups()
-        year = int(yy)
-        if year < 100:
-            year = 2000 + year
-        try:
-            dt = datetime(year, int(mm), int(dd))
-            return dt.strftime('%Y-%m-%d')
-        except Exception:
-            pass
-    # 回退：原样返回（后续逻辑会丢弃空日期）
-    return s
-
 def parse_float(value: str):
     if value is None:
         return None
@@ -91,86 +60,18 @@ def parse_ref_range(s: str):
         return None, v
     return None, None
 
-# 常见检验项目别名到标准名称映射（可逐步扩展）
-INDICATOR_SYNONYMS = {
-    # 白细胞
-    'wbc': '白细胞计数', '白细胞': '白细胞计数', '白细胞数': '白细胞计数', '白细胞计数': '白细胞计数',
-    # 中性粒细胞
-    'neut#': '中性粒细胞计数', 'neut%': '中性粒细胞百分数', '中性粒细胞计数': '中性粒细胞计数',
-    '中性粒细胞百分比': '中性粒细胞百分数', '中性粒细胞%': '中性粒细胞百分数', '中性细胞计数': '中性粒细胞计数',
-    '中性细胞百分数': '中性粒细胞百分数',
-    # 补充：同义名称归并（ANC、绝对值）
-    '中性粒细胞绝对值': '中性粒细胞计数', 'anc': '中性粒细胞计数',
-    '淋巴细胞绝对值': '淋巴细胞计数',
-    '单核细胞绝对值': '单核细胞计数',
-    '嗜酸性粒细胞绝对值': '嗜酸性粒细胞计数',
-    '嗜碱性粒细胞绝对值': '嗜碱性粒细胞计数',
-    '有核红细胞绝对值': '有核红细胞计数',
-    # 淋巴细胞
-    'lymph#': '淋巴细胞计数', 'lymph%': '淋巴细胞百分数', 'lym#': '淋巴细胞计数', 'lym%': '淋巴细胞百分数',
-    '淋巴细胞数': '淋巴细胞计数', '淋巴细胞比率': '淋巴细胞百分数', '淋巴细胞%': '淋巴细胞百分数',
-    # 嗜酸性粒细胞
-    'eo#': '嗜酸性粒细胞计数', 'eo%': '嗜酸性粒细胞百分数', '嗜酸细胞计数': '嗜酸性粒细胞计数',
-    '嗜酸细胞百分比': '嗜酸性粒细胞百分数', '嗜酸粒细胞计数': '嗜酸性粒细胞计数', '嗜酸粒细胞百分比': '嗜酸性粒细胞百分数',
-    # 嗜碱性粒细胞
-    'baso#': '嗜碱性粒细胞计数', 'baso%': '嗜碱性粒细胞百分数', '嗜碱细胞计数': '嗜碱性粒细胞计数',
-    '嗜碱细胞百分比': '嗜碱性粒细胞百分数', '嗜碱粒细胞计数': '嗜碱性粒细胞计数', '嗜碱粒细胞百分比': '嗜碱性粒细胞百分数',
-    # 单核细胞
-    'mono#': '单核细胞计数', 'mono%': '单核细胞百分数', '单核细胞数': '单核细胞计数', '单核细胞比率': '单核细胞百分数',
-    # 红细胞
-    'rbc': '红细胞', '红细胞数': '红细胞', '红细胞计数': '红细胞', '红细胞': '红细胞',
-    # 血红蛋白/红细胞压积
-    'hgb': '血红蛋白', 'hb': '血红蛋白', '血红蛋白': '血红蛋白', '血红蛋白浓度': '血红蛋白',
-    'hct': '红细胞压积', '红细胞比容': '红细胞压积', '红细胞压积': '红细胞压积',
-    # 红细胞指数
-    'mcv': '平均红细胞体积', '平均红细胞体积': '平均红细胞体积',
-    'mch': '平均红细胞血红蛋白含量', '平均红细胞血红蛋白含量': '平均红细胞血红蛋白含量', '平均红细胞血红蛋白量': '平均红细胞血红蛋白含量',
-    'mchc': '平均红细胞血红蛋白浓度', '平均红细胞血红蛋白浓度': '平均红细胞血红蛋白浓度',
-    # 血小板
-    'plt': '血小板计数', '血小板数': '血小板计数', '血小板计数': '血小板计数',
-    'mpv': '平均血小板体积', '平均血小板体积': '平均血小板体积',
-    'pdw': '血小板分布宽度', '血小板分布宽度': '血小板分布宽度', '血小板体积分布宽度': '血小板分布宽度',
-    'p-lcr': '大血小板比率', '大血小板比率': '大血小板比率',
-    'pct': '血小板比容', '血小板比容': '血小板比容',
-    # 有核红细胞
-    'nrbc#': '有核红细胞计数', 'nrbc%': '有核红细胞百分数', '有核红细胞计数': '有核红细胞计数',
-    # RDW（红细胞体积分布宽度）
-    '红细胞分布宽度CV': '红细胞分布宽度变异系数', '红细胞分布宽度SD': '红细胞分布宽度标准差',
-    'rdw-cv': '红细胞分布宽度变异系数', 'rdw-sd': '红细胞分布宽度标准差', 'rdw sd': '红细胞分布宽度标准差',
-}
-
-STAR_RE = re.compile(r'[★☆＊*※✱﹡]')
-
-def canonical_indicator_name(name: str) -> str:
-    if not name:
-        return ''
-    s = unicodedata.normalize('NFKC', name).strip()
-    # 去除星标/特殊标记
-    s = STAR_RE.sub('', s)
-    # 去除常见“新版/标星”等无关括注
-    s = re.sub(r'（[^）]*?(?:新版|星标|标星)[^）]*）', '', s)
-    s = re.sub(r'\([^)]*?(?:新版|星标|标星)[^)]*\)', '', s)
-    s = s.strip()
-    # 如果包含代码，如 NEUT# / NEUT% / LYM% 等，统一识别
-    token = s.upper().replace(' ', '')
-    for code in ['NEUT#', 'NEUT%', 'LYMPH#', 'LYMPH%', 'LYM#', 'LYM%', 'EO#', 'EO%', 'BASO#', 'BASO%', 'MONO#', 'MONO%', 'NRBC#', 'NRBC%', 'WBC', 'RBC', 'HGB', 'HCT', 'MCH', 'MCHC', 'MCV', 'PLT', 'MPV', 'PDW', 'P-LCR', 'PCT', 'ANC', 'RDW-CV', 'RDW-SD']:
-        if code in token:
-            key = code.lower()
-            return INDICATOR_SYNONYMS.get(key, s)
-    # 直接别名映射（中文/英文）
-    key = s.lower()
-    return INDICATOR_SYNONYMS.get(key, s)
-
 def ensure_schema(conn: sqlite3.Connection):
     # 复用已存在的表结构（由 migrate_to_db.py 创建）
     cur = conn.cursor()
     cur.execute('SELECT name FROM sqlite_master WHERE type="table" AND name="indicators"')
     if cur.fetchone() is None:
         raise RuntimeError('Database schema not found. Please run migrate_to_db.py first.')
+    # 旧库按版本补齐索引等结构
+    apply_migrations(conn)
 
 def upsert_date(conn, date_str: str) -> int:
     cur = conn.cursor()
-    cur.execute('INSERT OR IGNORE INTO dates(date) VALUES(?)', (date_str,))
+    cur.execute('INSERT OR IGNORE INTO dates(date, day) VALUES(?,?)', (date_str, date_day(date_str)))
     cur.execute('SELECT id FROM dates WHERE date=?', (date_str,))
     row = cur.fetchone()
     return row[0]
@@ -192,125 +93,463 @@ def upsert_indicator(conn, name: str, unit: str, ref_lower, ref_upper) -> int:
     cur.execute('SELECT id FROM indicators WHERE name=?', (name,))
     return cur.fetchone()[0]
 
-def import_csvs():
+# 同一文件内的重复键（分块流式解析时可跨块出现）按 select_better 取舍：数值记录不被非数值记录覆盖
+FILE_RECORD_UPSERT_SQL = '''
+    INSERT INTO file_records(file_id, patient_id, indicator_id, date_id, value, status, flag)
+    VALUES(?,?,?,?,?,?,?)
+    ON CONFLICT(file_id, indicator_id, date_id) DO UPDATE SET
+        patient_id=excluded.patient_id, value=excluded.value, status=excluded.status, flag=excluded.flag
+    WHERE excluded.value IS NOT NULL OR file_records.value IS NULL
+'''
+
+class IdResolver:
+    """In-memory date/indicator id maps for bulk import.
+
+    Loaded once per import; applies the same rules as upsert_date() and
+    upsert_indicator() but only touches the database for new rows or when a
+    missing unit/reference range gets filled in. Indicators are shared by
+    all patients, so ids whose unit/range changed are kept in ``filled``.
+    Patients are resolved from CSV subdirectory names (created on demand).
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.filled = set()
+        self.patients = dict(conn.execute('SELECT code, id FROM patients'))
+        self.dates = dict(conn.execute('SELECT date, id FROM dates'))
+        self.indicators = {
+            name: [ind_id, unit, ref_lower, ref_upper]
+            for ind_id, name, unit, ref_lower, ref_upper
+            in conn.execute('SELECT id, name, unit, ref_lower, ref_upper FROM indicators')
+        }
+
+    def date_id(self, date_str: str) -> int:
+        date_id = self.dates.get(date_str)
+        if date_id is None:
+            # day 在 Python 中计算，与 migrate_to_db 的回填一致（触发器对非 ISO 写法得到 NULL）
+            cur = self.conn.execute('INSERT INTO dates(date, day) VALUES(?,?)', (date_str, date_day(date_str)))
+            date_id = self.dates[date_str] = cur.lastrowid
+        return date_id
+
+    def indicator_id(self, name: str, unit: str, ref_lower, ref_upper) -> int:
+        entry = self.indicators.get(name)
+        if entry is None:
+            cur = self.conn.execute('INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES(?,?,?,?)',
+                                    (name, unit, ref_lower, ref_upper))
+            self.indicators[name] = [cur.lastrowid, unit, ref_lower, ref_upper]
+            return cur.lastrowid
+        ind_id, old_unit, old_lower, old_upper = entry
+        # 谨慎更新：仅在原值为空时覆盖单位或参考范围，避免冲突
+        if (not old_unit) and unit:
+            self.conn.execute('UPDATE indicators SET unit=? WHERE id=?', (unit, ind_id))
+            entry[1] = unit
+            self.filled.add(ind_id)
+        if (old_lower is None and old_upper is None) and (ref_lower is not None or ref_upper is not None):
+            self.conn.execute('UPDATE indicators SET ref_lower=?, ref_upper=? WHERE id=?', (ref_lower, ref_upper, ind_id))
+            entry[2], entry[3] = ref_lower, ref_upper
+            self.filled.add(ind_id)
+        return ind_id
+
+    def patient_id(self, rel: str) -> int:
+        # CSV_DIR/<code>/*.csv 属于患者 <code>；顶层文件属于默认患者
+        if '/' not in rel:
+            return DEFAULT_PATIENT_ID
+        code = rel.split('/', 1)[0]
+        patient_id = self.patients.get(code)
+        if patient_id is None:
+            cur = self.conn.execute('INSERT INTO patients(code, name) VALUES(?,?)', (code, code))
+            patient_id = self.patients[code] = cur.lastrowid
+        return patient_id
+
+@contextmanager
+def bulk_import_pragmas(conn: sqlite3.Connection):
+    """Run with synchronous=OFF and journal_mode=MEMORY, restoring both afterwards.
+
+    Only for the duration of an import: a crash mid-import can corrupt the
+    file, and the fix is re-running the import from the CSVs.
+    """
+    synchronous = conn.execute('PRAGMA synchronous').fetchone()[0]
+    journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+    conn.execute('PRAGMA synchronous=OFF')
+    try:
+        conn.execute('PRAGMA journal_mode=MEMORY')
+    except sqlite3.OperationalError:
+        # 其他连接（如运行中的 server.py）持有 WAL 时无法切换，保持原模式继续
+        pass
+    try:
+        yield
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute('PRAGMA journal_mode=%s' % journal_mode)
+        conn.execute('PRAGMA synchronous=%d' % synchronous)
+
+def import_csvs(jobs: int = 1, full: bool = False, prune: bool = False):
+    # 目录缺失时若照常比对，所有已导入文件都会被当作已删除而撤回其数据
+    if not CSV_DIR.is_dir():
+        raise FileNotFoundError(f'CSV directory not found: {CSV_DIR}')
     conn = sqlite3.connect(DB_PATH)
     try:
         ensure_schema(conn)
-        cur = conn.cursor()
-        files = sorted([p for p in CSV_DIR.glob('*.csv')])
-        if not files:
-            print(f'No CSV files found in {CSV_DIR}')
-            return
-        total_rows = 0
-        for fpath in files:
-            print(f'Importing {fpath.name}...')
-            # 兼容不同编码和分隔符
-            encodings = ['utf-8-sig', 'utf-8', 'gbk', 'gb18030']
-            reader_obj = None
-            delim = ','
-            for enc in encodings:
-                try:
-                    with open(fpath, 'r', encoding=enc) as f:
-                        sample = f.read(4096)
-                        try:
-                            dialect = csv.Sniffer().sniff(sample)
-                            delim = dialect.delimiter
-                        except Exception:
-                            delim = ','
-                    # 重新打开并创建 DictReader
-                    f = open(fpath, 'r', encoding=enc)
-                    reader_obj = csv.DictReader(f, delimiter=delim)
-                    # 检查是否有字段名
-                    if reader_obj.fieldnames and len(reader_obj.fieldnames) > 0:
-                        # 保存文件句柄以便迭代
-                        file_handle = f
-                        break
-                    else:
-                        f.close()
-                except Exception:
-                    continue
-
-            if reader_obj is None:
-                print(f'  Skipped {fpath.name}: cannot read CSV with supported encodings')
-                continue
-
-            # 映射字段名（兼容不同表头写法）
-            def find_key(keys, candidates):
-                for k in keys:
-                    ks = (k or '').strip()
-                    for c in candidates:
-                        if c in ks:
-                            return k
-                return None
+        with bulk_import_pragmas(conn):
+            _import_files(conn, jobs, full, prune)
+    finally:
+        conn.close()
+
+# 映射字段名（兼容不同表头写法）
+def find_key(keys, candidates):
+    for k in keys:
+        ks = (k or '').strip()
+        for c in candidates:
+            if c in ks:
+                return k
+    return None
+
+def select_better(old, new):
+    if old is None:
+        return new
+    # 优先保留数值有效的记录
+    old_num = isinstance(old.get('value'), (int, float))
+    new_num = isinstance(new.get('value'), (int, float))
+    if new_num and not old_num:
+        return new
+    if old_num and not new_num:
+        return old
+    # 都是数值：优先保留带上下箭头标记的（信息量更高），否则取最新
+    old_flag = old.get('flag')
+    new_flag = new.get('flag')
+    def score(flag):
+        return 1 if flag in ('↑', '↓') else 0
+    if score(new_flag) > score(old_flag):
+        return new
+    return new  # 默认后来的覆盖
+
+# 候选编码（按优先级）；带 BOM 的 UTF-8 单独识别
+ENCODINGS = ('utf-8', 'gbk', 'gb18030')
+DELIMITERS = (',', '\t', ';', '|')
+SAMPLE_BYTES = 64 * 1024
+# 超过此大小的文件（拼接导出的大文件）在主进程中分块流式写入，每块至多 STREAM_CHUNK_KEYS 个键
+STREAM_BYTES = 64 * 1024 * 1024
+STREAM_CHUNK_KEYS = 50000
 
-            keys = reader_obj.fieldnames
-            date_key = find_key(keys, ['报告日期', '日期', '采集时间', '采集日期', '检验时间', '检验日期', '时间'])
-            name_key = find_key(keys, ['检测指标', '项目', '项目名称', '检验项目'])
-            value_key = find_key(keys, ['结果', '数值'])
-            status_key = find_key(keys, ['状态'])
-            ref_key = find_key(keys, ['参考值', '参考范围', '参考区间'])
-            unit_key = find_key(keys, ['单位'])
+def detect_encodings(sample: bytes):
+    """Candidate encodings for a file, most likely first, judged from one byte sample."""
+    if sample.startswith(codecs.BOM_UTF8):
+        return ['utf-8-sig']
+    ok = []
+    for enc in ENCODINGS:
+        try:
+            # 增量解码：样本末尾被截断的多字节字符不算错误
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+        except UnicodeDecodeError:
+            continue
+        ok.append(enc)
+    # 样本都解不开时仍按顺序尝试，由流式读取时的解码错误做最终判定
+    return ok or list(ENCODINGS)
+
+def detect_delimiter(header_line: str) -> str:
+    # 表头中出现最多的候选分隔符；都没有时按逗号处理
+    counts = [(header_line.count(d), d) for d in DELIMITERS]
+    n, delim = max(counts, key=lambda c: c[0])
+    return delim if n else ','
+
+def _parse_rows(reader, chunk_keys=None):
+    """Yield deduplicated [((indicator, date), record), ...] chunks, or None when there is no header.
+
+    A chunk holds at most chunk_keys keys (no limit when None); a key may
+    recur in a later chunk and is then resolved when written.
+    """
+    header = None
+    cols = None
+    # 聚合：同日同项目去重与优选
+    rows_map = {}
+    for row in reader:
+        if not row:
+            continue
+        if header is None:
+            header = row
+            keys = [k.strip() for k in header]
+            cols = [
+                keys.index(k) if k is not None else None
+                for k in (
+                    find_key(keys, ['报告日期', '日期', '采集时间', '采集日期', '检验时间', '检验日期', '时间']),
+                    find_key(keys, ['检测指标', '项目', '项目名称', '检验项目']),
+                    find_key(keys, ['结果', '数值']),
+                    find_key(keys, ['状态']),
+                    find_key(keys, ['参考值', '参考范围', '参考区间']),
+                    find_key(keys, ['单位']),
+                )
+            ]
+            continue
+        # 拼接导出的大文件中会重复出现表头行
+        if row == header:
+            continue
+        date_raw, raw_name, value_raw, status, ref_raw, unit = (
+            (row[c] if c is not None and c < len(row) else '') for c in cols)
+        date_str = normalize_date(date_raw.strip())
+        ind_name = canonical_indicator_name(raw_name.strip())
+        value = parse_float(value_raw if cols[2] is not None else None)
+        status = status.strip()
+        flag = status
+        unit = unit.strip()
+        ref_lower, ref_upper = parse_ref_range(ref_raw if cols[4] is not None else None)
 
-            # 聚合：同日同项目去重与优选
+        if not ind_name or not date_str:
+            continue
+
+        key = (ind_name, date_str)
+        rec = {
+            'value': value,
+            'status': status,
+            'flag': flag,
+            'unit': unit,
+            'ref_lower': ref_lower,
+            'ref_upper': ref_upper,
+        }
+        rows_map[key] = select_better(rows_map.get(key), rec)
+        if chunk_keys and len(rows_map) >= chunk_keys:
+            yield list(rows_map.items())
             rows_map = {}
-            def select_better(old, new):
-                if old is None:
-                    return new
-                # 优先保留数值有效的记录
-                old_num = isinstance(old.get('value'), (int, float))
-                new_num = isinstance(new.get('value'), (int, float))
-                if new_num and not old_num:
-                    return new
-                if old_num and not new_num:
-                    return old
-                # 都是数值：优先保留带上下箭头标记的（信息量更高），否则取最新
-                old_flag = old.get('flag')
-                new_flag = new.get('flag')
-                def score(flag):
-                    return 1 if flag in ('↑', '↓') else 0
-                if score(new_flag) > score(old_flag):
-                    return new
-                return new  # 默认后来的覆盖
-
-            for row in reader_obj:
-                date_raw = (row.get(date_key) if date_key else '').strip()
-                date_str = normalize_date(date_raw)
-                raw_name = (row.get(name_key) if name_key else '').strip()
-                ind_name = canonical_indicator_name(raw_name)
-                value = parse_float(row.get(value_key) if value_key else None)
-                status = (row.get(status_key) if status_key else '').strip()
-                flag = status
-                unit = (row.get(unit_key) if unit_key else '').strip()
-                ref_lower, ref_upper = parse_ref_range(row.get(ref_key) if ref_key else None)
-
-                if not ind_name or not date_str:
-                    continue
-
-                key = (ind_name, date_str)
-                rec = {
-                    'value': value,
-                    'status': status,
-                    'flag': flag,
-                    'unit': unit,
-                    'ref_lower': ref_lower,
-                    'ref_upper': ref_upper,
-                }
-                rows_map[key] = select_better(rows_map.get(key), rec)
-
-            # 写入数据库
-            for (ind_name, date_str), rec in rows_map.items():
-                date_id = upsert_date(conn, date_str)
-                ind_id = upsert_indicator(conn, ind_name, rec['unit'], rec['ref_lower'], rec['ref_upper'])
-                cur.execute('''
-                    INSERT OR REPLACE INTO measurements(indicator_id, date_id, value, status, flag, phase)
-                    VALUES(?,?,?,?,?,?)
-                ''', (ind_id, date_id, rec['value'], rec['status'], rec['flag'], None))
-                total_rows += 1
-
-        conn.commit()
-        print(f'Imported {total_rows} rows from {len(files)} files.')
-    finally:
-        conn.close()
+    yield list(rows_map.items()) if header is not None else None
+
+def iter_csv_chunks(fpath: Path, chunk_keys=None):
+    """Stream one OCR CSV as chunks of deduplicated records (see _parse_rows).
+
+    The file is opened once: encoding and delimiter are decided from a byte
+    sample, then rows are streamed from the same handle. A None item voids
+    everything yielded before it (a later encoding is being tried); a file
+    whose last item is None cannot be read.
+    """
+    with open(fpath, 'rb') as raw:
+        sample = raw.read(SAMPLE_BYTES)
+        for enc in detect_encodings(sample):
+            raw.seek(0)
+            text = io.TextIOWrapper(raw, encoding=enc, newline='')
+            try:
+                first = text.readline()
+                reader = csv.reader(itertools.chain([first], text), delimiter=detect_delimiter(first))
+                yield from _parse_rows(reader, chunk_keys)
+                return
+            except UnicodeDecodeError:
+                # 样本之后才出现无法解码的字节：作废已产出的块，回到开头换下一个编码
+                yield None
+            finally:
+                # 解除包装，避免 TextIOWrapper 回收时关闭底层文件
+                text.detach()
+    yield None
+
+def parse_csv_file(fpath: Path):
+    """Parse and normalize one OCR CSV without touching the database.
+
+    Returns [((indicator, date), record), ...] deduplicated per (indicator,
+    date), or None when the file cannot be read with any supported encoding.
+    Runs in worker processes, so it must stay a module-level function.
+    """
+    records = None
+    for records in iter_csv_chunks(fpath):
+        pass
+    return records
+
+def _parsed_files(files, jobs: int):
+    """Yield (path, chunks) in file order, chunks as in iter_csv_chunks()."""
+    # 大文件按块流式解析，内存与文件大小无关；其余文件整体解析，可分发到多个进程。
+    # map 按提交顺序返回，写入顺序（后导入的文件覆盖先导入的）与串行时一致
+    streamed = {fpath for fpath in files if fpath.stat().st_size > STREAM_BYTES}
+    small = [fpath for fpath in files if fpath not in streamed]
+    with ExitStack() as stack:
+        if jobs <= 1 or len(small) <= 1:
+            parsed = map(parse_csv_file, small)
+        else:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            chunksize = max(1, min(32, len(small) // (jobs * 4)))
+            parsed = pool.map(parse_csv_file, small, chunksize=chunksize)
+        for fpath in files:
+            if fpath in streamed:
+                yield fpath, iter_csv_chunks(fpath, STREAM_CHUNK_KEYS)
+            else:
+                yield fpath, [next(parsed)]
+
+def _write_records(cur, ids: IdResolver, file_id: int, patient_id: int, chunks):
+    """Write one file's record chunks to file_records; returns the row count, or None if unreadable."""
+    total = 0
+    chunk = None
+    for chunk in chunks:
+        if chunk is None:
+            # 换编码重读（或无法读取）：丢弃该文件已写入的记录
+            cur.execute('DELETE FROM file_records WHERE file_id=?', (file_id,))
+            total = 0
+            continue
+        # ID 经内存映射解析，逐块 executemany
+        batch = []
+        for (ind_name, date_str), rec in chunk:
+            date_id = ids.date_id(date_str)
+            ind_id = ids.indicator_id(ind_name, rec['unit'], rec['ref_lower'], rec['ref_upper'])
+            batch.append((file_id, patient_id, ind_id, date_id, rec['value'], rec['status'], rec['flag']))
+        cur.executemany(FILE_RECORD_UPSERT_SQL, batch)
+        cur.executemany('INSERT OR IGNORE INTO affected_keys(patient_id, indicator_id, date_id) VALUES(?,?,?)',
+                        [b[1:4] for b in batch])
+        total += len(batch)
+    return None if chunk is None else total
+
+# 受影响的 (患者, 指标, 日期)：其 measurements 行需按 file_records 重新选出胜出者
+AFFECTED_KEYS_DDL = '''
+    CREATE TEMP TABLE IF NOT EXISTS affected_keys (
+        patient_id INTEGER NOT NULL,
+        indicator_id INTEGER NOT NULL,
+        date_id INTEGER NOT NULL,
+        PRIMARY KEY (patient_id, indicator_id, date_id)
+    ) WITHOUT ROWID
+'''
+# 与全量导入一致：按文件路径顺序后导入的覆盖先导入的，即该患者路径最大的文件胜出
+RESOLVE_WINNERS_SQL = '''
+    INSERT OR REPLACE INTO measurements(patient_id, indicator_id, date_id, value, status, flag, phase, source_file_id)
+    SELECT fr.patient_id, fr.indicator_id, fr.date_id, fr.value, fr.status, fr.flag, NULL, fr.file_id
+    FROM affected_keys a
+    JOIN file_records fr
+      ON fr.patient_id = a.patient_id AND fr.indicator_id = a.indicator_id AND fr.date_id = a.date_id
+    JOIN imported_files f ON f.id = fr.file_id
+    WHERE f.path = (
+        SELECT MAX(f2.path)
+        FROM file_records fr2 JOIN imported_files f2 ON f2.id = fr2.file_id
+        WHERE fr2.patient_id = a.patient_id AND fr2.indicator_id = a.indicator_id AND fr2.date_id = a.date_id
+    )
+'''
+# 不再有任何文件提供的记录被撤回；非 CSV 来源（source_file_id 为空）的保持不动
+RETRACT_ORPHANS_SQL = '''
+    DELETE FROM measurements
+    WHERE source_file_id IS NOT NULL
+      AND EXISTS (SELECT 1 FROM affected_keys a
+                  WHERE a.patient_id = measurements.patient_id
+                    AND a.indicator_id = measurements.indicator_id AND a.date_id = measurements.date_id)
+      AND NOT EXISTS (SELECT 1 FROM file_records fr
+                      WHERE fr.patient_id = measurements.patient_id
+                        AND fr.indicator_id = measurements.indicator_id AND fr.date_id = measurements.date_id)
+'''
+
+# 受影响键所在的 (患者, 指标, 儒略日)，用于增量刷新周期汇总
+AFFECTED_DAYS_SQL = '''
+    SELECT a.patient_id, a.indicator_id, d.day FROM affected_keys a JOIN dates d ON d.id = a.date_id
+'''
+
+def file_sha256(fpath: Path) -> str:
+    h = hashlib.sha256()
+    with open(fpath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _changed_files(conn: sqlite3.Connection, files, full: bool):
+    """Split files into (pending, unchanged_count, removed_ids) against imported_files.
+
+    pending is [(path, rel, size, mtime, sha256, file_id or None)]. Size and
+    mtime decide first; the hash is only computed when they differ, and a
+    matching hash just refreshes the stored size/mtime.
+    """
+    known = {rel: (file_id, size, mtime, digest) for file_id, rel, size, mtime, digest
+             in conn.execute('SELECT id, path, size, mtime, sha256 FROM imported_files')}
+    pending = []
+    unchanged = 0
+    for fpath in files:
+        rel = fpath.relative_to(CSV_DIR).as_posix()
+        st = fpath.stat()
+        old = known.pop(rel, None)
+        if old and not full and (old[1], old[2]) == (st.st_size, st.st_mtime):
+            unchanged += 1
+            continue
+        digest = file_sha256(fpath)
+        if old and not full and old[3] == digest:
+            conn.execute('UPDATE imported_files SET size=?, mtime=? WHERE id=?', (st.st_size, st.st_mtime, old[0]))
+            unchanged += 1
+            continue
+        pending.append((fpath, rel, st.st_size, st.st_mtime, digest, old[0] if old else None))
+    # 已从目录中删除的文件
+    removed = [v[0] for v in known.values()]
+    return pending, unchanged, removed
+
+def _retract_files(conn: sqlite3.Connection, file_ids):
+    # 记下这些文件贡献过的键，再删除其记录；胜出者稍后统一重算
+    for file_id in file_ids:
+        conn.execute('''
+            INSERT OR IGNORE INTO affected_keys(patient_id, indicator_id, date_id)
+            SELECT patient_id, indicator_id, date_id FROM file_records WHERE file_id=?
+        ''', (file_id,))
+        conn.execute('DELETE FROM file_records WHERE file_id=?', (file_id,))
+
+def _import_files(conn: sqlite3.Connection, jobs: int, full: bool = False, prune: bool = False):
+    cur = conn.cursor()
+    ids = IdResolver(conn)
+    # 顶层 CSV 属于默认患者，CSV_DIR/<code>/ 下的属于对应患者
+    files = sorted(list(CSV_DIR.glob('*.csv')) + list(CSV_DIR.glob('*/*.csv')))
+    if not files:
+        print(f'No CSV files found in {CSV_DIR}')
+    cur.execute(AFFECTED_KEYS_DDL)
+    cur.execute('DELETE FROM affected_keys')
+    pending, unchanged, removed = _changed_files(conn, files, full)
+    # 空目录多半是未同步或挂载失败：不据此撤回全部数据，除非显式 --prune
+    if removed and not files and not prune:
+        print(f'Kept {len(removed)} previously imported files; pass --prune to retract them')
+        removed = []
+    if removed:
+        _retract_files(conn, removed)
+        conn.executemany('DELETE FROM imported_files WHERE id=?', [(i,) for i in removed])
+    _retract_files(conn, [p[5] for p in pending if p[5] is not None])
+
+    imported_at = datetime.now().isoformat(timespec='seconds')
+    total_rows = 0
+    for (fpath, rel, size, mtime, digest, file_id), (_, chunks) in zip(
+            pending, _parsed_files([p[0] for p in pending], jobs)):
+        print(f'Importing {fpath.name}...')
+        patient_id = ids.patient_id(rel)
+        new_file = file_id is None
+        if new_file:
+            file_id = cur.execute(
+                'INSERT INTO imported_files(path, size, mtime, sha256, imported_at, patient_id) VALUES(?,?,?,?,?,?)',
+                (rel, size, mtime, digest, imported_at, patient_id)).lastrowid
+
+        # 单一写入者：全部文件处于同一个事务中，结束时一次提交
+        rows = _write_records(cur, ids, file_id, patient_id, chunks)
+        if rows is None:
+            print(f'  Skipped {fpath.name}: cannot read CSV with supported encodings')
+            # 不记录指纹，下次导入时重试
+            if new_file:
+                cur.execute('DELETE FROM imported_files WHERE id=?', (file_id,))
+            continue
+        if not new_file:
+            cur.execute('UPDATE imported_files SET size=?, mtime=?, sha256=?, imported_at=? WHERE id=?',
+                        (size, mtime, digest, imported_at, file_id))
+        total_rows += rows
+
+    # 只对受影响的键重选胜出者：日常导入的开销与新增数据量成正比
+    cur.execute(RESOLVE_WINNERS_SQL)
+    cur.execute(RETRACT_ORPHANS_SQL)
+    # 周期汇总只重算受影响的 (患者, 指标, 周期)，与胜出者在同一事务内提交
+    keys_by_patient = {}
+    for patient_id, ind_id, day in cur.execute(AFFECTED_DAYS_SQL).fetchall():
+        keys_by_patient.setdefault(patient_id, []).append((ind_id, day))
+    # 指标为各患者共用：补全了单位/参考范围的指标，其所有患者的 payload 都已变化
+    if ids.filled:
+        placeholders = ','.join('?' * len(ids.filled))
+        for (patient_id,) in cur.execute('SELECT DISTINCT patient_id FROM measurements WHERE indicator_id IN (%s)'
+                                         % placeholders, sorted(ids.filled)).fetchall():
+            keys_by_patient.setdefault(patient_id, [])
+    for patient_id, keys in sorted(keys_by_patient.items()):
+        update_cycle_summaries(conn, patient_id, keys)
+    # 只让数据变化的患者的缓存失效
+    touch_patients(conn, keys_by_patient)
+    conn.commit()
+    print(f'Imported {total_rows} rows from {len(pending)} new/changed files '
+          f'({unchanged} unchanged, {len(removed)} removed).')
+
+def main():
+    ap = argparse.ArgumentParser(description='Import OCR CSVs from origin_ocr_csv_files/ into the SQLite database.')
+    ap.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                    help='worker processes for CSV parsing (default: CPU count; 1 = no pool)')
+    ap.add_argument('--full', action='store_true',
+                    help='re-import every CSV, ignoring the imported_files fingerprints')
+    ap.add_argument('--prune', action='store_true',
+                    help='retract previously imported files even when no CSV is found')
+    args = ap.parse_args()
+    import_csvs(jobs=args.jobs, full=args.full, prune=args.prune)
 
 if __name__ == '__main__':
-    import_csvs()
\ No newline at end of file
+    main()
\ No newline at end of file
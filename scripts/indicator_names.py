@@ -0,0 +1,76 @@
+"""
+Indicator-name canonicalization shared by the import, normalization and
+export scripts.
+
+The tables live in indicator_synonyms.json next to this file:
+
+- ``aliases`` + ``code_tokens``: full normalization applied to raw OCR names
+  at import time (NFKC, star marks and "新版/星标" notes stripped, instrument
+  codes such as NEUT#/PLT recognized anywhere in the name, case-insensitive
+  alias lookup). Code tokens are tried in list order, so an earlier token wins
+  even when a later one also occurs (e.g. MCH before MCHC).
+- ``merge``: the conservative exact-match merge used when exporting
+  (绝对值 -> 计数, RBC -> 红细胞). It deliberately leaves names such as
+  血红蛋白浓度 alone, which the dashboard keys its core charts on.
+
+Results are memoized per raw name. Compatible with Python 3.7 (ships in the
+SCF zip via payload_builder).
+"""
+import json
+import re
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+SYNONYMS_PATH = Path(__file__).resolve().with_name('indicator_synonyms.json')
+
+with open(SYNONYMS_PATH, 'r', encoding='utf-8') as _f:
+    _TABLES = json.load(_f)
+
+INDICATOR_SYNONYMS = _TABLES['aliases']
+MERGE_SYNONYMS = _TABLES['merge']
+CODE_TOKENS = tuple(_TABLES['code_tokens'])
+
+STAR_RE = re.compile(r'[★☆＊*※✱﹡]')
+NOTE_FULLWIDTH_RE = re.compile(r'（[^）]*?(?:新版|星标|标星)[^）]*）')
+NOTE_RE = re.compile(r'\([^)]*?(?:新版|星标|标星)[^)]*\)')
+# 零宽先行断言：在每个位置报告首个（按列表顺序）匹配的代码，允许相互重叠
+CODE_RE = re.compile('(?=(%s))' % '|'.join(re.escape(c) for c in CODE_TOKENS))
+_CODE_RANK = {c: i for i, c in enumerate(CODE_TOKENS)}
+
+
+def find_code_token(token: str):
+    """First entry of CODE_TOKENS (in list order) occurring anywhere in token, or None."""
+    best = None
+    for m in CODE_RE.finditer(token):
+        rank = _CODE_RANK[m.group(1)]
+        if best is None or rank < best:
+            best = rank
+            if rank == 0:
+                break
+    return None if best is None else CODE_TOKENS[best]
+
+
+@lru_cache(maxsize=4096)
+def canonical_indicator_name(name: str) -> str:
+    if not name:
+        return ''
+    s = unicodedata.normalize('NFKC', name).strip()
+    # 去除星标/特殊标记
+    s = STAR_RE.sub('', s)
+    # 去除常见“新版/标星”等无关括注
+    s = NOTE_FULLWIDTH_RE.sub('', s)
+    s = NOTE_RE.sub('', s)
+    s = s.strip()
+    # 如果包含代码，如 NEUT# / NEUT% / LYM% 等，统一识别
+    code = find_code_token(s.upper().replace(' ', ''))
+    if code is not None:
+        return INDICATOR_SYNONYMS.get(code.lower(), s)
+    # 直接别名映射（中文/英文）
+    return INDICATOR_SYNONYMS.get(s.lower(), s)
+
+
+def merge_name(name: str) -> str:
+    """Export-time merge of synonymous names (exact match after strip)."""
+    name = (name or '').strip()
+    return MERGE_SYNONYMS.get(name, name)
@@ -2,10 +2,30 @@ import json
 import sqlite3
 from pathlib import Path
 
+from chemo_cycles import seed_cycles
+from cycle_summary import rebuild_cycle_summaries
+from date_normalizer import date_day
+from patients import DEFAULT_PATIENT_ID, set_patient_meta, touch_patients
+
 BASE = Path(__file__).resolve().parent.parent
 DATA_JSON = BASE / 'dashboard' / 'data.json'
 DB_PATH = BASE / 'db' / 'zhl.sqlite3'
 
+def backfill_date_days(conn: sqlite3.Connection):
+    rows = conn.execute('SELECT id, date FROM dates').fetchall()
+    conn.executemany('UPDATE dates SET day=? WHERE id=?', [(date_day(d), i) for i, d in rows])
+
+def refill_date_days(conn: sqlite3.Connection):
+    # 触发器按 julianday 计算，非 ISO 写法（如 2025-8-6、2025.08.06）得到 NULL：按 date_day 重算
+    changed = [(date_day(d), i) for i, d, day in conn.execute('SELECT id, date, day FROM dates').fetchall()
+               if date_day(d) != day]
+    if not changed:
+        return
+    conn.executemany('UPDATE dates SET day=? WHERE id=?', changed)
+    # 日序号决定排序与周期归属：令各患者的周期汇总依据失效（下次刷新时重建），并使其缓存失效
+    conn.execute("DELETE FROM patient_meta WHERE key = 'cycle_summary_basis'")
+    conn.execute('UPDATE patients SET generation = generation + 1')
+
 SCHEMA = {
     'tables': [
         # 指标表
@@ -39,18 +59,231 @@ SCHEMA = {
             key TEXT PRIMARY KEY,
             value TEXT
         )'''
+    ],
+    # 版本化迁移：(版本号, 步骤)，步骤为 SQL 或 fn(conn)；
+    # PRAGMA user_version 记录已应用到的版本，只执行其后的迁移。
+    # 旧版本的表结构按当时原样内联，旧库逐版本升级的结果与新库一致
+    'migrations': [
+        # 1: 覆盖索引，按指标取序列（WHERE indicator_id=?）时无需回表
+        (1, [
+            'CREATE INDEX IF NOT EXISTS idx_measurements_indicator_cover '
+            'ON measurements(indicator_id, date_id, value, status, flag, phase)',
+        ]),
+        # 2: 整数日序号（儒略日），日期排序与范围过滤不再比较文本
+        (2, [
+            'ALTER TABLE dates ADD COLUMN day INTEGER',
+            backfill_date_days,
+            'CREATE INDEX IF NOT EXISTS idx_dates_day ON dates(day, date)',
+            '''CREATE TRIGGER IF NOT EXISTS dates_fill_day AFTER INSERT ON dates
+               WHEN NEW.day IS NULL
+               BEGIN
+                   UPDATE dates SET day = CAST(julianday(NEW.date) + 0.5 AS INTEGER) WHERE id = NEW.id;
+               END''',
+            # 收集统计信息，让规划器选用上面的索引（按日期顺序驱动、免排序）
+            'ANALYZE',
+        ]),
+        # 3: 增量导入——已导入文件指纹与逐文件记录（来源），文件变化时可精确撤回
+        (3, [
+            '''CREATE TABLE IF NOT EXISTS imported_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                sha256 TEXT NOT NULL,
+                imported_at TEXT
+            )''',
+            # 每个文件（同日同项目去重后）贡献的记录；measurements 中为各文件记录的胜出者
+            '''CREATE TABLE IF NOT EXISTS file_records (
+                file_id INTEGER NOT NULL,
+                indicator_id INTEGER NOT NULL,
+                date_id INTEGER NOT NULL,
+                value REAL,
+                status TEXT,
+                flag TEXT,
+                PRIMARY KEY (file_id, indicator_id, date_id),
+                FOREIGN KEY (file_id) REFERENCES imported_files(id)
+            ) WITHOUT ROWID''',
+            'CREATE INDEX IF NOT EXISTS idx_file_records_key ON file_records(indicator_id, date_id)',
+            'ALTER TABLE measurements ADD COLUMN source_file_id INTEGER REFERENCES imported_files(id)',
+        ]),
+        # 4: 按化疗周期物化的指标汇总（谷值、低于下限天数、恢复时间、AUC），见 cycle_summary.py
+        #    （版本 6 起按患者分区）
+        (4, [
+            '''CREATE TABLE IF NOT EXISTS cycle_summaries (
+                indicator_id INTEGER NOT NULL,
+                cycle INTEGER NOT NULL,
+                n_points INTEGER NOT NULL,
+                first_day INTEGER NOT NULL,
+                last_day INTEGER NOT NULL,
+                nadir_value REAL NOT NULL,
+                nadir_day INTEGER NOT NULL,
+                days_below REAL,
+                recovery_days REAL,
+                auc REAL NOT NULL,
+                ref_lower REAL,
+                PRIMARY KEY (indicator_id, cycle),
+                FOREIGN KEY (indicator_id) REFERENCES indicators(id)
+            ) WITHOUT ROWID''',
+        ]),
+        # 5: 实际给药日期（周期起点）；阶段标签在读取时按此排期计算，见 chemo_cycles.py
+        (5, [
+            '''CREATE TABLE IF NOT EXISTS cycles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start_date TEXT UNIQUE NOT NULL,
+                note TEXT
+            )''',
+            # 以 meta 中的起始日期作为第一个周期
+            '''INSERT INTO cycles(start_date)
+               SELECT date(value) FROM meta
+               WHERE key = 'start_date' AND date(value) IS NOT NULL AND NOT EXISTS (SELECT 1 FROM cycles)''',
+        ]),
+        # 6: 患者维度（见 patients.py）。已有数据归入默认患者；测量、排期与周期汇总按患者分区，
+        #    索引以 patient_id 开头；meta 中的起始日期与周期长度移入 patient_meta
+        (6, [
+            '''CREATE TABLE IF NOT EXISTS patients (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE NOT NULL,
+                name TEXT,
+                generation INTEGER NOT NULL DEFAULT 0
+            )''',
+            "INSERT OR IGNORE INTO patients(id, code) VALUES(1, 'default')",
+            '''CREATE TABLE IF NOT EXISTS patient_meta (
+                patient_id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (patient_id, key),
+                FOREIGN KEY (patient_id) REFERENCES patients(id)
+            ) WITHOUT ROWID''',
+            # 周期汇总所依据的排期随汇总一同归入默认患者
+            '''INSERT OR REPLACE INTO patient_meta(patient_id, key, value)
+               SELECT 1, key, value FROM meta WHERE key IN ('start_date', 'cycle_length_days', 'cycle_summary_basis')''',
+            "DELETE FROM meta WHERE key IN ('start_date', 'cycle_length_days', 'cycle_summary_basis')",
+            # 唯一约束改为 (patient_id, indicator_id, date_id)：SQLite 需重建表
+            '''CREATE TABLE measurements_v6 (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id INTEGER NOT NULL DEFAULT 1,
+                indicator_id INTEGER NOT NULL,
+                date_id INTEGER NOT NULL,
+                value REAL,
+                status TEXT,
+                flag TEXT,
+                phase TEXT,
+                source_file_id INTEGER REFERENCES imported_files(id),
+                FOREIGN KEY (patient_id) REFERENCES patients(id),
+                FOREIGN KEY (indicator_id) REFERENCES indicators(id),
+                FOREIGN KEY (date_id) REFERENCES dates(id),
+                UNIQUE(patient_id, indicator_id, date_id)
+            )''',
+            '''INSERT INTO measurements_v6(id, patient_id, indicator_id, date_id, value, status, flag, phase, source_file_id)
+               SELECT id, 1, indicator_id, date_id, value, status, flag, phase, source_file_id FROM measurements''',
+            'DROP TABLE measurements',
+            'ALTER TABLE measurements_v6 RENAME TO measurements',
+            'CREATE INDEX idx_measurements_indicator_cover '
+            'ON measurements(patient_id, indicator_id, date_id, value, status, flag, phase)',
+            # 按患者取日期轴（EXISTS 子查询）
+            'CREATE INDEX idx_measurements_patient_date ON measurements(patient_id, date_id)',
+            'ALTER TABLE imported_files ADD COLUMN patient_id INTEGER NOT NULL DEFAULT 1',
+            'ALTER TABLE file_records ADD COLUMN patient_id INTEGER NOT NULL DEFAULT 1',
+            'DROP INDEX IF EXISTS idx_file_records_key',
+            'CREATE INDEX idx_file_records_key ON file_records(patient_id, indicator_id, date_id)',
+            '''CREATE TABLE cycles_v6 (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_id INTEGER NOT NULL DEFAULT 1,
+                start_date TEXT NOT NULL,
+                note TEXT,
+                FOREIGN KEY (patient_id) REFERENCES patients(id),
+                UNIQUE(patient_id, start_date)
+            )''',
+            'INSERT INTO cycles_v6(id, patient_id, start_date, note) SELECT id, 1, start_date, note FROM cycles',
+            'DROP TABLE cycles',
+            'ALTER TABLE cycles_v6 RENAME TO cycles',
+            'ALTER TABLE cycle_summaries RENAME TO cycle_summaries_v4',
+            '''CREATE TABLE cycle_summaries (
+                patient_id INTEGER NOT NULL,
+                indicator_id INTEGER NOT NULL,
+                cycle INTEGER NOT NULL,
+                n_points INTEGER NOT NULL,
+                first_day INTEGER NOT NULL,
+                last_day INTEGER NOT NULL,
+                nadir_value REAL NOT NULL,
+                nadir_day INTEGER NOT NULL,
+                days_below REAL,
+                recovery_days REAL,
+                auc REAL NOT NULL,
+                ref_lower REAL,
+                PRIMARY KEY (patient_id, indicator_id, cycle),
+                FOREIGN KEY (patient_id) REFERENCES patients(id),
+                FOREIGN KEY (indicator_id) REFERENCES indicators(id)
+            ) WITHOUT ROWID''',
+            # 已有汇总均属默认患者，原样搬入；不调用 cycle_summary 的现行实现，迁移结果不随其变化
+            '''INSERT INTO cycle_summaries(patient_id, indicator_id, cycle, n_points, first_day, last_day,
+                   nadir_value, nadir_day, days_below, recovery_days, auc, ref_lower)
+               SELECT 1, indicator_id, cycle, n_points, first_day, last_day,
+                   nadir_value, nadir_day, days_below, recovery_days, auc, ref_lower
+               FROM cycle_summaries_v4''',
+            'DROP TABLE cycle_summaries_v4',
+            'ANALYZE',
+        ]),
+        # 7: 修正触发器留下的日序号；此后写入路径均在 Python 中按 date_day 给出 day，
+        #    触发器只兜底直接以 SQL 插入的 ISO 日期。
+        #    追加为新版本而不是改写迁移 2 的回填：已在版本 2 及以上的库不会再执行迁移 2，
+        #    只有新版本号才能修正它们已写下的 NULL 日序号；已发布的迁移保持不变
+        (7, [
+            refill_date_days,
+        ]),
     ]
 }
 
+SCHEMA_VERSION = SCHEMA['migrations'][-1][0]
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """Bring the schema up to SCHEMA_VERSION; returns the version before upgrading."""
+    cur = conn.cursor()
+    current = cur.execute('PRAGMA user_version').fetchone()[0]
+    for version, steps in SCHEMA['migrations']:
+        if version <= current:
+            continue
+        # 每个版本一个事务：失败则整体回滚，user_version 不前进
+        cur.execute('BEGIN')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    cur.execute(step)
+            cur.execute('PRAGMA user_version = %d' % version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return current
+
+def check_schema_version(conn: sqlite3.Connection):
+    """Raise RuntimeError unless the schema is exactly at SCHEMA_VERSION.
+
+    For read-only entry points (exports), which must not migrate: migrations
+    run only on import (import_csvs_to_db.py) and server startup (server.py)."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version < SCHEMA_VERSION:
+        raise RuntimeError(f'Database schema is at version {version}, expected {SCHEMA_VERSION}. '
+                           'Run import_csvs_to_db.py or start server.py to migrate it first.')
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f'Database schema is at version {version}, newer than this code '
+                           f'({SCHEMA_VERSION}). Update the scripts first.')
+
 def ensure_schema(conn: sqlite3.Connection):
     cur = conn.cursor()
     for ddl in SCHEMA['tables']:
         cur.execute(ddl)
     conn.commit()
+    apply_migrations(conn)
+    # WAL：导入写入时读端（server.py）不被阻塞；journal_mode 持久保存在库文件中
+    cur.execute('PRAGMA journal_mode=WAL')
 
 def upsert_date(conn, date_str: str) -> int:
     cur = conn.cursor()
-    cur.execute('INSERT OR IGNORE INTO dates(date) VALUES(?)', (date_str,))
+    # day 与回填一致按 date_day 计算，不依赖触发器
+    cur.execute('INSERT OR IGNORE INTO dates(date, day) VALUES(?,?)', (date_str, date_day(date_str)))
     cur.execute('SELECT id FROM dates WHERE date=?', (date_str,))
     return cur.fetchone()[0]
 
@@ -81,11 +314,12 @@ def migrate():
         ensure_schema(conn)
         cur = conn.cursor()
 
-        # meta
+        # data.json 只有一位患者：写入默认患者
+        patient_id = DEFAULT_PATIENT_ID
         start_date = payload.get('start_date')
         cycle_length_days = payload.get('cycle_length_days')
-        cur.execute('INSERT OR REPLACE INTO meta(key, value) VALUES(?,?)', ('start_date', start_date or ''))
-        cur.execute('INSERT OR REPLACE INTO meta(key, value) VALUES(?,?)', ('cycle_length_days', str(cycle_length_days or '')))
+        set_patient_meta(conn, patient_id, 'start_date', start_date or '')
+        set_patient_meta(conn, patient_id, 'cycle_length_days', str(cycle_length_days or ''))
 
         # dates
         dates = payload.get('dates', [])
@@ -108,10 +342,15 @@ def migrate():
                 flag = pt.get('flag')
                 phase = pt.get('phase')
                 cur.execute(
-                    'INSERT OR REPLACE INTO measurements(indicator_id, date_id, value, status, flag, phase) VALUES(?,?,?,?,?,?)',
-                    (ind_id, date_id, value, status, flag, phase)
+                    'INSERT OR REPLACE INTO measurements(patient_id, indicator_id, date_id, value, status, flag, phase) '
+                    'VALUES(?,?,?,?,?,?,?)',
+                    (patient_id, ind_id, date_id, value, status, flag, phase)
                 )
 
+        # 整体重写了该患者的设置与测量数据，周期汇总全量重建
+        seed_cycles(conn, patient_id)
+        rebuild_cycle_summaries(conn, patient_id)
+        touch_patients(conn, [patient_id])
         conn.commit()
         print(f'Migrated to {DB_PATH}')
     finally:
@@ -1,161 +1,115 @@
 import sqlite3
-import re
-import unicodedata
 from pathlib import Path
 
+from cycle_summary import update_cycle_summaries
+from indicator_names import canonical_indicator_name
+from migrate_to_db import apply_migrations
+from patients import touch_patients
+
 BASE = Path(__file__).resolve().parent.parent
 DB_PATH = BASE / 'db' / 'zhl.sqlite3'
 
-STAR_RE = re.compile(r'[★☆＊*※✱﹡]')
+# 别名/星标指标 -> 标准名称（临时表，由 Python 端的 canonical_indicator_name 计算）
+ALIAS_MAP_DDL = 'CREATE TEMP TABLE alias_map (src_id INTEGER PRIMARY KEY, canon TEXT NOT NULL)'
+
+# 找到或创建目标标准指标；已存在时只填补缺失的单位与参考范围。
+# 按 src_id 顺序逐行执行，多个别名指向同一目标时先到者优先，与逐条处理一致
+MERGE_INDICATORS_SQL = '''
+    INSERT INTO indicators(name, unit, ref_lower, ref_upper)
+    SELECT a.canon, i.unit, i.ref_lower, i.ref_upper
+    FROM alias_map a JOIN indicators i ON i.id = a.src_id
+    WHERE true
+    ORDER BY a.src_id
+    ON CONFLICT(name) DO UPDATE SET
+        unit = CASE WHEN COALESCE(indicators.unit, '') = '' AND COALESCE(excluded.unit, '') <> ''
+                    THEN excluded.unit ELSE indicators.unit END,
+        ref_lower = CASE WHEN indicators.ref_lower IS NULL AND indicators.ref_upper IS NULL
+                         THEN excluded.ref_lower ELSE indicators.ref_lower END,
+        ref_upper = CASE WHEN indicators.ref_lower IS NULL AND indicators.ref_upper IS NULL
+                         THEN excluded.ref_upper ELSE indicators.ref_upper END
+'''
 
-# 与导入脚本保持一致的别名映射
-INDICATOR_SYNONYMS = {
-    'wbc': '白细胞计数', '白细胞': '白细胞计数', '白细胞数': '白细胞计数', '白细胞计数': '白细胞计数',
-    'neut#': '中性粒细胞计数', 'neut%': '中性粒细胞百分数', '中性粒细胞计数': '中性粒细胞计数',
-    '中性粒细胞百分比': '中性粒细胞百分数', '中性粒细胞%': '中性粒细胞百分数', '中性细胞计数': '中性粒细胞计数',
-    '中性细胞百分数': '中性粒细胞百分数',
-    # 补充：同义名称归并
-    '中性粒细胞绝对值': '中性粒细胞计数', 'anc': '中性粒细胞计数',
-    '淋巴细胞绝对值': '淋巴细胞计数',
-    '单核细胞绝对值': '单核细胞计数',
-    '嗜酸性粒细胞绝对值': '嗜酸性粒细胞计数',
-    '嗜碱性粒细胞绝对值': '嗜碱性粒细胞计数',
-    '有核红细胞绝对值': '有核红细胞计数',
-    'lymph#': '淋巴细胞计数', 'lymph%': '淋巴细胞百分数', 'lym#': '淋巴细胞计数', 'lym%': '淋巴细胞百分数',
-    '淋巴细胞数': '淋巴细胞计数', '淋巴细胞比率': '淋巴细胞百分数', '淋巴细胞%': '淋巴细胞百分数',
-    'eo#': '嗜酸性粒细胞计数', 'eo%': '嗜酸性粒细胞百分数', '嗜酸细胞计数': '嗜酸性粒细胞计数',
-    '嗜酸细胞百分比': '嗜酸性粒细胞百分数', '嗜酸粒细胞计数': '嗜酸性粒细胞计数', '嗜酸粒细胞百分比': '嗜酸性粒细胞百分数',
-    'baso#': '嗜碱性粒细胞计数', 'baso%': '嗜碱性粒细胞百分数', '嗜碱细胞计数': '嗜碱性粒细胞计数',
-    '嗜碱细胞百分比': '嗜碱性粒细胞百分数', '嗜碱粒细胞计数': '嗜碱性粒细胞计数', '嗜碱粒细胞百分比': '嗜碱性粒细胞百分数',
-    'mono#': '单核细胞计数', 'mono%': '单核细胞百分数', '单核细胞数': '单核细胞计数', '单核细胞比率': '单核细胞百分数',
-    'rbc': '红细胞', '红细胞数': '红细胞', '红细胞计数': '红细胞', '红细胞': '红细胞',
-    'hgb': '血红蛋白', 'hb': '血红蛋白', '血红蛋白': '血红蛋白', '血红蛋白浓度': '血红蛋白',
-    'hct': '红细胞压积', '红细胞比容': '红细胞压积', '红细胞压积': '红细胞压积',
-    'mcv': '平均红细胞体积', '平均红细胞体积': '平均红细胞体积',
-    'mch': '平均红细胞血红蛋白含量', '平均红细胞血红蛋白含量': '平均红细胞血红蛋白含量', '平均红细胞血红蛋白量': '平均红细胞血红蛋白含量',
-    'mchc': '平均红细胞血红蛋白浓度', '平均红细胞血红蛋白浓度': '平均红细胞血红蛋白浓度',
-    'plt': '血小板计数', '血小板数': '血小板计数', '血小板计数': '血小板计数',
-    'mpv': '平均血小板体积', '平均血小板体积': '平均血小板体积',
-    'pdw': '血小板分布宽度', '血小板分布宽度': '血小板分布宽度', '血小板体积分布宽度': '血小板分布宽度',
-    'p-lcr': '大血小板比率', '大血小板比率': '大血小板比率',
-    'pct': '血小板比容', '血小板比容': '血小板比容',
-    'nrbc#': '有核红细胞计数', 'nrbc%': '有核红细胞百分数', '有核红细胞计数': '有核红细胞计数',
-    # RDW 同义项
-    '红细胞分布宽度CV': '红细胞分布宽度变异系数', '红细胞分布宽度SD': '红细胞分布宽度标准差',
-    'rdw-cv': '红细胞分布宽度变异系数', 'rdw-sd': '红细胞分布宽度标准差', 'rdw sd': '红细胞分布宽度标准差',
-}
+# 迁移测量数据：同日冲突时进行优选——
+# 来源为数值时总是覆盖（认为来源更近）；两者都非数值时优先带箭头；目标为数值而来源不是时保留目标。
+# 与旧实现一样按来源指标顺序逐行生效（同一来源内同一患者的日期互不冲突）
+# 来源文件（source_file_id）随行迁移，增量导入时仍可按文件撤回
+MERGE_MEASUREMENTS_SQL = '''
+    INSERT INTO measurements(patient_id, indicator_id, date_id, value, status, flag, phase, source_file_id)
+    SELECT m.patient_id, t.id, m.date_id, m.value, m.status, m.flag, m.phase, m.source_file_id
+    FROM alias_map a
+    JOIN measurements m ON m.indicator_id = a.src_id
+    JOIN indicators t ON t.name = a.canon
+    WHERE true
+    ORDER BY a.src_id
+    ON CONFLICT(patient_id, indicator_id, date_id) DO UPDATE SET
+        value = excluded.value, status = excluded.status, flag = excluded.flag, phase = excluded.phase,
+        source_file_id = excluded.source_file_id
+    WHERE typeof(excluded.value) IN ('integer', 'real')
+       OR (typeof(measurements.value) NOT IN ('integer', 'real')
+           AND COALESCE(excluded.flag IN ('↑', '↓'), 0) > COALESCE(measurements.flag IN ('↑', '↓'), 0))
+'''
 
-def canonical_indicator_name(name: str) -> str:
-    if not name:
-        return ''
-    s = unicodedata.normalize('NFKC', name).strip()
-    s = STAR_RE.sub('', s)
-    s = re.sub(r'（[^）]*?(?:新版|星标|标星)[^）]*）', '', s)
-    s = re.sub(r'\([^)]*?(?:新版|星标|标星)[^)]*\)', '', s)
-    s = s.strip()
-    token = s.upper().replace(' ', '')
-    for code in ['NEUT#', 'NEUT%', 'LYMPH#', 'LYMPH%', 'LYM#', 'LYM%', 'EO#', 'EO%', 'BASO#', 'BASO%', 'MONO#', 'MONO%', 'NRBC#', 'NRBC%', 'WBC', 'RBC', 'HGB', 'HCT', 'MCH', 'MCHC', 'MCV', 'PLT', 'MPV', 'PDW', 'P-LCR', 'PCT', 'ANC', 'RDW-CV', 'RDW-SD']:
-        if code in token:
-            key = code.lower()
-            return INDICATOR_SYNONYMS.get(key, s)
-    key = s.lower()
-    return INDICATOR_SYNONYMS.get(key, s)
+# 逐文件记录同样改指向标准指标（同一文件内同日冲突时按上面的优选规则），
+# 否则导入时重选胜出者会按已删除的指标 id 写回
+MERGE_FILE_RECORDS_SQL = '''
+    INSERT INTO file_records(file_id, patient_id, indicator_id, date_id, value, status, flag)
+    SELECT fr.file_id, fr.patient_id, t.id, fr.date_id, fr.value, fr.status, fr.flag
+    FROM alias_map a
+    JOIN file_records fr ON fr.indicator_id = a.src_id
+    JOIN indicators t ON t.name = a.canon
+    WHERE true
+    ORDER BY a.src_id
+    ON CONFLICT(file_id, indicator_id, date_id) DO UPDATE SET
+        value = excluded.value, status = excluded.status, flag = excluded.flag
+    WHERE typeof(excluded.value) IN ('integer', 'real')
+       OR (typeof(file_records.value) NOT IN ('integer', 'real')
+           AND COALESCE(excluded.flag IN ('↑', '↓'), 0) > COALESCE(file_records.flag IN ('↑', '↓'), 0))
+'''
+
+# 合并目标（标准指标）当前的单位与参考范围
+TARGETS_SQL = '''
+    SELECT DISTINCT t.id, t.unit, t.ref_lower, t.ref_upper
+    FROM alias_map a JOIN indicators t ON t.name = a.canon
+'''
 
-def score_record(flag):
-    return 1 if flag in ('↑', '↓') else 0
 
 def normalize_db():
     conn = sqlite3.connect(DB_PATH)
     try:
-        conn.row_factory = sqlite3.Row
+        apply_migrations(conn)
         cur = conn.cursor()
-
-        cur.execute('SELECT id, name, unit, ref_lower, ref_upper FROM indicators')
-        inds = cur.fetchall()
-        moved_count = 0
-        deleted_inds = 0
-
-        for ind in inds:
-            ind_id = ind['id']
-            name = ind['name']
+        aliases = []
+        for ind_id, name in cur.execute('SELECT id, name FROM indicators').fetchall():
             canon = canonical_indicator_name(name)
-            if canon == name:
-                continue
-
-            # 找到或创建目标标准指标
-            cur.execute('SELECT id, unit, ref_lower, ref_upper FROM indicators WHERE name=?', (canon,))
-            target = cur.fetchone()
-            if target:
-                tgt_id = target['id']
-                tgt_unit, tgt_lower, tgt_upper = target['unit'], target['ref_lower'], target['ref_upper']
-                # 填补缺失的单位与参考范围
-                updates = []
-                if (not tgt_unit) and ind['unit']:
-                    updates.append(('unit', ind['unit']))
-                if (tgt_lower is None and tgt_upper is None) and (ind['ref_lower'] is not None or ind['ref_upper'] is not None):
-                    updates.append(('ref', (ind['ref_lower'], ind['ref_upper'])))
-                if updates:
-                    if any(u[0] == 'unit' for u in updates):
-                        cur.execute('UPDATE indicators SET unit=? WHERE id=?', (ind['unit'], tgt_id))
-                    if any(u[0] == 'ref' for u in updates):
-                        cur.execute('UPDATE indicators SET ref_lower=?, ref_upper=? WHERE id=?', (ind['ref_lower'], ind['ref_upper'], tgt_id))
-            else:
-                cur.execute('INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES(?,?,?,?)',
-                            (canon, ind['unit'], ind['ref_lower'], ind['ref_upper']))
-                tgt_id = cur.lastrowid
-
-            # 迁移测量数据：同日冲突时进行优选
-            cur.execute('''
-                SELECT m.id as mid, d.date as date, m.value as value, m.status as status, m.flag as flag, m.phase as phase
-                FROM measurements m JOIN dates d ON m.date_id = d.id
-                WHERE m.indicator_id = ?
-            ''', (ind_id,))
-            src_rows = cur.fetchall()
-            for r in src_rows:
-                # 目标是否已有同日记录
-                cur.execute('''
-                    SELECT m.id as mid, d.date as date, m.value as value, m.status as status, m.flag as flag, m.phase as phase
-                    FROM measurements m JOIN dates d ON m.date_id = d.id
-                    WHERE m.indicator_id = ? AND d.date = ?
-                ''', (tgt_id, r['date']))
-                tgt_row = cur.fetchone()
-                # 获取该日期 id
-                cur.execute('SELECT id FROM dates WHERE date=?', (r['date'],))
-                date_id = cur.fetchone()['id']
-                if not tgt_row:
-                    # 直接插入到目标
-                    cur.execute('''
-                        INSERT OR REPLACE INTO measurements(indicator_id, date_id, value, status, flag, phase)
-                        VALUES(?,?,?,?,?,?)
-                    ''', (tgt_id, date_id, r['value'], r['status'], r['flag'], r['phase']))
-                else:
-                    # 优选覆盖策略
-                    tgt_is_num = isinstance(tgt_row['value'], (int, float))
-                    src_is_num = isinstance(r['value'], (int, float))
-                    choose_src = False
-                    if src_is_num and not tgt_is_num:
-                        choose_src = True
-                    elif src_is_num and tgt_is_num:
-                        if score_record(r['flag']) > score_record(tgt_row['flag']):
-                            choose_src = True
-                        else:
-                            choose_src = True  # 默认用来源记录更新（认为来源更近）
-                    elif not src_is_num and not tgt_is_num:
-                        # 都非数值，优先带箭头
-                        if score_record(r['flag']) > score_record(tgt_row['flag']):
-                            choose_src = True
-                    if choose_src:
-                        cur.execute('''
-                            UPDATE measurements SET value=?, status=?, flag=?, phase=?
-                            WHERE id=?
-                        ''', (r['value'], r['status'], r['flag'], r['phase'], tgt_row['mid']))
-                # 删除源记录
-                cur.execute('DELETE FROM measurements WHERE id=?', (r['mid'],))
-                moved_count += 1
+            if canon != name:
+                aliases.append((ind_id, canon))
 
-            # 删除源指标
-            cur.execute('DELETE FROM indicators WHERE id=?', (ind_id,))
-            deleted_inds += 1
+        # 全部合并在同一事务内完成（连接关闭时临时表随之释放）
+        cur.execute(ALIAS_MAP_DDL)
+        cur.executemany('INSERT INTO alias_map(src_id, canon) VALUES(?,?)', aliases)
+        before = {row[0]: row[1:] for row in cur.execute(TARGETS_SQL)}
+        cur.execute(MERGE_INDICATORS_SQL)
+        # 受影响的患者：有别名测量的，以及目标指标被补全单位/参考范围时其已有测量的患者
+        filled = [i for i, *attrs in cur.execute(TARGETS_SQL).fetchall() if i in before and before[i] != tuple(attrs)]
+        patient_ids = {p for (p,) in cur.execute(
+            'SELECT DISTINCT m.patient_id FROM alias_map a JOIN measurements m ON m.indicator_id = a.src_id')}
+        if filled:
+            patient_ids.update(p for (p,) in cur.execute(
+                'SELECT DISTINCT patient_id FROM measurements WHERE indicator_id IN (%s)' % ','.join('?' * len(filled)),
+                filled))
+        cur.execute(MERGE_MEASUREMENTS_SQL)
+        cur.execute('DELETE FROM measurements WHERE indicator_id IN (SELECT src_id FROM alias_map)')
+        moved_count = cur.rowcount
+        cur.execute(MERGE_FILE_RECORDS_SQL)
+        cur.execute('DELETE FROM file_records WHERE indicator_id IN (SELECT src_id FROM alias_map)')
+        # 删除源指标
+        cur.execute('DELETE FROM indicators WHERE id IN (SELECT src_id FROM alias_map)')
+        deleted_inds = cur.rowcount
+        # 合并目标的全部周期重算；已删除源指标的汇总随之清除
+        targets = [i for (i,) in cur.execute('SELECT DISTINCT t.id FROM alias_map a JOIN indicators t ON t.name = a.canon')]
+        for patient_id in sorted(patient_ids):
+            update_cycle_summaries(conn, patient_id, indicator_ids=targets)
+        touch_patients(conn, patient_ids)
 
         conn.commit()
         print(f'Moved {moved_count} measurements; deleted {deleted_inds} starred/aliased indicators.')
@@ -163,4 +117,4 @@ def normalize_db():
         conn.close()
 
 if __name__ == '__main__':
-    normalize_db()
\ No newline at end of file
+    normalize_db()
@@ -0,0 +1,111 @@
+"""
+Skip-if-unchanged writes for generated outputs, with a content-hash manifest.
+
+export_from_db.py and process_blood_data.py write data.json and the
+data_processed/*.csv files through write_outputs(). The new bytes are
+streamed to a temp file while being hashed, and a target is replaced (via
+os.replace) only when its content differs. Unchanged outputs keep their
+mtime, so deploys do not see them as modified.
+
+Hashes are recorded in dist/manifest.json, keyed by path relative to the repo
+root: sha256, md5 and size. The manifest is a local, untracked record of the
+last export on this machine (dist/ is git-ignored and CI never runs the
+exports), so deploy_cos.py hashes files itself instead of trusting it. The
+manifest itself is only rewritten when an entry changes.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent.parent
+MANIFEST_PATH = BASE / 'dist' / 'manifest.json'
+CHUNK_SIZE = 1 << 20
+
+
+def manifest_key(path) -> str:
+    path = Path(path).resolve()
+    try:
+        return path.relative_to(BASE).as_posix()
+    except ValueError:
+        # 仓库外的输出（如 process_blood_data 的绝对路径）按绝对路径记录
+        return path.as_posix()
+
+
+def file_sha256(path):
+    """sha256 hex digest of a file's content, or None if it does not exist."""
+    h = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+                h.update(block)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def load_manifest(manifest_path=MANIFEST_PATH) -> dict:
+    """Manifest entries ({key: {'sha256', 'md5', 'size'}}); empty if missing or unreadable."""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('files') or {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _replace_if_changed(tmps, paths, sha256) -> list:
+    changed = []
+    for i, (tmp, path) in enumerate(zip(tmps, paths)):
+        if file_sha256(path) == sha256:
+            tmp.unlink()
+        else:
+            os.replace(tmp, path)
+            changed.append(i)
+    return changed
+
+
+def write_outputs(paths, chunks, manifest_path=MANIFEST_PATH) -> list:
+    """Write the same chunks (str as UTF-8, or bytes) to every path, leaving
+    byte-identical targets untouched; returns the paths (as given) actually
+    rewritten."""
+    given = list(paths)
+    paths = [Path(p) for p in given]
+    tmps = [p.with_name(p.name + '.tmp') for p in paths]
+    sha256, md5, size = hashlib.sha256(), hashlib.md5(), 0
+    for p in paths:
+        p.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        files = []
+        try:
+            for t in tmps:
+                files.append(open(t, 'wb'))
+            for chunk in chunks:
+                data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                sha256.update(data)
+                md5.update(data)
+                size += len(data)
+                for f in files:
+                    f.write(data)
+        finally:
+            for f in files:
+                f.close()
+        # 全部写完后再逐个比较替换，读者不会看到半截文件
+        changed = [given[i] for i in _replace_if_changed(tmps, paths, sha256.hexdigest())]
+    except BaseException:
+        for t in tmps:
+            if t.exists():
+                t.unlink()
+        raise
+
+    entry = {'sha256': sha256.hexdigest(), 'md5': md5.hexdigest(), 'size': size}
+    if manifest_path is not None:
+        files = load_manifest(manifest_path)
+        updated = dict(files, **{manifest_key(p): entry for p in paths})
+        if updated != files:
+            text = json.dumps({'files': dict(sorted(updated.items()))}, ensure_ascii=False, indent=2) + '\n'
+            manifest_path = Path(manifest_path)
+            tmp = manifest_path.with_name(manifest_path.name + '.tmp')
+            manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(text, encoding='utf-8')
+            os.replace(tmp, manifest_path)
+    return changed
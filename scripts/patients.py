@@ -0,0 +1,53 @@
+"""
+Patients dimension shared by the importer, payload builder and servers.
+
+Every measurement, cycle start and cycle summary belongs to one patient;
+per-patient settings (start_date, cycle_length_days, ...) live in
+patient_meta. Data that predates the dimension, and any row written without
+a patient_id, belongs to the default patient (id 1), which the legacy
+/api/data routes and data.json keep serving.
+
+patients.generation is bumped by every writer that changes a patient's data
+(touch_patients), so caches are invalidated per patient: a new lab report
+for one patient leaves every other patient's cached payload in place.
+
+Kept compatible with the SCF Python 3.7 runtime (the module ships in the zip).
+"""
+import sqlite3
+
+DEFAULT_PATIENT_ID = 1
+DEFAULT_PATIENT_CODE = 'default'
+
+PATIENTS_SQL = 'SELECT id, code, name FROM patients ORDER BY id'
+GENERATIONS_SQL = 'SELECT id, generation FROM patients'
+PATIENT_META_SQL = 'SELECT key, value FROM patient_meta WHERE patient_id=?'
+
+
+def patient_meta(conn: sqlite3.Connection, patient_id: int = DEFAULT_PATIENT_ID) -> dict:
+    return dict(conn.execute(PATIENT_META_SQL, (patient_id,)))
+
+
+def set_patient_meta(conn: sqlite3.Connection, patient_id: int, key: str, value):
+    conn.execute('INSERT OR REPLACE INTO patient_meta(patient_id, key, value) VALUES(?,?,?)',
+                 (patient_id, key, value))
+
+
+def patient_exists(conn: sqlite3.Connection, patient_id: int) -> bool:
+    return conn.execute('SELECT 1 FROM patients WHERE id=?', (patient_id,)).fetchone() is not None
+
+
+def list_patients(conn: sqlite3.Connection) -> list:
+    """/api/patients payload: id, code and name of every patient."""
+    return [{'id': i, 'code': code, 'name': name} for i, code, name in conn.execute(PATIENTS_SQL)]
+
+
+def generations(conn: sqlite3.Connection) -> dict:
+    """{patient_id: generation} of every patient."""
+    return dict(conn.execute(GENERATIONS_SQL))
+
+
+def touch_patients(conn: sqlite3.Connection, patient_ids):
+    """Bump the generation of patients whose data changed; runs in the
+    caller's transaction."""
+    conn.executemany('UPDATE patients SET generation = generation + 1 WHERE id=?',
+                     [(i,) for i in sorted(set(patient_ids))])
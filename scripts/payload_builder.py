@@ -0,0 +1,601 @@
+"""
+Shared /api/data payload builder.
+
+server.py and server_scf.py build their JSON through build_payload();
+export_from_db.py streams the same content through payload_head() and
+iter_indicators(). Both share the point/merge helpers, so the live API and the
+static data.json carry the same content: canonical indicator names,
+YYYY-MM-DD dates, normalized flags, per-date dedup and phase labels from
+the chemo_cycles schedule. Every payload belongs to one patient (see
+patients.py); the default patient's is the legacy /api/data and data.json.
+
+Kept compatible with the SCF Python 3.7 runtime (the module ships in the zip).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from chemo_cycles import CycleSchedule
+from date_normalizer import date_ordinal, normalize_date
+from http_encoding import compress
+from indicator_names import merge_name as canonical_name
+from patients import DEFAULT_PATIENT_ID, GENERATIONS_SQL, patient_meta
+from trends import trends_view
+
+# 固定 SQL 文本：复用连接时 sqlite3 会命中其预编译语句缓存
+# 日期与指标只列出该患者有测量的（EXISTS 走以 patient_id 开头的索引）
+DATES_SQL = '''
+    SELECT date FROM dates d
+    WHERE EXISTS (SELECT 1 FROM measurements m WHERE m.patient_id = ? AND m.date_id = d.id)
+'''
+INDICATORS_SQL = '''
+    SELECT id, name, unit, ref_lower, ref_upper FROM indicators i
+    WHERE EXISTS (SELECT 1 FROM measurements m WHERE m.patient_id = ? AND m.indicator_id = i.id)
+    ORDER BY name
+'''
+SERIES_SQL = '''
+    SELECT m.indicator_id, d.date, m.value, m.status, m.flag, m.phase
+    FROM measurements m
+    JOIN dates d ON m.date_id = d.id
+    JOIN indicators i ON m.indicator_id = i.id
+    WHERE m.patient_id = ?
+    ORDER BY i.name, d.date
+'''
+# 按指标过滤的序列查询：走 measurements(patient_id, indicator_id, date_id) 覆盖索引
+SERIES_BY_IDS_SQL = '''
+    SELECT m.indicator_id, d.date, m.value, m.status, m.flag, m.phase
+    FROM measurements m
+    JOIN dates d ON m.date_id = d.id
+    WHERE m.patient_id = ? AND m.indicator_id IN ({placeholders})
+    ORDER BY m.indicator_id, d.date
+'''
+
+# 流式导出：来源指标按 canonical 分组排名（临时表），单个游标即按合并顺序返回行
+EXPORT_GROUPS_DDL = '''
+    CREATE TEMP TABLE IF NOT EXISTS export_groups (
+        grp INTEGER NOT NULL,
+        member INTEGER NOT NULL,
+        indicator_id INTEGER NOT NULL,
+        PRIMARY KEY (grp, member)
+    ) WITHOUT ROWID
+'''
+GROUPED_SERIES_SQL = '''
+    SELECT m.indicator_id, d.date, m.value, m.status, m.flag, m.phase
+    FROM temp.export_groups g
+    JOIN measurements m ON m.patient_id = ? AND m.indicator_id = g.indicator_id
+    JOIN dates d ON m.date_id = d.id
+    ORDER BY g.grp, g.member, d.date
+'''
+
+ABNORMAL_FLAGS = frozenset(('↑', '↓'))
+
+_local = threading.local()
+
+
+def parse_date_param(s: str) -> str:
+    """Normalize a query-string date to YYYY-MM-DD; ValueError if unparseable."""
+    v = normalize_date(s)
+    datetime.strptime(v, '%Y-%m-%d')
+    return v
+
+
+def normalize_flag(raw):
+    # 将各种原始标记（如“↑H”“ ↓ ”）归一为 ↑/↓/-，无法识别时保留原值
+    text = (raw or '').strip()
+    if '↓' in text:
+        return '↓'
+    if '↑' in text:
+        return '↑'
+    if '-' in text:
+        return '-'
+    return raw
+
+
+def normalize_ref(lower, upper) -> dict:
+    if lower is None and upper is None:
+        return {}
+    if isinstance(upper, (int, float)) and upper < 0:
+        upper = abs(upper)
+    if isinstance(lower, (int, float)) and isinstance(upper, (int, float)) and lower > upper:
+        lower, upper = upper, lower
+    return {
+        'lower': lower,
+        'upper': upper
+    }
+
+
+def derive_flag(val, lower, upper):
+    # 根据参考范围推断异常标记；有范围且正常时返回 '-' 以便前端着色为正常
+    if val is None or not isinstance(val, (int, float)):
+        return None
+    if lower is not None and val < lower:
+        return '↓'
+    if upper is not None and val > upper:
+        return '↑'
+    if lower is not None or upper is not None:
+        return '-'
+    return None
+
+
+def _prefer(existing: dict, candidate: dict) -> bool:
+    # 同一天的两个点：优先数值型，其次带异常箭头的；同等时取后来者
+    e_num = isinstance(existing.get('value'), (int, float))
+    s_num = isinstance(candidate.get('value'), (int, float))
+    if s_num and not e_num:
+        return True
+    if s_num and e_num:
+        e_score = 1 if existing.get('flag') in ABNORMAL_FLAGS else 0
+        s_score = 1 if candidate.get('flag') in ABNORMAL_FLAGS else 0
+        return s_score >= e_score
+    return False
+
+
+def _merge_by_date(by_date: dict, points):
+    for pt in points:
+        ex = by_date.get(pt['date'])
+        if not ex or _prefer(ex, pt):
+            by_date[pt['date']] = pt
+
+
+def _is_ref_complete(r) -> bool:
+    return isinstance(r, dict) and (r.get('lower') is not None) and (r.get('upper') is not None)
+
+
+def _file_ident(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def get_connection(db_path) -> sqlite3.Connection:
+    """Return a per-thread connection to db_path, opened once and reused
+    until the file at db_path is replaced (different device/inode)."""
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = str(db_path)
+    # 与 PayloadCache 的探测连接一致按文件身份判断：库文件被替换后旧连接仍指向旧 inode，须重开
+    ident = _file_ident(key)
+    cached = conns.get(key)
+    if cached is not None and cached[0] == ident:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    conn = sqlite3.connect(key)
+    conns[key] = (ident, conn)
+    return conn
+
+
+def _make_point(date, value, status, norm_flag, phase, ref) -> dict:
+    pt = {
+        'date': date,
+        'value': value,
+        'status': status,
+        'flag': norm_flag,
+        'phase': phase
+    }
+    # 如果 flag 为空或缺失，则根据参考范围与数值推断
+    if not pt['flag']:
+        auto_flag = derive_flag(value, ref.get('lower'), ref.get('upper'))
+        if auto_flag:
+            pt['flag'] = auto_flag
+            pt['status'] = auto_flag
+    return pt
+
+
+def _merge_source(entry, unit, ref, points):
+    """Fold one source indicator's points into its canonical entry (None for
+    the first source of the group); returns the entry."""
+    points.sort(key=lambda p: date_ordinal(p['date']))
+    # 初始去重：同一天保留信息量更高的点
+    by_date_initial = {}
+    _merge_by_date(by_date_initial, points)
+    series = [by_date_initial[d] for d in sorted(by_date_initial, key=date_ordinal)]
+
+    # 合并到 canonical 指标名（避免同义词重复导致数据分散）
+    if entry is None:
+        return {
+            'unit': unit,
+            'ref': ref,
+            'series': series
+        }
+    # 单位：优先已有，否则用当前
+    if not entry.get('unit') and unit:
+        entry['unit'] = unit
+    # 参考范围：选择更完整（同时具备上下限）的那一个
+    if not _is_ref_complete(entry.get('ref') or {}) and _is_ref_complete(ref):
+        entry['ref'] = ref
+    # series 合并：按日期取并集，优先保留数值型与带有异常标志的点
+    by_date = {pt['date']: pt for pt in entry.get('series', [])}
+    _merge_by_date(by_date, series)
+    entry['series'] = [by_date[d] for d in sorted(by_date, key=date_ordinal)]
+    return entry
+
+
+def _sources(cur, patient_id) -> list:
+    return [(ind_id, name, unit or '', normalize_ref(ref_lower, ref_upper))
+            for ind_id, name, unit, ref_lower, ref_upper in cur.execute(INDICATORS_SQL, (patient_id,)).fetchall()]
+
+
+def _meta(cur, patient_id, schedule) -> dict:
+    meta = patient_meta(cur, patient_id)
+    return {
+        'start_date': meta.get('start_date'),
+        'cycle_length_days': int(meta.get('cycle_length_days')) if meta.get('cycle_length_days') else None,
+        'cycle_starts': schedule.start_dates() if schedule is not None else [],
+    }
+
+
+def _phase_labels(schedule, dates) -> dict:
+    # 有排期时按日期一次性计算阶段标签（每个日期一次，而非每个点）；否则沿用 measurements.phase
+    return schedule.labels(dates) if schedule is not None else {}
+
+
+def payload_head(conn: sqlite3.Connection, patient_id: int = DEFAULT_PATIENT_ID) -> dict:
+    """Everything in the unfiltered payload except ``indicators``, in key order."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    head = _meta(cur, patient_id, CycleSchedule.from_conn(cur, patient_id))
+    head['dates'] = sorted({normalize_date(d) for (d,) in cur.execute(DATES_SQL, (patient_id,))}, key=date_ordinal)
+    return head
+
+
+def build_payload(conn: sqlite3.Connection, names=None, date_from=None, date_to=None,
+                  patient_id: int = DEFAULT_PATIENT_ID) -> dict:
+    """Assemble a patient's /api/data payload from one ordered scan of measurements.
+
+    ``names`` (canonical or source indicator names) restricts the scan to
+    those indicators; ``date_from``/``date_to`` (inclusive, any accepted date
+    spelling) restrict dates. With no filters this is the whole dataset.
+    """
+    cur = conn.cursor()
+    cur.row_factory = None
+
+    # 同一批数据中标记取值很少，按原始字符串缓存规范化结果（日期由 date_normalizer 缓存）
+    flag_cache = {}
+    norm_date = normalize_date
+    sort_key = date_ordinal
+
+    schedule = CycleSchedule.from_conn(cur, patient_id)
+    payload = _meta(cur, patient_id, schedule)
+
+    lo = sort_key(date_from) if date_from else None
+    hi = sort_key(date_to) if date_to else None
+
+    def in_range(d):
+        k = sort_key(d)
+        return (lo is None or k >= lo) and (hi is None or k <= hi)
+
+    dates = sorted({norm_date(d) for (d,) in cur.execute(DATES_SQL, (patient_id,))}, key=sort_key)
+    if lo is not None or hi is not None:
+        dates = [d for d in dates if in_range(d)]
+    phases = _phase_labels(schedule, dates)
+
+    sources = _sources(cur, patient_id)
+    if names is not None:
+        wanted = {canonical_name(n) for n in names}
+        sources = [s for s in sources if canonical_name(s[1]) in wanted]
+    refs = {ind_id: ref for ind_id, _name, _unit, ref in sources}
+
+    if names is None:
+        rows = cur.execute(SERIES_SQL, (patient_id,))
+    elif sources:
+        sql = SERIES_BY_IDS_SQL.format(placeholders=','.join('?' * len(sources)))
+        rows = cur.execute(sql, [patient_id] + [s[0] for s in sources])
+    else:
+        rows = ()
+
+    points_by_ind = {}
+    for ind_id, date_raw, value, status, flag, phase in rows:
+        norm_flag = flag_cache.get(flag, flag_cache)
+        if norm_flag is flag_cache:
+            norm_flag = flag_cache[flag] = normalize_flag(flag)
+        date = norm_date(date_raw)
+        if lo is not None or hi is not None:
+            if not in_range(date):
+                continue
+        pt = _make_point(date, value, status, norm_flag, phases.get(date, phase), refs.get(ind_id) or {})
+        points = points_by_ind.get(ind_id)
+        if points is None:
+            points = points_by_ind[ind_id] = []
+        points.append(pt)
+
+    indicators = {}
+    for ind_id, name, unit, ref in sources:
+        canon = canonical_name(name)
+        indicators[canon] = _merge_source(indicators.get(canon), unit, ref, points_by_ind.get(ind_id, []))
+
+    payload['dates'] = dates
+    payload['indicators'] = indicators
+    return payload
+
+
+def iter_indicators(conn: sqlite3.Connection, patient_id: int = DEFAULT_PATIENT_ID):
+    """Yield ``(name, entry)`` pairs of the unfiltered payload's ``indicators``
+    in the same order and with the same content as build_payload, holding only
+    one canonical indicator's points at a time.
+
+    Source indicators are ranked into canonical groups in a temp table so one
+    cursor returns rows grouped the way they are merged. Needs a connection
+    that can create temp tables (the export script's, not the read-only SCF one).
+    """
+    cur = conn.cursor()
+    cur.row_factory = None
+    dates = {normalize_date(d) for (d,) in cur.execute(DATES_SQL, (patient_id,))}
+    phases = _phase_labels(CycleSchedule.from_conn(cur, patient_id), dates)
+    sources = _sources(cur, patient_id)
+    groups = {}
+    members = []
+    for rank, src in enumerate(sources):
+        canon = canonical_name(src[1])
+        grp = groups.get(canon)
+        if grp is None:
+            grp = groups[canon] = len(groups)
+            members.append([])
+        members[grp].append((rank, src))
+
+    cur.execute(EXPORT_GROUPS_DDL)
+    cur.execute('DELETE FROM temp.export_groups')
+    cur.executemany('INSERT INTO temp.export_groups(grp, member, indicator_id) VALUES(?,?,?)',
+                    [(grp, rank, src[0]) for grp, group in enumerate(members) for rank, src in group])
+    flag_cache = {}
+    try:
+        rows = cur.execute(GROUPED_SERIES_SQL, (patient_id,))
+        pending = next(rows, None)
+        for canon, group in zip(groups, members):
+            entry = None
+            for _rank, (ind_id, _name, unit, ref) in group:
+                points = []
+                # 游标按 (grp, member, date) 排序：当前来源指标的行连续出现
+                while pending is not None and pending[0] == ind_id:
+                    _id, date_raw, value, status, flag, phase = pending
+                    norm_flag = flag_cache.get(flag, flag_cache)
+                    if norm_flag is flag_cache:
+                        norm_flag = flag_cache[flag] = normalize_flag(flag)
+                    date = normalize_date(date_raw)
+                    points.append(_make_point(date, value, status, norm_flag, phases.get(date, phase), ref))
+                    pending = next(rows, None)
+                entry = _merge_source(entry, unit, ref, points)
+            yield canon, entry
+    finally:
+        conn.execute('DROP TABLE IF EXISTS temp.export_groups')
+
+
+def _code_table(seed=()):
+    table = list(seed)
+    index = {v: i for i, v in enumerate(table)}
+
+    def code(v):
+        i = index.get(v)
+        if i is None:
+            i = index[v] = len(table)
+            table.append(v)
+        return i
+    return table, code
+
+
+def to_columnar(payload: dict) -> dict:
+    """Columnar form of the payload: a shared date axis, per-indicator value
+    arrays and small integer codes for flag/status/phase."""
+    dates = list(payload.get('dates') or [])
+    date_index = {d: i for i, d in enumerate(dates)}
+    flags, flag_code = _code_table((None, '-', '↑', '↓'))
+    statuses, status_code = _code_table()
+    phases, phase_code = _code_table((None,))
+    indicators = {}
+    for name, ind in (payload.get('indicators') or {}).items():
+        d_idx, values, f_codes, s_codes, p_codes = [], [], [], [], []
+        for pt in ind.get('series') or []:
+            di = date_index.get(pt['date'])
+            if di is None:
+                # 序列中出现日期表之外的日期时扩展共享日期轴
+                di = date_index[pt['date']] = len(dates)
+                dates.append(pt['date'])
+            d_idx.append(di)
+            values.append(pt.get('value'))
+            f_codes.append(flag_code(pt.get('flag')))
+            s_codes.append(status_code(pt.get('status')))
+            p_codes.append(phase_code(pt.get('phase')))
+        indicators[name] = {
+            'unit': ind.get('unit'),
+            'ref': ind.get('ref'),
+            'd': d_idx,
+            'v': values,
+            'f': f_codes,
+            's': s_codes,
+            'p': p_codes
+        }
+    return {
+        'format': 'columnar',
+        'start_date': payload.get('start_date'),
+        'cycle_length_days': payload.get('cycle_length_days'),
+        'cycle_starts': payload.get('cycle_starts'),
+        'dates': dates,
+        'flags': flags,
+        'statuses': statuses,
+        'phases': phases,
+        'indicators': indicators
+    }
+
+
+def from_columnar(payload: dict) -> dict:
+    """Inverse of to_columnar(); returns the payload unchanged if it is not columnar."""
+    if payload.get('format') != 'columnar':
+        return payload
+    dates = payload.get('dates') or []
+    flags, statuses, phases = payload['flags'], payload['statuses'], payload['phases']
+    indicators = {}
+    for name, col in (payload.get('indicators') or {}).items():
+        series = []
+        for i, di in enumerate(col['d']):
+            series.append({
+                'date': dates[di],
+                'value': col['v'][i],
+                'status': statuses[col['s'][i]],
+                'flag': flags[col['f'][i]],
+                'phase': phases[col['p'][i]]
+            })
+        indicators[name] = {
+            'unit': col.get('unit'),
+            'ref': col.get('ref'),
+            'series': series
+        }
+    return {
+        'start_date': payload.get('start_date'),
+        'cycle_length_days': payload.get('cycle_length_days'),
+        'cycle_starts': payload.get('cycle_starts'),
+        'dates': dates,
+        'indicators': indicators
+    }
+
+
+def indicator_index(payload: dict) -> dict:
+    """Metadata-only view for /api/indicators: no series, just unit, ref,
+    point count and first/last date per indicator."""
+    indicators = {}
+    for name, ind in payload.get('indicators', {}).items():
+        series = ind.get('series') or []
+        indicators[name] = {
+            'unit': ind.get('unit'),
+            'ref': ind.get('ref'),
+            'count': len(series),
+            'first': series[0]['date'] if series else None,
+            'last': series[-1]['date'] if series else None
+        }
+    return {
+        'start_date': payload.get('start_date'),
+        'cycle_length_days': payload.get('cycle_length_days'),
+        'cycle_starts': payload.get('cycle_starts'),
+        'dates': payload.get('dates', []),
+        'indicators': indicators
+    }
+
+
+# 可选的输出格式：名称 -> 由完整 payload 派生该格式的函数
+FORMATS = {
+    'full': lambda payload: payload,
+    'columnar': to_columnar,
+}
+
+# 由完整 payload 派生、单独路由提供的视图（/api/indicators、/api/trends）
+VIEWS = dict(FORMATS, indicators=indicator_index, trends=trends_view)
+
+
+def serialize_payload(payload: dict) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class CachedPayload:
+    __slots__ = ('body', 'etag', '_encoded')
+
+    def __init__(self, body: bytes):
+        self.body = body
+        # 强 ETag：正文字节的摘要，内容不变则 ETag 不变
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self._encoded = {}
+
+    def encoded(self, coding) -> bytes:
+        """Body in the given content coding (None = identity), compressed once and memoized."""
+        if coding is None:
+            return self.body
+        data = self._encoded.get(coding)
+        if data is None:
+            data = self._encoded[coding] = compress(self.body, coding)
+        return data
+
+    def etag_for(self, coding) -> str:
+        # 不同编码是不同的表示，强 ETag 需区分
+        return self.etag if coding is None else '%s-%s' % (self.etag, coding)
+
+
+class PayloadCache:
+    """Serialized payloads kept in memory per patient until their data changes.
+
+    Staleness is checked with ``PRAGMA data_version`` on one long-lived probe
+    connection (the value only moves when another connection commits), plus
+    the file identity so a replaced database file is picked up as well. When
+    data_version moves, patients.generation tells which patients a commit
+    touched; only their payloads and query entries are dropped.
+    """
+
+    # 每位患者按查询参数缓存的条目（/api/series）上限，超出时淘汰最早写入的
+    max_entries = 64
+    # 同时缓存的患者数上限，超出时淘汰最久未访问的患者
+    max_patients = 32
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._lock = threading.Lock()
+        self._probe = None
+        self._probe_ident = None
+        self._version = None
+        self._generations = {}
+        # patient_id -> {'payload': 完整 payload 或 None, 'entries': {key: CachedPayload}}
+        self._patients = {}
+
+    def _current_version(self):
+        st = os.stat(self.db_path)
+        ident = (st.st_dev, st.st_ino)
+        if self._probe is None or self._probe_ident != ident:
+            if self._probe is not None:
+                self._probe.close()
+            self._probe = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._probe_ident = ident
+        return ident, self._probe.execute('PRAGMA data_version').fetchone()[0]
+
+    def _refresh(self):
+        version = self._current_version()
+        if version == self._version:
+            return
+        generations = dict(self._probe.execute(GENERATIONS_SQL))
+        if self._version is None or version[0] != self._version[0]:
+            # 首次或换了库文件：全部失效
+            self._patients = {}
+        else:
+            # 只丢弃代数变化（或已删除）的患者
+            for pid in [pid for pid in self._patients if generations.get(pid) != self._generations.get(pid)]:
+                del self._patients[pid]
+        self._generations = generations
+        self._version = version
+
+    def _state(self, patient_id):
+        state = self._patients.pop(patient_id, None)
+        if state is None:
+            if len(self._patients) >= self.max_patients:
+                self._patients.pop(next(iter(self._patients)))
+            state = {'payload': None, 'entries': {}}
+        # 重新插入到末尾：字典顺序即最近访问顺序
+        self._patients[patient_id] = state
+        return state
+
+    def _entry(self, state, key, make):
+        entries = state['entries']
+        entry = entries.get(key)
+        if entry is None:
+            if len(entries) >= self.max_entries:
+                entries.pop(next(iter(entries)))
+            entry = entries[key] = CachedPayload(serialize_payload(make()))
+        return entry
+
+    def get(self, build, fmt='full', patient_id: int = DEFAULT_PATIENT_ID) -> CachedPayload:
+        """Return the patient's cached entry for ``fmt`` (a key of VIEWS),
+        calling build() for a fresh payload when their data has changed."""
+        with self._lock:
+            self._refresh()
+            state = self._state(patient_id)
+            if state['payload'] is None:
+                state['payload'] = build()
+            return self._entry(state, fmt, lambda: VIEWS[fmt](state['payload']))
+
+    def get_query(self, key, build, patient_id: int = DEFAULT_PATIENT_ID) -> CachedPayload:
+        """Return the patient's cached entry for a filtered query; build()
+        returns the payload to serialize. Invalidated together with that
+        patient's full payload."""
+        with self._lock:
+            self._refresh()
+            return self._entry(self._state(patient_id), key, build)
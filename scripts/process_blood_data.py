@@ -1,11 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import csv
+import gc
+import io
 import json
+import math
 import os
 import re
 from collections import defaultdict, Counter
+from contextlib import contextmanager
 from datetime import datetime, date
+from functools import lru_cache
+from operator import itemgetter
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:  # 无 numpy 时逐格计算，输出与矩阵路径逐字节相同
+    _HAS_NUMPY = False
+
+from indicator_names import merge_name
+from output_manifest import write_outputs
 
 SRC_PATH = "/Users/ericzhou/MyStudio/Trae_projects/ZHL/化疗周期血常规数据.csv"
 OUT_DIR = "/Users/ericzhou/MyStudio/Trae_projects/ZHL/data_processed"
@@ -20,27 +35,36 @@ FIELDS = ["报告单号", "报告日期", "检测指标", "结果", "状态", "
 
 REF_RE = re.compile(r"^\s*([0-9]+(?:\.[0-9]+)?)\s*~\s*([0-9]+(?:\.[0-9]+)?)\s*$")
 
-# 指标同义词归并：将“绝对值/绝对数”归整到“计数”
-# 注意：不归并诸如“不典型淋巴细胞绝对数”“巨大未成熟细胞绝对值”等特殊项目
-INDICATOR_SYNONYMS = {
-    '中性粒细胞绝对值': '中性粒细胞计数',
-    '淋巴细胞绝对值': '淋巴细胞计数',
-    '单核细胞绝对值': '单核细胞计数',
-    '嗜酸性粒细胞绝对值': '嗜酸性粒细胞计数',
-    '嗜碱性粒细胞绝对值': '嗜碱性粒细胞计数',
-    '有核红细胞绝对值': '有核红细胞计数',
-    # RBC 统一到“红细胞”
-    'rbc': '红细胞', '红细胞数': '红细胞', '红细胞计数': '红细胞',
-}
+# 标记编码：矩阵中按整数存放
+FLAG_CHARS = ("-", "↑", "↓")
+FLAG_CODES = {c: i for i, c in enumerate(FLAG_CHARS)}
+FLAG_UP, FLAG_DOWN = FLAG_CODES["↑"], FLAG_CODES["↓"]
+
+# 指标同义词归并（“绝对值”→“计数”、RBC→“红细胞”）见 indicator_synonyms.json 的 merge 表；
+# 不归并诸如“不典型淋巴细胞绝对数”“巨大未成熟细胞绝对值”等特殊项目
+canonical_indicator_name = merge_name
+
 
-def canonical_indicator_name(name: str) -> str:
-    name = (name or '').strip()
-    return INDICATOR_SYNONYMS.get(name, name)
+def _canonical_date(s: str, sep: str):
+    # s 为补零的 YYYY{sep}MM{sep}DD 时直接得到日期（与 strptime 结果相同），否则 None 交给 strptime
+    if len(s) != 10 or s[4] != sep or s[7] != sep:
+        return None
+    iso = s.replace(sep, "-")
+    try:
+        d = date.fromisoformat(iso)
+    except ValueError:
+        return None
+    return d if d.isoformat() == iso else None
 
 
+# 同一日期、参考值字符串在各指标行中反复出现，按原始字符串缓存解析结果
+@lru_cache(maxsize=None)
 def parse_date(s: str) -> str:
     # normalize to YYYY-MM-DD
     s = s.strip()
+    d = _canonical_date(s, "-") or _canonical_date(s, ".")
+    if d is not None:
+        return d.isoformat()
     try:
         dt = datetime.strptime(s, "%Y-%m-%d")
         return dt.date().isoformat()
@@ -64,6 +88,7 @@ def parse_value(s: str):
         return s
 
 
+@lru_cache(maxsize=None)
 def parse_ref_interval(ref_str: str):
     if not ref_str:
         return None
@@ -87,62 +112,237 @@ def chemo_phase_label(d: date) -> str:
     return f"第{cycle}次化疗d{day_in_cycle}"
 
 
-def load_rows():
-    rows = []
-    with open(SRC_PATH, "r", encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        # Validate header
-        if reader.fieldnames != FIELDS:
-            # try to map by position if header differs slightly
-            mapping = {FIELDS[i]: name for i, name in enumerate(reader.fieldnames or [])}
-        for r in reader:
-            # normalize fields
-            rec = {key: r.get(key, "").strip() for key in FIELDS}
-            rows.append(rec)
-    return rows
-
-
-def process():
-    rows = load_rows()
-    # Collect sets
-    indicators = []
-    indicator_set = set()
-    dates = set()
-
-    # Data map: (indicator, date) -> {value, status, unit, ref_str}
-    data_map = {}
-
-    # For ref and unit unification
+@contextmanager
+def _gc_paused():
+    # 载入与建矩阵一次性创建十余万个存活的行列表与元组，期间暂停循环垃圾回收，免得分代回收反复扫描它们
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def load_columns():
+    """Source columns as lists of raw (unstripped) strings, keyed by FIELDS
+    (报告单号 is not used and left out)."""
+    with open(SRC_PATH, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None) or []
+        rows = list(filter(None, reader))
+    # 按列名取值（与 DictReader 一致：重名列取最后一列，缺失列或短行视为空）
+    pos = {name: i for i, name in enumerate(header)}
+    width = len(header)
+    if rows and min(map(len, rows)) < width:
+        rows = [r + [""] * (width - len(r)) for r in rows]
+    return {key: list(map(itemgetter(pos[key]), rows)) if key in pos else [""] * len(rows) for key in FIELDS[1:]}
+
+
+def build_matrix(columns):
+    """Indicator x date matrix of the last row per (indicator, date).
+
+    Returns (indicators, sorted_dates, cells, unit counters, ref counters).
+    cells describes the present cells in row-major order: ``index`` (flat
+    i * D + j), ``numeric`` (float, NaN for non-numeric results), ``is_num``,
+    ``status_code`` (FLAG_CODES of the raw status, "-" otherwise),
+    ``status_id`` (index into ``status_texts``, the JSON texts of the
+    distinct statuses) and the texts ``text`` (pivot CSV) and
+    ``value_json``. With numpy the non-text columns are arrays, otherwise
+    everything is a list.
+    """
+    # 逐列解析：每个不同的原始字符串（指标名、日期、结果、状态）只解析一次，再按编号查表
+    raw_names, name_ids = _encode(columns["检测指标"])
+    ind_index = {}
+    # 编号按首次出现顺序：指标顺序与逐行遍历时一致
+    name_ind = [ind_index.setdefault(canonical_indicator_name(raw.strip()), len(ind_index)) for raw in raw_names]
+    indicators = list(ind_index)
+
+    # 计数保持各取值首次出现的顺序，most_common 的并列取舍与逐行累加一致
     unit_counter_by_ind = defaultdict(Counter)
-    ref_counter_by_ind = defaultdict(Counter)
-
-    for r in rows:
-        # 归并到标准指标名称
-        ind = canonical_indicator_name(r["检测指标"].strip())
-        dt_str = parse_date(r["报告日期"])  # normalized
-        val = parse_value(r["结果"])  # float or str
-        status = r["状态"].strip()
-        ref_str = r["参考值"].strip()
-        unit = r["单位"].strip()
-
-        if ind not in indicator_set:
-            indicator_set.add(ind)
-            indicators.append(ind)
-        dates.add(dt_str)
-
-        key = (ind, dt_str)
-        data_map[key] = {
-            "value": val,
-            "status": status,
-            "unit": unit,
-            "ref_str": ref_str,
-        }
+    for (n, unit), count in Counter(zip(name_ids, columns["单位"])).items():
+        unit = unit.strip()
         if unit:
-            unit_counter_by_ind[ind][unit] += 1
+            unit_counter_by_ind[indicators[name_ind[n]]][unit] += count
+    ref_counter_by_ind = defaultdict(Counter)
+    for (n, ref_str), count in Counter(zip(name_ids, columns["参考值"])).items():
+        ref_str = ref_str.strip()
         if ref_str and parse_ref_interval(ref_str):
-            ref_counter_by_ind[ind][ref_str] += 1
+            ref_counter_by_ind[indicators[name_ind[n]]][ref_str] += count
+
+    raw_dates, date_ids = _encode(columns["报告日期"])
+    normalized = [parse_date(raw) for raw in raw_dates]
+    sorted_dates = sorted(set(normalized))
+    date_pos = {d: j for j, d in enumerate(sorted_dates)}
+    date_col = [date_pos[d] for d in normalized]
+    width = len(sorted_dates)
+
+    # 结果：(是否数值, 数值, 透视表文本 f"{val}", JSON 文本)
+    raw_results, result_ids = _encode(columns["结果"])
+    values = list(map(parse_value, raw_results))
+    is_num = [type(val) is float for val in values]
+    numeric = [val if num else math.nan for val, num in zip(values, is_num)]
+    # 状态取值很少：JSON 文本与标记编码按取值各算一次
+    raw_statuses, status_ids = _encode(columns["状态"])
+    statuses = [raw.strip() for raw in raw_statuses]
+
+    # 同一 (指标, 日期) 出现多行时以最后一行为准；保留的格按行主序排列
+    if _HAS_NUMPY:
+        flat = (np.array(name_ind, dtype=np.intp)[np.array(name_ids, dtype=np.intp)] * width
+                + np.array(date_col, dtype=np.intp)[np.array(date_ids, dtype=np.intp)])
+        index, last = np.unique(flat[::-1], return_index=True)
+        keep = len(flat) - 1 - last
+        kept_results = np.array(result_ids, dtype=np.intp)[keep]
+        kept_statuses = np.array(status_ids, dtype=np.intp)[keep]
+        cells = {
+            "index": index.astype(np.intp),
+            "is_num": np.array(is_num, dtype=bool)[kept_results],
+            "numeric": np.array(numeric, dtype=float)[kept_results],
+            "status_id": kept_statuses,
+            "status_code": np.array([FLAG_CODES.get(st, 0) for st in statuses], dtype=np.int8)[kept_statuses],
+        }
+    else:
+        last = {name_ind[n] * width + date_col[d]: r for r, (n, d) in enumerate(zip(name_ids, date_ids))}
+        index = sorted(last)
+        keep = [last[k] for k in index]
+        kept_results = [result_ids[r] for r in keep]
+        kept_statuses = [status_ids[r] for r in keep]
+        cells = {
+            "index": index,
+            "is_num": _take(is_num, kept_results),
+            "numeric": _take(numeric, kept_results),
+            "status_id": kept_statuses,
+            "status_code": _take([FLAG_CODES.get(st, 0) for st in statuses], kept_statuses),
+        }
+    cells["text"] = _take([f"{val}" for val in values], kept_results)
+    cells["value_json"] = _take(list(map(_json_value, values)), kept_results)
+    cells["status_texts"] = [json.dumps(st, ensure_ascii=False) for st in statuses]
+    return indicators, sorted_dates, cells, unit_counter_by_ind, ref_counter_by_ind
+
+
+def _encode(items):
+    # (按首次出现顺序排列的不同取值, 每项在其中的编号)
+    table = list(dict.fromkeys(items))
+    ids = dict(zip(table, range(len(table))))
+    return table, list(map(ids.__getitem__, items))
+
+
+def _object_array(items):
+    arr = np.empty(len(items), dtype=object)
+    arr[:] = items
+    return arr
+
+
+def compute_flags(cells, width, lower, upper):
+    """Flag codes of the present cells: numeric cells of indicators with both
+    unified bounds are compared against them, all others keep their raw
+    status ("-" unless it is ↑/↓). lower/upper hold one bound per indicator
+    (NaN when missing)."""
+    if _HAS_NUMPY:
+        rows = cells["index"] // width
+        lo = np.asarray(lower, dtype=float)[rows]
+        hi = np.asarray(upper, dtype=float)[rows]
+        numeric = cells["numeric"]
+        with np.errstate(invalid="ignore"):
+            derived = np.where(numeric < lo, FLAG_DOWN, np.where(numeric > hi, FLAG_UP, FLAG_CODES["-"]))
+        comparable = cells["is_num"] & ~np.isnan(lo) & ~np.isnan(hi)
+        return np.where(comparable, derived, cells["status_code"]).astype(np.int8)
+    flags = []
+    for k, num, val, code in zip(cells["index"], cells["is_num"], cells["numeric"], cells["status_code"]):
+        lo, hi = lower[k // width], upper[k // width]
+        if num and not (math.isnan(lo) or math.isnan(hi)):
+            code = FLAG_DOWN if val < lo else FLAG_UP if val > hi else FLAG_CODES["-"]
+        flags.append(code)
+    return flags
+
+
+def dense_rows(index, values, n_rows, width):
+    """Scatter per-cell values into n_rows lists of ``width`` cells ("" where absent)."""
+    if _HAS_NUMPY:
+        grid = np.full(n_rows * width, "", dtype=object)
+        grid[index] = values
+        return grid.reshape(n_rows, width).tolist()
+    grid = [""] * (n_rows * width)
+    for k, v in zip(index, values):
+        grid[k] = v
+    return [grid[i * width:(i + 1) * width] for i in range(n_rows)]
+
+
+def _json_value(val) -> str:
+    # 与 json.dumps(..., ensure_ascii=False) 对单个值的输出一致
+    if isinstance(val, float) and math.isfinite(val):
+        return repr(val)
+    return json.dumps(val, ensure_ascii=False)
+
+
+def _dumps(value, level: int) -> str:
+    # json.dumps(indent=2) 中位于第 level 层的取值
+    return json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n" + "  " * level)
+
+
+POINT_KEYS = ("date", "value", "status", "flag", "phase")
+# series 中每个点（indent=2 的第 4 层）在各取值之间的固定文本，由 json.dumps 本身生成，排版与之一致
+POINT_PARTS = ("  " * 4 + _dumps(dict.fromkeys(POINT_KEYS, 0), 4)).split("0")
+
+
+def point_texts(cells, width, flags, sorted_dates) -> list:
+    """Texts of the present cells as json.dumps(indent=2) lays out their
+    series points inside data.json, in row-major order."""
+    # 每个点 = 日期段 + 数值 + 状态/标记段 + 阶段段：日期与阶段标签按日期各算一次，
+    # 状态/标记段按 (状态, 标记) 组合各算一次，逐点只剩三次拼接
+    p = POINT_PARTS
+    heads = [p[0] + json.dumps(d, ensure_ascii=False) + p[1] for d in sorted_dates]
+    tails = [p[4] + json.dumps(date_phase(d), ensure_ascii=False) + p[5] for d in sorted_dates]
+    middles = [p[2] + status + p[3] + json.dumps(flag, ensure_ascii=False)
+               for status in cells["status_texts"] for flag in FLAG_CHARS]
+    if _HAS_NUMPY:
+        cols = cells["index"] % width
+        combos = cells["status_id"] * len(FLAG_CHARS) + flags
+    else:
+        cols = [k % width for k in cells["index"]]
+        combos = [s * len(FLAG_CHARS) + f for s, f in zip(cells["status_id"], flags)]
+    return [a + b + c + d for a, b, c, d in
+            zip(_take(heads, cols), cells["value_json"], _take(middles, combos), _take(tails, cols))]
+
+
+def dumps_dashboard(head: dict, indicators: dict, points: dict) -> str:
+    """json.dumps(dash, ensure_ascii=False, indent=2) of head + {"indicators":
+    {name: meta + {"series": [...]}}}, with each series given as the point
+    texts from point_texts()."""
+    out = ["{"]
+    for key, value in head.items():
+        out.append("\n  %s: %s," % (_dumps(key, 1), _dumps(value, 1)))
+    if not indicators:
+        out.append('\n  "indicators": {}\n}')
+        return "".join(out)
+    out.append('\n  "indicators": {')
+    for n, (name, meta) in enumerate(indicators.items()):
+        out.append("\n    %s: {" % _dumps(name, 2))
+        for key, value in meta.items():
+            out.append("\n      %s: %s," % (_dumps(key, 3), _dumps(value, 3)))
+        series = points[name]
+        out.append('\n      "series": %s\n    }' % ("[\n" + ",\n".join(series) + "\n      ]" if series else "[]"))
+        if n < len(indicators) - 1:
+            out.append(",")
+    out.append("\n  }\n}")
+    return "".join(out)
+
+
+def date_phase(dt_str: str) -> str:
+    d = _canonical_date(dt_str, "-")
+    if d is not None:
+        return chemo_phase_label(d)
+    try:
+        d = datetime.strptime(dt_str, "%Y-%m-%d").date()
+        return chemo_phase_label(d)
+    except Exception:
+        return ""
 
-    sorted_dates = sorted(list(dates))
+
+def process():
+    with _gc_paused():
+        indicators, sorted_dates, cells, unit_counter_by_ind, ref_counter_by_ind = build_matrix(load_columns())
+    width = len(sorted_dates)
 
     # Build unified ref per indicator
     unified_ref = {}
@@ -166,61 +366,33 @@ def process():
             "upper": ref_interval[1] if ref_interval else None,
         }
 
+    # 标记只算一次：按统一参考区间整体比较，异常标记 CSV 与 JSON 共用
+    lower = [math.nan if unified_ref[ind]["lower"] is None else unified_ref[ind]["lower"] for ind in indicators]
+    upper = [math.nan if unified_ref[ind]["upper"] is None else unified_ref[ind]["upper"] for ind in indicators]
+    flags = compute_flags(cells, width, lower, upper)
+    header = ["检测指标"] + sorted_dates
+
     # Write pivot CSV
     pivot_path = os.path.join(OUT_DIR, "化疗周期血常规数据_透视表.csv")
-    with open(pivot_path, "w", encoding="utf-8-sig", newline="") as f:
+    with io.StringIO(newline="") as f:
         writer = csv.writer(f)
-        header = ["检测指标"] + sorted_dates
         writer.writerow(header)
-        for ind in indicators:
-            row = [ind]
-            for dt_str in sorted_dates:
-                entry = data_map.get((ind, dt_str))
-                if not entry:
-                    row.append("")
-                else:
-                    val = entry["value"]
-                    # keep numeric as string for CSV
-                    if isinstance(val, float):
-                        row.append(f"{val}")
-                    else:
-                        row.append(f"{val}")
-            writer.writerow(row)
+        rows = dense_rows(cells["index"], cells["text"], len(indicators), width)
+        writer.writerows([ind] + row for ind, row in zip(indicators, rows))
+        changed = write_outputs([pivot_path], [f.getvalue().encode("utf-8-sig")])
 
     # Write abnormal-flag CSV
     abn_path = os.path.join(OUT_DIR, "化疗周期血常规数据_异常标记.csv")
-    with open(abn_path, "w", encoding="utf-8-sig", newline="") as f:
+    with io.StringIO(newline="") as f:
         writer = csv.writer(f)
-        header = ["检测指标"] + sorted_dates
         writer.writerow(header)
-        for ind in indicators:
-            lower = unified_ref[ind]["lower"]
-            upper = unified_ref[ind]["upper"]
-            row = [ind]
-            for dt_str in sorted_dates:
-                entry = data_map.get((ind, dt_str))
-                if not entry:
-                    row.append("")
-                    continue
-                val = entry["value"]
-                status = entry["status"]
-                flag = "-"
-                if isinstance(val, float) and lower is not None and upper is not None:
-                    if val < lower:
-                        flag = "↓"
-                    elif val > upper:
-                        flag = "↑"
-                    else:
-                        flag = "-"
-                else:
-                    # fallback to provided status
-                    flag = status if status in {"-", "↑", "↓"} else "-"
-                row.append(flag)
-            writer.writerow(row)
+        rows = dense_rows(cells["index"], _take(FLAG_CHARS, flags), len(indicators), width)
+        writer.writerows([ind] + row for ind, row in zip(indicators, rows))
+        changed += write_outputs([abn_path], [f.getvalue().encode("utf-8-sig")])
 
     # Write unified reference ranges CSV
     ref_out_path = os.path.join(OUT_DIR, "参考区间标准化.csv")
-    with open(ref_out_path, "w", encoding="utf-8-sig", newline="") as f:
+    with io.StringIO(newline="") as f:
         writer = csv.writer(f)
         writer.writerow(["检测指标", "参考下限", "参考上限", "单位", "参考值来源"])
         for ind in indicators:
@@ -233,68 +405,42 @@ def process():
                 unit,
                 ur["ref_str"] if ur["ref_str"] else "",
             ])
+        changed += write_outputs([ref_out_path], [f.getvalue().encode("utf-8-sig")])
 
     # Build dashboard JSON
-    dash = {
+    points = point_texts(cells, width, flags, sorted_dates)
+    # 保留的格按行主序排列：各指标的点连续且按日期升序
+    if _HAS_NUMPY:
+        counts = dict(enumerate(np.bincount(cells["index"] // width, minlength=len(indicators)).tolist()))
+    else:
+        counts = Counter(k // width for k in cells["index"])
+    series = {}
+    start = 0
+    for i, ind in enumerate(indicators):
+        series[ind] = points[start:start + counts.get(i, 0)]
+        start += counts.get(i, 0)
+    head = {
         "start_date": CHEMO_START_DATE.isoformat(),
         "cycle_length_days": CYCLE_LENGTH_DAYS,
         "dates": sorted_dates,
-        "indicators": {},
     }
+    meta = {ind: {"unit": unified_unit[ind], "ref": {"lower": unified_ref[ind]["lower"],
+                                                     "upper": unified_ref[ind]["upper"]}}
+            for ind in indicators}
+    changed += write_outputs([DASHBOARD_DATA_PATH], [dumps_dashboard(head, meta, series)])
 
-    # Prepare series per indicator
-    for ind in indicators:
-        unit = unified_unit[ind]
-        ur = unified_ref[ind]
-        series = []
-        for dt_str in sorted_dates:
-            entry = data_map.get((ind, dt_str))
-            if not entry:
-                continue
-            val = entry["value"]
-            status = entry["status"]
-            # compute flag using unified ref when available
-            lower = ur["lower"]
-            upper = ur["upper"]
-            flag = status if status in {"-", "↑", "↓"} else "-"
-            if isinstance(val, float) and lower is not None and upper is not None:
-                if val < lower:
-                    flag = "↓"
-                elif val > upper:
-                    flag = "↑"
-                else:
-                    flag = "-"
-            # phase
-            try:
-                d = datetime.strptime(dt_str, "%Y-%m-%d").date()
-                phase = chemo_phase_label(d)
-            except Exception:
-                phase = ""
-            series.append({
-                "date": dt_str,
-                "value": val,
-                "status": status,
-                "flag": flag,
-                "phase": phase,
-            })
-        dash["indicators"][ind] = {
-            "unit": unit,
-            "ref": {
-                "lower": ur["lower"],
-                "upper": ur["upper"],
-            },
-            "series": series,
-        }
+    # 内容与现有文件逐字节相同的输出不重写（保持 mtime），哈希记录在 dist/manifest.json
+    print("Written:")
+    for path in (pivot_path, abn_path, ref_out_path, DASHBOARD_DATA_PATH):
+        print("-", path if path in changed else f"{path} (unchanged)")
 
-    with open(DASHBOARD_DATA_PATH, "w", encoding="utf-8") as f:
-        json.dump(dash, f, ensure_ascii=False, indent=2)
 
-    print("Written:")
-    print("-", pivot_path)
-    print("-", abn_path)
-    print("-", ref_out_path)
-    print("-", DASHBOARD_DATA_PATH)
+def _take(table, codes):
+    # table[code] for each code
+    if _HAS_NUMPY:
+        return _object_array(table)[np.asarray(codes, dtype=np.intp)].tolist()
+    return list(map(table.__getitem__, codes))
 
 
 if __name__ == "__main__":
-    process()
\ No newline at end of file
+    process()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import base64
+import hashlib
 import json
 import os
 import sys
@@ -19,7 +20,7 @@ EXACT_EXCLUDES = {
     'dist/publish.log'
 }
 DIR_EXCLUDES = {
-    '.git', '.venv', '__pycache__', 'node_modules', 'origin_ocr_csv_files'
+    '.git', '.venv', '__pycache__', 'node_modules', 'origin_ocr_csv_files', 'dist/site'
 }
 SUFFIX_EXCLUDES = {'.pyc'}
 
@@ -90,11 +91,20 @@ def get_file_sha(token, path):
         return data.get('sha')
     return None
 
+def git_blob_sha(content: bytes) -> str:
+    # 与 GitHub contents API 返回的 sha 相同（git blob 对象哈希）
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
 def upload_file(token, rel_path, message):
     abs_path = ROOT / rel_path
     with open(abs_path, 'rb') as f:
-        b64 = base64.b64encode(f.read()).decode('utf-8')
+        content = f.read()
     sha = get_file_sha(token, rel_path.as_posix())
+    if sha == git_blob_sha(content):
+        # 内容未变：跳过，避免产生空提交
+        print(f'未变化: {rel_path}')
+        return None
+    b64 = base64.b64encode(content).decode('utf-8')
     data = {
         'message': message,
         'content': b64,
@@ -146,14 +156,16 @@ def main():
     else:
         targets = [p for p in ROOT.rglob('*') if p.is_file() and not should_exclude(p)]
 
-    uploaded = 0
+    uploaded = skipped = 0
     for p in targets:
         rel = p.relative_to(ROOT)
         msg = f'Publish {rel.as_posix()} (via API)'
         ok = upload_file(token, rel, msg)
         if ok:
             uploaded += 1
-    print(f'完成上传 {uploaded} 个文件')
+        elif ok is None:
+            skipped += 1
+    print(f'完成上传 {uploaded} 个文件，{skipped} 个未变化已跳过')
     # 清理不应提交的文件（与 .gitignore 保持一致）
     delete_file(token, 'db/zhl.sqlite3', 'Remove db file (ignore)')
     delete_file(token, 'dist/publish.log', 'Remove local log')
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
 try:
     from flask_cors import CORS
     _HAS_CORS = True
@@ -7,6 +7,12 @@ except Exception:
 import sqlite3
 from pathlib import Path
 
+from cycle_summary import cycles_view, has_cycle_summaries, refresh_stale_cycle_summaries
+from http_encoding import brotli_available, choose_encoding
+from migrate_to_db import apply_migrations
+from patients import DEFAULT_PATIENT_ID, list_patients, patient_exists, touch_patients
+from payload_builder import FORMATS, PayloadCache, build_payload, get_connection, parse_date_param
+
 BASE = Path(__file__).resolve().parent.parent
 DB_PATH = BASE / 'db' / 'zhl.sqlite3'
 
@@ -22,87 +28,132 @@ else:
         return resp
 
 def get_conn():
-    return sqlite3.connect(DB_PATH)
+    # 每个工作线程复用同一连接，语句缓存随连接保留
+    return get_connection(DB_PATH)
+
+# 序列化后的 payload 缓存（按患者）；仅在该患者的数据有新提交（导入/迁移）后重建
+payload_cache = PayloadCache(DB_PATH)
+CODINGS = ('gzip', 'br') if brotli_available() else ('gzip',)
+
+def send_cached(entry):
+    coding = choose_encoding(request.headers.get('Accept-Encoding'), CODINGS)
+    etag = entry.etag_for(coding)
+    # 任一编码表示的 ETag 都代表同一内容
+    if any(request.if_none_match.contains(entry.etag_for(c)) for c in (None,) + CODINGS):
+        resp = Response(status=304)
+    else:
+        resp = Response(entry.encoded(coding), mimetype='application/json')
+        if coding:
+            resp.headers['Content-Encoding'] = coding
+    resp.set_etag(etag)
+    resp.headers['Vary'] = 'Accept-Encoding'
+    # 允许浏览器缓存但每次携带 If-None-Match 复核
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+def request_format():
+    fmt = request.args.get('format', 'full')
+    return fmt if fmt in FORMATS else None
+
+def request_names():
+    # names 可重复出现，也可逗号分隔
+    return sorted({n.strip() for v in request.args.getlist('names') for n in v.split(',') if n.strip()})
+
+def request_patient():
+    # ?patient=<id>，省略时为默认患者；返回 (patient_id, 错误响应)
+    raw = request.args.get('patient')
+    if not raw:
+        return DEFAULT_PATIENT_ID, None
+    try:
+        patient_id = int(raw)
+    except ValueError:
+        return None, (jsonify({'error': f'patient must be an integer: {raw}'}), 400)
+    if not patient_exists(get_conn(), patient_id):
+        return None, (jsonify({'error': f'unknown patient: {patient_id}'}), 404)
+    return patient_id, None
 
 @app.route('/api/data')
 def api_data():
-    conn = get_conn()
+    # ?format=columnar 返回列式紧凑格式（共享日期轴 + 整数编码标记）
+    fmt = request_format()
+    if fmt is None:
+        return jsonify({'error': f'unknown format: {request.args.get("format")}'}), 400
+    return send_cached(payload_cache.get(lambda: build_payload(get_conn()), fmt))
+
+@app.route('/api/indicators')
+def api_indicators():
+    # 仅元数据（单位、参考范围、点数、首末日期），不含序列；?patient= 指定患者
+    patient_id, error = request_patient()
+    if error:
+        return error
+    return send_cached(payload_cache.get(
+        lambda: build_payload(get_conn(), patient_id=patient_id), 'indicators', patient_id))
+
+@app.route('/api/trends')
+def api_trends():
+    # 预计算的 LOESS / 线性趋势（trends.py），随 payload 按数据版本缓存
+    patient_id, error = request_patient()
+    if error:
+        return error
+    return send_cached(payload_cache.get(
+        lambda: build_payload(get_conn(), patient_id=patient_id), 'trends', patient_id))
+
+@app.route('/api/series')
+def api_series():
+    # /api/series?names=a,b&from=YYYY-MM-DD&to=YYYY-MM-DD&patient=<id>，names 可重复出现
+    fmt = request_format()
+    if fmt is None:
+        return jsonify({'error': f'unknown format: {request.args.get("format")}'}), 400
+    patient_id, error = request_patient()
+    if error:
+        return error
+    names = request_names()
+    if not names:
+        return jsonify({'error': 'names is required'}), 400
     try:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        # meta
-        cur.execute('SELECT key, value FROM meta')
-        meta_rows = cur.fetchall()
-        meta = {row['key']: row['value'] for row in meta_rows}
-
-        # dates
-        cur.execute('SELECT date FROM dates ORDER BY date')
-        dates = [row['date'] for row in cur.fetchall()]
-
-        # indicators
-        cur.execute('SELECT id, name, unit, ref_lower, ref_upper FROM indicators ORDER BY name')
-        inds = cur.fetchall()
-
-        indicators = {}
-        for ind in inds:
-            ind_id = ind['id']
-            name = ind['name']
-            unit = ind['unit'] or ''
-            ref = {}
-            if ind['ref_lower'] is not None or ind['ref_upper'] is not None:
-                ref = {
-                    'lower': ind['ref_lower'],
-                    'upper': ind['ref_upper']
-                }
-            ref_lower = ind['ref_lower']
-            ref_upper = ind['ref_upper']
-
-            cur.execute('''
-                SELECT d.date as date, m.value as value, m.status as status, m.flag as flag, m.phase as phase
-                FROM measurements m JOIN dates d ON m.date_id = d.id
-                WHERE m.indicator_id = ?
-                ORDER BY d.date
-            ''', (ind_id,))
-            series = []
-            for row in cur.fetchall():
-                v = row['value']
-                status = row['status']
-                flag = row['flag']
-                # 回退推断：当数据库缺失标记时，基于参考范围派生
-                if (flag is None or str(flag).strip() == '') and v is not None and (ref_lower is not None or ref_upper is not None):
-                    if ref_lower is not None and v < ref_lower:
-                        flag = '↓'
-                        status = status or '低'
-                    elif ref_upper is not None and v > ref_upper:
-                        flag = '↑'
-                        status = status or '高'
-                    else:
-                        flag = '-'
-                        status = status or '正常'
-                series.append({
-                    'date': row['date'],
-                    'value': v,
-                    'status': status,
-                    'flag': flag,
-                    'phase': row['phase']
-                })
-
-            indicators[name] = {
-                'unit': unit,
-                'ref': ref,
-                'series': series
-            }
-
-        payload = {
-            'start_date': meta.get('start_date'),
-            'cycle_length_days': int(meta.get('cycle_length_days')) if meta.get('cycle_length_days') else None,
-            'dates': dates,
-            'indicators': indicators
-        }
-        return jsonify(payload)
-    finally:
-        conn.close()
+        date_from = parse_date_param(request.args['from']) if request.args.get('from') else None
+        date_to = parse_date_param(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from/to must be dates (YYYY-MM-DD)'}), 400
+    key = ('series', fmt, tuple(names), date_from, date_to)
+    entry = payload_cache.get_query(
+        key, lambda: FORMATS[fmt](build_payload(get_conn(), names, date_from, date_to, patient_id)), patient_id)
+    return send_cached(entry)
+
+@app.route('/api/cycles')
+def api_cycles():
+    # /api/cycles?names=a,b&patient=<id>：每指标每周期一行的预计算汇总（cycle_summary.py），names 可省略
+    if not has_cycle_summaries(get_conn()):
+        return jsonify({'error': 'cycle summaries not available; run migrate_to_db.py'}), 404
+    patient_id, error = request_patient()
+    if error:
+        return error
+    names = request_names()
+    entry = payload_cache.get_query(
+        ('cycles', tuple(names)), lambda: cycles_view(get_conn(), names or None, patient_id), patient_id)
+    return send_cached(entry)
+
+@app.route('/api/patients')
+def api_patients():
+    return jsonify({'patients': list_patients(get_conn())})
+
+@app.route('/api/patients/<int:patient_id>/data')
+def api_patient_data(patient_id):
+    # 与 /api/data 相同的 payload，按患者构建与缓存；默认患者与 /api/data 共用缓存
+    fmt = request_format()
+    if fmt is None:
+        return jsonify({'error': f'unknown format: {request.args.get("format")}'}), 400
+    if not patient_exists(get_conn(), patient_id):
+        return jsonify({'error': f'unknown patient: {patient_id}'}), 404
+    return send_cached(payload_cache.get(lambda: build_payload(get_conn(), patient_id=patient_id), fmt, patient_id))
 
 if __name__ == '__main__':
+    # 缓存失效依赖 patients 表：启动前把旧库升级到当前版本，并补建缺失的周期汇总
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        apply_migrations(conn)
+        touch_patients(conn, refresh_stale_cycle_summaries(conn))
+        conn.commit()
+    finally:
+        conn.close()
     app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
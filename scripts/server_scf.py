@@ -1,98 +1,206 @@
+import base64
 import json
-import sqlite3
+import re
+import time
 from pathlib import Path
 
-BASE = Path(__file__).resolve().parent.parent
-DB_PATH = BASE / 'db' / 'zhl.sqlite3'
+# 模块开始载入的时刻：冷启动首个调用的指标附带初始化各阶段耗时，区分初始化与请求本身
+_LOAD_T0 = time.perf_counter()
+
+from http_encoding import choose_encoding  # noqa: E402
+
+HERE = Path(__file__).resolve().parent
+BASE = HERE.parent
+# SCF 包内 db/ 与本文件同级；在仓库中则位于上一级目录
+DB_PATH = HERE / 'db' / 'zhl.sqlite3'
+if not DB_PATH.exists():
+    DB_PATH = BASE / 'db' / 'zhl.sqlite3'
+# 构建时预渲染的 /api/data 响应（见 build_scf_zip.py），与 DB 同目录：
+# api_data.json / api_data.<format>.json 及其 .gz/.br/.etag
+# （api_data.indicators.* / api_data.trends.* 为 /api/indicators、/api/trends 的视图）
+PREBUILT_DIR = DB_PATH.parent
+PREBUILT_SUFFIXES = {None: '.json', 'gzip': '.json.gz', 'br': '.json.br'}
+INDEX_VIEW = 'indicators'
+TRENDS_VIEW = 'trends'
+# /api/series 按查询参数缓存的响应数上限
+MAX_QUERY_STATES = 64
+# /api/patients/<id>/data：默认患者用预渲染文件，其他患者按需从 DB 构建
+PATIENT_DATA_RE = re.compile(r'/api/patients/(\d+)/data$')
+DEFAULT_PATIENT_ID = 1  # 同 patients.DEFAULT_PATIENT_ID；热路径上不导入 sqlite3
+
+# 热启动状态：同一容器内的后续调用复用连接与已序列化的响应体
+_STATE = {
+    'conn': None,
+    'conn_path': None,
+    'payload': None,
+    # 无预渲染文件时按格式缓存从 DB 构建的响应：{format: {'bodies': {coding: body}, 'etag': str}}
+    # identity 响应体为文本，压缩表示为 base64 文本
+    'formats': {},
+    # /api/series 等参数化查询（含其他患者的 payload）：{key: 同上结构}
+    'queries': {},
+    'invocations': 0,
+    # 打开 DB 连接（含导入 sqlite3）的耗时，毫秒；冷启动首个调用的指标中报告
+    'conn_ms': None,
+}
+
+def _prebuilt_stem(fmt):
+    return 'api_data' if fmt == 'full' else 'api_data.' + fmt
+
+def _make_state(body, variants, etag):
+    bodies = {None: body.decode('utf-8')}
+    for coding, data in variants.items():
+        bodies[coding] = base64.b64encode(data).decode('ascii')
+    return {'bodies': bodies, 'etag': etag}
+
+def _load_prebuilt(prebuilt_dir):
+    """{format: state} of the prebuilt responses in ``prebuilt_dir``."""
+    # 存在预渲染文件时直接作为响应体，热路径上不再导入 sqlite3 / 查询数据库
+    prebuilt = {}
+    for etag_path in sorted(prebuilt_dir.glob('api_data*.etag')):
+        stem = etag_path.name[:-len('.etag')]
+        fmt = 'full' if stem == 'api_data' else stem[len('api_data.'):]
+        body_path = prebuilt_dir / (stem + PREBUILT_SUFFIXES[None])
+        if not body_path.exists():
+            continue
+        variants = {}
+        for coding, suffix in PREBUILT_SUFFIXES.items():
+            path = prebuilt_dir / (stem + suffix)
+            if coding and path.exists():
+                variants[coding] = path.read_bytes()
+        prebuilt[fmt] = _make_state(
+            body_path.read_bytes(), variants, etag_path.read_text(encoding='utf-8').strip())
+    return prebuilt
+
+# 预渲染响应与连接状态分开保存：打开/重开 DB 连接时不会丢弃它们
+_prebuilt_t0 = time.perf_counter()
+_PREBUILT = _load_prebuilt(PREBUILT_DIR)
+_HAS_PREBUILT = bool(_PREBUILT)
+# 初始化耗时（毫秒）：import_ms 在模块末尾写入
+_INIT = {'prebuilt_ms': (time.perf_counter() - _prebuilt_t0) * 1000}
+
+def _get_conn():
+    # 数据库随 zip 发布且不可变：只读 + immutable，跳过文件锁与变更检测
+    if _STATE['conn'] is None or _STATE['conn_path'] != DB_PATH:
+        t0 = time.perf_counter()
+        import sqlite3
+        if _STATE['conn'] is not None:
+            _STATE['conn'].close()
+        uri = Path(DB_PATH).resolve().as_uri() + '?mode=ro&immutable=1'
+        _STATE['conn'] = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        _STATE['conn_path'] = DB_PATH
+        _STATE['payload'] = None
+        _STATE['formats'] = {}
+        _STATE['queries'] = {}
+        _STATE['conn_ms'] = (time.perf_counter() - t0) * 1000
+    return _STATE['conn']
 
 def _query_payload():
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-
-        cur.execute('SELECT key, value FROM meta')
-        meta = {row['key']: row['value'] for row in cur.fetchall()}
-
-        cur.execute('SELECT date FROM dates ORDER BY date')
-        dates = [row['date'] for row in cur.fetchall()]
-
-        cur.execute('SELECT id, name, unit, ref_lower, ref_upper FROM indicators ORDER BY name')
-        inds = cur.fetchall()
-        indicators = {}
-        for ind in inds:
-            ind_id = ind['id']
-            name = ind['name']
-            unit = ind['unit'] or ''
-            ref = {}
-            if ind['ref_lower'] is not None or ind['ref_upper'] is not None:
-                ref = {
-                    'lower': ind['ref_lower'],
-                    'upper': ind['ref_upper']
-                }
-            ref_lower = ind['ref_lower']
-            ref_upper = ind['ref_upper']
-
-            cur.execute('''
-                SELECT d.date as date, m.value as value, m.status as status, m.flag as flag, m.phase as phase
-                FROM measurements m JOIN dates d ON m.date_id = d.id
-                WHERE m.indicator_id = ?
-                ORDER BY d.date
-            ''', (ind_id,))
-            series = []
-            for row in cur.fetchall():
-                v = row['value']
-                status = row['status']
-                flag = row['flag']
-                # 缺失标记时按参考范围派生，确保前端着色一致
-                if (flag is None or str(flag).strip() == '') and v is not None and (ref_lower is not None or ref_upper is not None):
-                    if ref_lower is not None and v < ref_lower:
-                        flag = '↓'
-                        status = status or '低'
-                    elif ref_upper is not None and v > ref_upper:
-                        flag = '↑'
-                        status = status or '高'
-                    else:
-                        flag = '-'
-                        status = status or '正常'
-                series.append({
-                    'date': row['date'],
-                    'value': v,
-                    'status': status,
-                    'flag': flag,
-                    'phase': row['phase']
-                })
-
-            indicators[name] = {
-                'unit': unit,
-                'ref': ref,
-                'series': series
-            }
-
-        payload = {
-            'start_date': meta.get('start_date'),
-            'cycle_length_days': int(meta.get('cycle_length_days')) if meta.get('cycle_length_days') else None,
-            'dates': dates,
-            'indicators': indicators
-        }
-        return payload
-    finally:
-        conn.close()
+    from payload_builder import build_payload
+    return build_payload(_get_conn())
+
+def _format_state(fmt):
+    """Response bodies and ETag for ``fmt``; queries the DB only without prebuilt bodies.
+
+    Returns None for an unknown format."""
+    if _HAS_PREBUILT:
+        return _PREBUILT.get(fmt)
+    conn = _get_conn()
+    state = _STATE['formats'].get(fmt)
+    if state is None:
+        from http_encoding import compress_variants
+        from payload_builder import VIEWS, CachedPayload, build_payload, serialize_payload
+        if fmt not in VIEWS:
+            return None
+        if _STATE['payload'] is None:
+            _STATE['payload'] = build_payload(conn)
+        entry = CachedPayload(serialize_payload(VIEWS[fmt](_STATE['payload'])))
+        state = _STATE['formats'][fmt] = _make_state(entry.body, compress_variants(entry.body), entry.etag)
+    return state
+
+def _query_state(key, build):
+    """Response bodies and ETag for a parameterized query (always from the DB);
+    build() returns the object to serialize."""
+    state = _STATE['queries'].get(key)
+    if state is None:
+        from http_encoding import compress_variants
+        from payload_builder import CachedPayload, serialize_payload
+        entry = CachedPayload(serialize_payload(build()))
+        queries = _STATE['queries']
+        if len(queries) >= MAX_QUERY_STATES:
+            queries.pop(next(iter(queries)))
+        state = queries[key] = _make_state(entry.body, compress_variants(entry.body), entry.etag)
+    return state
+
+def _series_state(fmt, names, date_from, date_to, patient_id=DEFAULT_PATIENT_ID):
+    """Response bodies and ETag for a filtered /api/series query."""
+    from payload_builder import FORMATS, build_payload
+    return _query_state((fmt, names, date_from, date_to, patient_id),
+                        lambda: FORMATS[fmt](build_payload(_get_conn(), names, date_from, date_to, patient_id)))
+
+def _patient_state(patient_id, view):
+    """Response bodies and ETag of a payload view (key of VIEWS) for a
+    patient other than the default one."""
+    from payload_builder import VIEWS, build_payload
+    # 库不可变：每位患者的响应体构建一次后一直复用
+    return _query_state(('patient', patient_id, view),
+                        lambda: VIEWS[view](build_payload(_get_conn(), patient_id=patient_id)))
+
+def _log_metric(start_kind, path, status, elapsed_ms, init=None):
+    # 输出到函数日志，便于按 cold/warm 统计延迟分布；冷启动另附初始化耗时
+    record = {
+        'metric': 'scf_latency',
+        'start': start_kind,
+        'path': path,
+        'status': status,
+        'ms': round(elapsed_ms, 3),
+    }
+    if init is not None:
+        record['init'] = {k: round(v, 3) for k, v in init.items()}
+    print(json.dumps(record))
+
+def _init_metrics(t0):
+    """Init durations (ms) reported with the first invocation: module import
+    (including the prebuilt load), the gap from the end of the import to this
+    invocation, and the DB connection setup if it happened by now."""
+    init = dict(_INIT, since_load_ms=(t0 - _LOADED_AT) * 1000)
+    if _STATE['conn_ms'] is not None:
+        init['conn_ms'] = _STATE['conn_ms']
+    return init
 
 def _resp_json(data, status=200):
     body = json.dumps(data, ensure_ascii=False)
+    return _resp_body(body, status)
+
+def _resp_body(body, status=200, headers=None, is_base64=False):
+    resp_headers = {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type',
+    }
+    if headers:
+        resp_headers.update(headers)
     return {
-        'isBase64Encoded': False,
+        'isBase64Encoded': is_base64,
         'statusCode': status,
-        'headers': {
-            'Content-Type': 'application/json; charset=utf-8',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'GET, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type',
-        },
+        'headers': resp_headers,
         'body': body
     }
 
+def _header(event, name):
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for k, v in headers.items():
+        if k.lower() == name:
+            return v
+    return None
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(',')]
+    return '*' in tags or ('"%s"' % etag) in tags
+
 def _resp_text(text, status=200):
     return {
         'isBase64Encoded': False,
@@ -106,17 +214,171 @@ def _resp_text(text, status=200):
         'body': text
     }
 
+def _query_param(event, name):
+    # API 网关事件中查询参数可能位于 queryString 或 queryStringParameters
+    for key in ('queryString', 'queryStringParameters'):
+        params = event.get(key) or {}
+        if name in params:
+            return params[name]
+    return None
+
+def _send_state(event, state):
+    bodies = state['bodies']
+    coding = choose_encoding(_header(event, 'Accept-Encoding'), bodies)
+    # 不同编码是不同的表示，强 ETag 需区分（与 payload_builder.CachedPayload.etag_for 一致）
+    etags = {c: (state['etag'] if c is None else '%s-%s' % (state['etag'], c)) for c in bodies}
+    headers = {'ETag': '"%s"' % etags[coding], 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if_none_match = _header(event, 'If-None-Match')
+    if any(_etag_matches(if_none_match, tag) for tag in etags.values()):
+        return _resp_body('', 304, headers)
+    if coding is None:
+        return _resp_body(bodies[None], 200, headers)
+    # API 网关按 isBase64Encoded 还原二进制响应体
+    headers['Content-Encoding'] = coding
+    return _resp_body(bodies[coding], 200, headers, is_base64=True)
+
+def _patient_param(event):
+    """(patient_id, error response) for the optional ?patient=<id>."""
+    raw = _query_param(event, 'patient')
+    if not raw:
+        return DEFAULT_PATIENT_ID, None
+    try:
+        patient_id = int(raw)
+    except (TypeError, ValueError):
+        return None, _resp_json({'error': 'patient must be an integer: %s' % raw}, 400)
+    # 默认患者不查库，冷启动仍只用预渲染文件
+    if patient_id != DEFAULT_PATIENT_ID:
+        from patients import patient_exists
+        if not patient_exists(_get_conn(), patient_id):
+            return None, _resp_json({'error': 'unknown patient: %d' % patient_id}, 404)
+    return patient_id, None
+
+def _handle_api_data(event):
+    # ?format=columnar 返回列式紧凑格式
+    fmt = _query_param(event, 'format') or 'full'
+    state = _format_state(fmt) if fmt not in (INDEX_VIEW, TRENDS_VIEW) else None
+    if state is None:
+        return _resp_json({'error': 'unknown format: %s' % fmt}, 400)
+    return _send_state(event, state)
+
+def _handle_api_indicators(event):
+    # 仅元数据（单位、参考范围、点数、首末日期），不含序列；?patient= 指定患者
+    patient_id, error = _patient_param(event)
+    if error:
+        return error
+    if patient_id != DEFAULT_PATIENT_ID:
+        return _send_state(event, _patient_state(patient_id, INDEX_VIEW))
+    state = _format_state(INDEX_VIEW)
+    if state is None:
+        return _resp_json({'error': 'indicator index not available'}, 404)
+    return _send_state(event, state)
+
+def _handle_api_trends(event):
+    # 预计算的 LOESS / 线性趋势，随 payload 一同预渲染或缓存
+    patient_id, error = _patient_param(event)
+    if error:
+        return error
+    if patient_id != DEFAULT_PATIENT_ID:
+        return _send_state(event, _patient_state(patient_id, TRENDS_VIEW))
+    state = _format_state(TRENDS_VIEW)
+    if state is None:
+        return _resp_json({'error': 'trends not available'}, 404)
+    return _send_state(event, state)
+
+def _names_param(event):
+    raw = _query_param(event, 'names') or ''
+    if isinstance(raw, (list, tuple)):
+        raw = ','.join(raw)
+    return tuple(sorted({n.strip() for n in raw.split(',') if n.strip()}))
+
+def _handle_api_series(event):
+    # /api/series?names=a,b&from=YYYY-MM-DD&to=YYYY-MM-DD&patient=<id>
+    from payload_builder import FORMATS, parse_date_param
+    fmt = _query_param(event, 'format') or 'full'
+    if fmt not in FORMATS:
+        return _resp_json({'error': 'unknown format: %s' % fmt}, 400)
+    patient_id, error = _patient_param(event)
+    if error:
+        return error
+    names = _names_param(event)
+    if not names:
+        return _resp_json({'error': 'names is required'}, 400)
+    try:
+        date_from = parse_date_param(_query_param(event, 'from')) if _query_param(event, 'from') else None
+        date_to = parse_date_param(_query_param(event, 'to')) if _query_param(event, 'to') else None
+    except ValueError:
+        return _resp_json({'error': 'from/to must be dates (YYYY-MM-DD)'}, 400)
+    return _send_state(event, _series_state(fmt, names, date_from, date_to, patient_id))
+
+def _handle_api_cycles(event):
+    # /api/cycles?names=a,b&patient=<id>：读 cycle_summaries 表，开销与周期数成正比，与预渲染无关
+    from cycle_summary import cycles_view, has_cycle_summaries
+    conn = _get_conn()
+    if not has_cycle_summaries(conn):
+        return _resp_json({'error': 'cycle summaries not available'}, 404)
+    patient_id, error = _patient_param(event)
+    if error:
+        return error
+    names = _names_param(event)
+    return _send_state(event, _query_state(('cycles', names, patient_id),
+                                           lambda: cycles_view(conn, names or None, patient_id)))
+
+def _handle_api_patients(event):
+    from patients import list_patients
+    return _resp_json({'patients': list_patients(_get_conn())})
+
+def _handle_api_patient_data(event, patient_id):
+    if patient_id == DEFAULT_PATIENT_ID:
+        return _handle_api_data(event)
+    from patients import patient_exists
+    from payload_builder import FORMATS
+    fmt = _query_param(event, 'format') or 'full'
+    if fmt not in FORMATS:
+        return _resp_json({'error': 'unknown format: %s' % fmt}, 400)
+    if not patient_exists(_get_conn(), patient_id):
+        return _resp_json({'error': 'unknown patient: %d' % patient_id}, 404)
+    return _send_state(event, _patient_state(patient_id, fmt))
+
+ROUTES = (
+    ('/api/data', _handle_api_data),
+    ('/api/indicators', _handle_api_indicators),
+    ('/api/series', _handle_api_series),
+    ('/api/trends', _handle_api_trends),
+    ('/api/cycles', _handle_api_cycles),
+    ('/api/patients', _handle_api_patients),
+)
+
+def _route(path):
+    m = PATIENT_DATA_RE.search(path)
+    if m:
+        patient_id = int(m.group(1))
+        return lambda event: _handle_api_patient_data(event, patient_id)
+    for suffix, handler in ROUTES:
+        if path.endswith(suffix):
+            return handler
+    return None
+
 def main_handler(event, context):
     # Tencent SCF + API Gateway event shape
+    t0 = time.perf_counter()
+    _STATE['invocations'] += 1
+    start_kind = 'cold' if _STATE['invocations'] == 1 else 'warm'
     method = (event.get('httpMethod') or 'GET').upper()
     path = event.get('path') or '/'
     if method == 'OPTIONS':
         return _resp_text('ok', 204)
-    if path.endswith('/api/data'):
+    handler = _route(path)
+    if handler is not None:
         try:
-            payload = _query_payload()
-            return _resp_json(payload)
+            resp = handler(event)
         except Exception as e:
-            return _resp_json({'error': str(e)}, 500)
+            resp = _resp_json({'error': str(e)}, 500)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        _log_metric(start_kind, path, resp['statusCode'], elapsed_ms,
+                    _init_metrics(t0) if start_kind == 'cold' else None)
+        return resp
     # default
-    return _resp_text('ok')
\ No newline at end of file
+    return _resp_text('ok')
+
+_LOADED_AT = time.perf_counter()
+_INIT['import_ms'] = (_LOADED_AT - _LOAD_T0) * 1000
@@ -0,0 +1,39 @@
+import json
+
+import build_static
+
+
+def test_build_fingerprints_assets_and_rewrites_html(tmp_path):
+    src, out = tmp_path / 'docs', tmp_path / 'site'
+    (src / 'dashboard').mkdir(parents=True)
+    (src / 'index.html').write_text(
+        '<script src="api_base.js"></script><script src="app.js?v=1"></script>'
+        '<link href="style.css" rel="stylesheet"><a href="https://example.com/app.js">x</a>', encoding='utf-8')
+    (src / 'dashboard' / 'index.html').write_text('<script src="../app.js"></script>', encoding='utf-8')
+    (src / 'app.js').write_text('console.log(1)', encoding='utf-8')
+    (src / 'style.css').write_text('body{}', encoding='utf-8')
+    (src / 'api_base.js').write_text('window.API_BASE=""', encoding='utf-8')
+    (src / 'data.json').write_text('{}', encoding='utf-8')
+
+    renamed = build_static.build(src, out)
+
+    app = renamed['app.js']
+    assert app != 'app.js' and (out / app).read_text(encoding='utf-8') == 'console.log(1)'
+    assert 'api_base.js' not in renamed and (out / 'api_base.js').exists()
+    assert not (out / 'app.js').exists() and not (out / 'data.json').exists()
+    index = (out / 'index.html').read_text(encoding='utf-8')
+    assert f'src="{app}?v=1"' in index and f'href="{renamed["style.css"]}"' in index
+    assert 'src="api_base.js"' in index and 'https://example.com/app.js' in index
+    assert (out / 'dashboard' / 'index.html').read_text(encoding='utf-8') == f'<script src="../{app}"></script>'
+    manifest = json.loads((out / 'data-manifest.json').read_text(encoding='utf-8'))
+    assert manifest == {'data': renamed['data.json']} and (out / manifest['data']).read_text() == '{}'
+
+    # 内容不变时文件名稳定
+    assert build_static.build(src, out) == renamed
+
+
+def test_cache_control_for():
+    assert build_static.cache_control_for('zhl/app.0123456789.js') == build_static.IMMUTABLE_CACHE_CONTROL
+    assert build_static.cache_control_for('zhl/data.abcdef0123.json') == build_static.IMMUTABLE_CACHE_CONTROL
+    for key in ('zhl/index.html', 'zhl/api_base.js', 'zhl/data-manifest.json', 'zhl/app.js'):
+        assert build_static.cache_control_for(key) == build_static.SHORT_CACHE_CONTROL
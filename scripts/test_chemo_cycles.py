@@ -0,0 +1,52 @@
+import sqlite3
+
+import chemo_cycles
+import cycle_summary
+import migrate_to_db
+from date_normalizer import date_ordinal
+from payload_builder import build_payload
+
+
+def test_locate_many_matches_bisect_with_and_without_numpy(monkeypatch):
+    # 第 2 周期推迟到 d26，第 3 周期之后按 21 天顺延
+    schedule = chemo_cycles.CycleSchedule([date_ordinal(d) for d in ('2025-08-08', '2025-09-02', '2025-09-23')], 21)
+    dates = ['2025-08-01', '2025-08-08', '2025-08-30', '2025-09-02', '2025-10-13', '2025-10-14', '2025-11-20']
+    expected = [(0, 0), (1, 1), (1, 23), (2, 1), (3, 21), (4, 1), (5, 17)]
+    ordinals = [date_ordinal(d) for d in dates]
+    assert [schedule.locate(o) for o in ordinals] == expected
+    for has_numpy in (True, False):
+        monkeypatch.setattr(chemo_cycles, '_HAS_NUMPY', has_numpy and chemo_cycles._HAS_NUMPY)
+        cycles, days = schedule.locate_many(ordinals)
+        assert list(zip(cycles, days)) == expected
+    assert schedule.bounds(2) == (date_ordinal('2025-09-02'), date_ordinal('2025-09-22'))
+    assert schedule.bounds(4) == (date_ordinal('2025-10-14'), date_ordinal('2025-11-03'))
+
+
+def test_schedule_change_relabels_without_rewriting_measurements(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'zhl.sqlite3')
+    migrate_to_db.ensure_schema(conn)
+    conn.executemany('INSERT INTO patient_meta(patient_id, key, value) VALUES(1,?,?)', [('start_date', '2025-08-08'), ('cycle_length_days', '21')])
+    ind_id = migrate_to_db.upsert_indicator(conn, '白细胞计数', '10^9/L', {'lower': 3.5, 'upper': 9.5})
+    for d, v in (('2025-08-12', 2.0), ('2025-08-30', 3.0), ('2025-09-06', 1.8)):
+        conn.execute('INSERT INTO measurements(indicator_id, date_id, value, phase) VALUES(?,?,?,?)',
+                     (ind_id, migrate_to_db.upsert_date(conn, d), v, 'stale'))
+    chemo_cycles.seed_cycles(conn)
+    cycle_summary.update_cycle_summaries(conn)
+    conn.commit()
+
+    def phases():
+        return [pt['phase'] for pt in build_payload(conn)['indicators']['白细胞计数']['series']]
+
+    assert phases() == ['第1次化疗d5', '第2次化疗d2', '第2次化疗d9']
+    assert [c['start'] for c in cycle_summary.cycles_view(conn)['indicators']['白细胞计数']['cycles']] == ['2025-08-08', '2025-08-29']
+
+    # 第 2 周期实际推迟到 09-02：只改排期，标签与周期汇总随之更新
+    chemo_cycles.set_schedule(conn, ['2025-08-08', '2025-09-02'])
+    cycle_summary.update_cycle_summaries(conn)
+    conn.commit()
+    assert phases() == ['第1次化疗d5', '第1次化疗d23', '第2次化疗d5']
+    assert build_payload(conn)['cycle_starts'] == ['2025-08-08', '2025-09-02']
+    cycles = cycle_summary.cycles_view(conn)['indicators']['白细胞计数']['cycles']
+    assert [(c['start'], c['n'], c['nadir']) for c in cycles] == [('2025-08-08', 2, 2.0), ('2025-09-02', 1, 1.8)]
+    assert {p for (p,) in conn.execute('SELECT phase FROM measurements')} == {'stale'}
+    conn.close()
@@ -0,0 +1,62 @@
+import sqlite3
+
+import cycle_summary
+import import_csvs_to_db
+import migrate_to_db
+
+HEADER = '报告日期,检测指标,结果,单位,参考值,状态\n'
+
+
+def test_summarize_cycle_interpolates_below_reference():
+    s = cycle_summary.summarize_cycle([(1, 4.0), (5, 1.0), (9, 3.0), (13, 5.0)], lower=3.5)
+    assert (s['n_points'], s['first_day'], s['last_day']) == (4, 1, 13)
+    assert (s['nadir_value'], s['nadir_day']) == (1.0, 5)
+    # 4 -> 1 在 d1 之后 2/3 天降到 3.5 以下，3 -> 5 在 d10 回到 3.5
+    assert s['days_below'] == round(4 - 2 / 3 + 4 + 1, 4)
+    assert s['recovery_days'] == 5.0
+    assert s['auc'] == 10 + 8 + 16
+    assert cycle_summary.summarize_cycle([(3, 2.0)], lower=None)['days_below'] is None
+
+
+def summaries(conn):
+    return conn.execute('SELECT * FROM cycle_summaries ORDER BY indicator_id, cycle').fetchall()
+
+
+def test_import_refreshes_touched_cycles_like_a_rebuild(tmp_path, monkeypatch):
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    db_path = tmp_path / 'zhl.sqlite3'
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.executemany('INSERT INTO patient_meta(patient_id, key, value) VALUES(1,?,?)', [('start_date', '2025-08-08'), ('cycle_length_days', '21')])
+    conn.commit()
+    monkeypatch.setattr(import_csvs_to_db, 'CSV_DIR', csv_dir)
+    monkeypatch.setattr(import_csvs_to_db, 'DB_PATH', db_path)
+
+    (csv_dir / 'a.csv').write_text(HEADER + '2025-08-06,白细胞计数,5.0,10^9/L,3.5-9.5,\n'
+                                   '2025-08-12,白细胞计数,2.0,10^9/L,3.5-9.5,↓\n'
+                                   '2025-08-20,白细胞计数,4.5,10^9/L,3.5-9.5,\n'
+                                   '2025-09-02,白细胞计数,3.0,10^9/L,3.5-9.5,↓\n', encoding='utf-8')
+    import_csvs_to_db.import_csvs()
+    (csv_dir / 'b.csv').write_text(HEADER + '2025-09-10,白细胞计数,1.5,10^9/L,3.5-9.5,↓\n', encoding='utf-8')
+    import_csvs_to_db.import_csvs()
+
+    view = cycle_summary.cycles_view(conn)
+    wbc = view['indicators']['白细胞计数']
+    # 化疗前（08-06）不计入；第 2 周期从 08-29 开始
+    assert [c['cycle'] for c in wbc['cycles']] == [1, 2]
+    c1, c2 = wbc['cycles']
+    assert (c1['start'], c1['nadir'], c1['nadir_date'], c1['n']) == ('2025-08-08', 2.0, '2025-08-12', 2)
+    assert (c2['start'], c2['nadir'], c2['nadir_date'], c2['n']) == ('2025-08-29', 1.5, '2025-09-10', 2)
+
+    incremental = summaries(conn)
+    conn.execute('BEGIN')
+    cycle_summary.rebuild_cycle_summaries(conn)
+    assert summaries(conn) == incremental
+    conn.rollback()
+
+    # 周期长度变化：下次刷新时按新基准整表重建
+    conn.execute("UPDATE patient_meta SET value='14' WHERE patient_id=1 AND key='cycle_length_days'")
+    cycle_summary.update_cycle_summaries(conn)
+    assert [c['cycle'] for c in cycle_summary.cycles_view(conn)['indicators']['白细胞计数']['cycles']] == [1, 2, 3]
+    conn.close()
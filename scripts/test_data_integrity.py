@@ -2,6 +2,8 @@ import json
 from pathlib import Path
 from datetime import datetime
 
+from payload_builder import from_columnar
+
 BASE = Path(__file__).resolve().parent.parent
 DOCS = BASE / 'docs' / 'data.json'
 DASH = BASE / 'dashboard' / 'data.json'
@@ -10,7 +12,8 @@ def parse_date(s: str):
     return datetime.strptime(s, '%Y-%m-%d')
 
 def run_checks(path: Path):
-    data = json.loads(path.read_text(encoding='utf-8'))
+    # 兼容 export_from_db.py --format columnar 导出的列式格式
+    data = from_columnar(json.loads(path.read_text(encoding='utf-8')))
     dates = data.get('dates') or []
     assert all(len(d) == 10 and d[4] == '-' and d[7] == '-' for d in dates), '日期未统一为YYYY-MM-DD'
     dates_sorted = sorted(dates, key=parse_date)
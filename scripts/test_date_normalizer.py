@@ -0,0 +1,19 @@
+from date_normalizer import UNPARSED_ORDINAL, date_ordinal, normalize_date
+
+
+def test_shapes_and_fallbacks():
+    assert normalize_date('2025/8/6') == '2025-08-06'
+    assert normalize_date('2025.08.06 8:05:07') == '2025-08-06'
+    assert normalize_date('20250806') == '2025-08-06'
+    # 两位年份：完整匹配时与 strptime 的 %y 一致，夹带在文本中时按 20xx
+    assert normalize_date('1/2/70') == '1970-01-02'
+    assert normalize_date('采样 10/24/25 8:45') == '2025-10-24'
+    # 形状匹配但日期无效：走原有 strptime 链，最终原样返回
+    assert normalize_date(' 2025-02-30 ') == '2025-02-30'
+    assert normalize_date(None) == ''
+
+
+def test_ordinal_sorts_unparsed_last():
+    raw = ['报告日期', '2025/8/10', '8/6/25', '20250807']
+    assert sorted(raw, key=date_ordinal) == ['8/6/25', '20250807', '2025/8/10', '报告日期']
+    assert date_ordinal('报告日期') == UNPARSED_ORDINAL
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+
+import pytest
+
+import deploy_cos
+
+
+class FakeCos:
+    """In-memory stand-in for CosS3Client (list/put/delete only)."""
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.puts = []
+        self.log = []
+        self.lock = threading.Lock()
+
+    def list_objects(self, Bucket, Prefix='', Marker='', MaxKeys=1000):
+        keys = sorted(k for k in self.objects if k.startswith(Prefix) and k > Marker)
+        page = keys[:MaxKeys]
+        return {
+            'Contents': [{'Key': k, 'ETag': '"%s"' % hashlib.md5(self.objects[k]).hexdigest()} for k in page],
+            'IsTruncated': 'true' if len(keys) > MaxKeys else 'false',
+        }
+
+    def put_object(self, Bucket, Body, Key, **kwargs):
+        with self.lock:
+            self.objects[Key] = Body
+            self.puts.append(Key)
+            self.log.append(('put', Key))
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Object']:
+            del self.objects[obj['Key']]
+            self.log.append(('delete', obj['Key']))
+
+
+def test_sync_uploads_only_changed_and_deletes_orphans(tmp_path, monkeypatch):
+    monkeypatch.setattr(deploy_cos, 'LIST_PAGE_SIZE', 2)
+    (tmp_path / 'dashboard').mkdir()
+    (tmp_path / 'index.html').write_bytes(b'<html>')
+    (tmp_path / 'app.js').write_bytes(b'new js')
+    (tmp_path / 'dashboard' / 'data.json').write_bytes(b'{}')
+    client = FakeCos({
+        'zhl/index.html': b'<html>',
+        'zhl/app.js': b'old js',
+        'zhl/old.css': b'gone',
+        'other/keep.txt': b'outside prefix',
+    })
+
+    uploaded, deleted = deploy_cos.sync(client, 'b', 'zhl/', tmp_path, jobs=4, delete=True)
+    assert sorted(uploaded) == ['zhl/app.js', 'zhl/dashboard/data.json']
+    assert deleted == ['zhl/old.css']
+    assert sorted(client.objects) == ['other/keep.txt', 'zhl/app.js', 'zhl/dashboard/data.json', 'zhl/index.html']
+
+    # 再次同步：远端已一致，无任何上传或删除
+    client.puts.clear()
+    assert deploy_cos.sync(client, 'b', 'zhl/', tmp_path, delete=True) == ([], [])
+    assert client.puts == []
+
+
+def test_same_size_content_change_is_uploaded(tmp_path):
+    # 大小不变、内容改变的文件也要上传：md5 按内容现算
+    (tmp_path / 'data.json').write_bytes(b'{"v": 2}')
+    (tmp_path / 'app.js').write_bytes(b'js')
+    client = FakeCos({'zhl/data.json': b'{"v": 1}', 'zhl/app.js': b'js'})
+    uploaded, _deleted = deploy_cos.sync(client, 'b', 'zhl/', tmp_path)
+    assert uploaded == ['zhl/data.json']
+    assert client.objects['zhl/data.json'] == b'{"v": 2}'
+
+
+def test_assets_before_pages_before_deletes(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    for name in ('index.html', 'a.js', 'sub/page.htm', 'b.css', 'sub/data.json'):
+        (tmp_path / name).write_bytes(name.encode())
+    client = FakeCos({'zhl/old.js': b'old', 'zhl/old.html': b'old'})
+    deploy_cos.sync(client, 'b', 'zhl/', tmp_path, jobs=4, delete=True)
+    ops = [op for op, _key in client.log]
+    puts = [key for op, key in client.log if op == 'put']
+    # 资源全部上传后才传 HTML，删除在所有上传之后
+    assert sorted(puts[:3]) == ['zhl/a.js', 'zhl/b.css', 'zhl/sub/data.json']
+    assert sorted(puts[3:]) == ['zhl/index.html', 'zhl/sub/page.htm']
+    assert ops == ['put'] * 5 + ['delete'] * 2
+
+
+def test_failed_asset_upload_stops_before_pages(tmp_path):
+    (tmp_path / 'index.html').write_bytes(b'<html>')
+    (tmp_path / 'a.js').write_bytes(b'js')
+    client = FakeCos({'zhl/old.js': b'old'})
+    put = client.put_object
+
+    def failing_put(Bucket, Body, Key, **kwargs):
+        if Key.endswith('.js'):
+            raise IOError('upload failed')
+        put(Bucket, Body, Key, **kwargs)
+    client.put_object = failing_put
+    with pytest.raises(IOError):
+        deploy_cos.sync(client, 'b', 'zhl/', tmp_path, delete=True)
+    assert client.log == []
@@ -0,0 +1,207 @@
+import sqlite3
+
+import pytest
+
+import import_csvs_to_db
+import migrate_to_db
+
+HEADER = '报告日期,检测指标,结果,单位,参考值,状态\n'
+
+
+def values(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(((name, date), value) for name, date, value in conn.execute('''
+            SELECT i.name, d.date, m.value FROM measurements m
+            JOIN indicators i ON m.indicator_id = i.id JOIN dates d ON m.date_id = d.id
+        '''))
+    finally:
+        conn.close()
+
+
+def test_incremental_import_retracts_changed_file(tmp_path, monkeypatch):
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    db_path = tmp_path / 'zhl.sqlite3'
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.close()
+    monkeypatch.setattr(import_csvs_to_db, 'CSV_DIR', csv_dir)
+    monkeypatch.setattr(import_csvs_to_db, 'DB_PATH', db_path)
+
+    (csv_dir / 'a.csv').write_text(HEADER + '2025-09-02,血小板计数,150,10^9/L,125-350,\n', encoding='utf-8')
+    (csv_dir / 'b.csv').write_text(HEADER + '2025-09-02,血小板计数,90,10^9/L,125-350,↓\n'
+                                   '2025-09-02,白细胞计数,2.1,10^9/L,3.5-9.5,↓\n', encoding='utf-8')
+    import_csvs_to_db.import_csvs()
+    # 后导入的 b.csv 覆盖 a.csv 的同日记录
+    assert values(db_path) == {('血小板计数', '2025-09-02'): 90, ('白细胞计数', '2025-09-02'): 2.1}
+
+    # b.csv 修改后：撤回其旧记录，a.csv 的值重新胜出
+    (csv_dir / 'b.csv').write_text(HEADER + '2025-09-23,白细胞计数,4.0,10^9/L,3.5-9.5,\n', encoding='utf-8')
+    import_csvs_to_db.import_csvs()
+    assert values(db_path) == {('血小板计数', '2025-09-02'): 150, ('白细胞计数', '2025-09-23'): 4.0}
+
+    (csv_dir / 'a.csv').unlink()
+    import_csvs_to_db.import_csvs()
+    assert values(db_path) == {('白细胞计数', '2025-09-23'): 4.0}
+
+
+def test_parse_retries_encoding_and_skips_repeated_headers(tmp_path, monkeypatch):
+    # 样本只覆盖开头的空行（可按 UTF-8 解码），GBK 字节在样本之后才出现：流式读取时换编码重读
+    monkeypatch.setattr(import_csvs_to_db, 'SAMPLE_BYTES', 16)
+    text = ('\n' * 20 + HEADER + '2025-09-02,血小板计数,90,10^9/L,125-350,↓\n'
+            + HEADER + '2025-09-23,白细胞计数,4.0,,,\n')
+    path = tmp_path / 'export.csv'
+    path.write_bytes(text.encode('gbk'))
+    records = dict(import_csvs_to_db.parse_csv_file(path))
+    assert set(records) == {('血小板计数', '2025-09-02'), ('白细胞计数', '2025-09-23')}
+    assert records[('血小板计数', '2025-09-02')]['flag'] == '↓'
+
+
+def test_missing_or_empty_csv_dir_keeps_imported_data(tmp_path, monkeypatch):
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    db_path = tmp_path / 'zhl.sqlite3'
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.close()
+    monkeypatch.setattr(import_csvs_to_db, 'CSV_DIR', csv_dir)
+    monkeypatch.setattr(import_csvs_to_db, 'DB_PATH', db_path)
+    (csv_dir / 'a.csv').write_text(HEADER + '2025-09-02,血小板计数,150,10^9/L,125-350,\n', encoding='utf-8')
+    import_csvs_to_db.import_csvs()
+    expected = {('血小板计数', '2025-09-02'): 150}
+
+    (csv_dir / 'a.csv').unlink()
+    csv_dir.rmdir()
+    with pytest.raises(FileNotFoundError):
+        import_csvs_to_db.import_csvs()
+    assert values(db_path) == expected
+
+    # 空目录不视为全部删除；--prune 时才撤回
+    csv_dir.mkdir()
+    import_csvs_to_db.import_csvs()
+    assert values(db_path) == expected
+    import_csvs_to_db.import_csvs(prune=True)
+    assert values(db_path) == {}
+
+
+def test_id_resolver_matches_upserts_for_new_and_existing_names(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'zhl.sqlite3')
+    migrate_to_db.ensure_schema(conn)
+    date_id = import_csvs_to_db.upsert_date(conn, '2025-09-02')
+    bare_id = import_csvs_to_db.upsert_indicator(conn, '血小板计数', '', None, None)
+    full_id = import_csvs_to_db.upsert_indicator(conn, '白细胞计数', '10^9/L', 3.5, 9.5)
+    resolver = import_csvs_to_db.IdResolver(conn)
+
+    # 已有名称：复用原 id，不插入新行
+    assert resolver.date_id('2025-09-02') == date_id
+    assert resolver.indicator_id('白细胞计数', 'g/L', 1.0, 2.0) == full_id
+    assert resolver.filled == set()
+    # 已有指标缺失的单位/参考范围才补齐，并记入 filled
+    assert resolver.indicator_id('血小板计数', '10^9/L', 125.0, 350.0) == bare_id
+    assert resolver.filled == {bare_id}
+    # 新名称：插入后缓存，重复解析得到同一 id
+    new_date = resolver.date_id('2025-09-23')
+    new_ind = resolver.indicator_id('血红蛋白', 'g/L', 115.0, 150.0)
+    assert resolver.date_id('2025-09-23') == new_date
+    assert resolver.indicator_id('血红蛋白', '', None, None) == new_ind
+    assert resolver.filled == {bare_id}
+    assert dict(conn.execute('SELECT date, id FROM dates')) == {'2025-09-02': date_id, '2025-09-23': new_date}
+    assert sorted(conn.execute('SELECT id, name, unit, ref_lower, ref_upper FROM indicators')) == sorted([
+        (bare_id, '血小板计数', '10^9/L', 125.0, 350.0),
+        (full_id, '白细胞计数', '10^9/L', 3.5, 9.5),
+        (new_ind, '血红蛋白', 'g/L', 115.0, 150.0),
+    ])
+    # 患者按子目录解析：顶层为默认患者，新子目录按需创建
+    assert resolver.patient_id('a.csv') == 1
+    p2 = resolver.patient_id('p2/a.csv')
+    assert (resolver.patient_id('p2/b.csv'), p2) == (p2, 2)
+    conn.close()
+
+
+def dump_tables(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        # 导入时间戳随运行而变，不参与比较
+        return {t: sorted(map(repr, conn.execute(
+            'SELECT * FROM %s' % t if t != 'imported_files' else
+            'SELECT id, path, size, mtime, sha256, patient_id FROM imported_files'))) for t in tables}
+    finally:
+        conn.close()
+
+
+def test_parallel_import_matches_serial(tmp_path, monkeypatch):
+    csv_dir = tmp_path / 'csv'
+    (csv_dir / 'p2').mkdir(parents=True)
+    # 多个文件互相覆盖同一 (指标, 日期)，并补全先前缺失的单位/参考范围
+    for i in range(6):
+        (csv_dir / ('%02d.csv' % i)).write_text(
+            HEADER + '2025-09-%02d,血小板计数,%d,10^9/L,125-350,\n' % (2 + i % 3, 100 + i)
+            + '2025-09-%02d,白细胞计数,%s,%s,%s,\n' % (2 + i, 2.0 + i, '10^9/L' if i else '', '3.5-9.5' if i > 2 else ''),
+            encoding='utf-8')
+    (csv_dir / 'p2' / 'a.csv').write_text(HEADER + '2025-09-02,白细胞计数,6.0,10^9/L,3.5-9.5,\n', encoding='utf-8')
+    (csv_dir / 'p2' / 'b.csv').write_text(HEADER + '2025-09-02,白细胞计数,7.0,10^9/L,3.5-9.5,\n', encoding='utf-8')
+    monkeypatch.setattr(import_csvs_to_db, 'CSV_DIR', csv_dir)
+
+    dumps = []
+    for jobs in (1, 3):
+        db_path = tmp_path / ('jobs%d.sqlite3' % jobs)
+        conn = sqlite3.connect(db_path)
+        migrate_to_db.ensure_schema(conn)
+        conn.executemany('INSERT INTO patient_meta(patient_id, key, value) VALUES(1,?,?)',
+                         [('start_date', '2025-08-08'), ('cycle_length_days', '21')])
+        conn.commit()
+        conn.close()
+        monkeypatch.setattr(import_csvs_to_db, 'DB_PATH', db_path)
+        import_csvs_to_db.import_csvs(jobs=jobs)
+        dumps.append(dump_tables(db_path))
+    assert dumps[0]['measurements'] and dumps[0]['cycle_summaries']
+    assert dumps[1] == dumps[0]
+
+
+def test_streamed_import_matches_whole_file(tmp_path, monkeypatch):
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    # 同一键跨块重复：后出现的非数值记录不覆盖数值记录，数值记录则后者覆盖
+    (csv_dir / 'export.csv').write_text(
+        HEADER + '2025-09-02,血小板计数,90,10^9/L,125-350,↓\n'
+        + '2025-09-02,白细胞计数,2.1,,,↓\n'
+        + '2025-09-02,血小板计数,未检出,10^9/L,125-350,\n'
+        + HEADER + '2025-09-02,白细胞计数,3.0,10^9/L,3.5-9.5,\n'
+        + '2025-09-23,白细胞计数,4.0,10^9/L,3.5-9.5,\n', encoding='utf-8')
+    monkeypatch.setattr(import_csvs_to_db, 'CSV_DIR', csv_dir)
+
+    dumps = []
+    for stream_bytes in (1 << 30, 0):
+        monkeypatch.setattr(import_csvs_to_db, 'STREAM_BYTES', stream_bytes)
+        monkeypatch.setattr(import_csvs_to_db, 'STREAM_CHUNK_KEYS', 1)
+        db_path = tmp_path / ('stream%d.sqlite3' % (not stream_bytes))
+        conn = sqlite3.connect(db_path)
+        migrate_to_db.ensure_schema(conn)
+        conn.close()
+        monkeypatch.setattr(import_csvs_to_db, 'DB_PATH', db_path)
+        import_csvs_to_db.import_csvs(jobs=1)
+        dumps.append(dump_tables(db_path))
+    assert values(db_path) == {('血小板计数', '2025-09-02'): 90, ('白细胞计数', '2025-09-02'): 3.0,
+                               ('白细胞计数', '2025-09-23'): 4.0}
+    assert dumps[1] == dumps[0]
+
+
+def test_unreadable_streamed_file_is_not_recorded(tmp_path, monkeypatch):
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    db_path = tmp_path / 'zhl.sqlite3'
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.close()
+    monkeypatch.setattr(import_csvs_to_db, 'CSV_DIR', csv_dir)
+    monkeypatch.setattr(import_csvs_to_db, 'DB_PATH', db_path)
+    monkeypatch.setattr(import_csvs_to_db, 'STREAM_BYTES', 0)
+    # 没有表头行：不写入记录，也不记录指纹
+    (csv_dir / 'empty.csv').write_bytes(b'')
+    import_csvs_to_db.import_csvs(jobs=1)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT COUNT(*) FROM imported_files').fetchone()[0] == 0
+    conn.close()
@@ -0,0 +1,16 @@
+from indicator_names import canonical_indicator_name, find_code_token, merge_name
+
+
+def test_code_tokens_follow_list_order():
+    # MCH 在列表中先于 MCHC，与原实现一致
+    assert find_code_token('MCHC') == 'MCH'
+    assert find_code_token('RBC-NEUT#') == 'NEUT#'
+    assert find_code_token('血小板') is None
+    assert canonical_indicator_name('★ＰＬＴ(新版)') == '血小板计数'
+    assert canonical_indicator_name('中性粒细胞绝对值（星标）') == '中性粒细胞计数'
+
+
+def test_merge_is_exact_match_only():
+    assert merge_name(' 红细胞数 ') == '红细胞'
+    assert merge_name('血红蛋白浓度') == '血红蛋白浓度'
+    assert merge_name('RBC') == 'RBC'
@@ -0,0 +1,69 @@
+import sqlite3
+
+import migrate_to_db
+
+
+def test_migrations_upgrade_existing_db_once():
+    conn = sqlite3.connect(':memory:')
+    # 仅有原始表的旧库（user_version 0）
+    for ddl in migrate_to_db.SCHEMA['tables']:
+        conn.execute(ddl)
+    conn.execute("INSERT INTO dates(date) VALUES('2025-8-6')")
+    conn.commit()
+
+    assert migrate_to_db.apply_migrations(conn) == 0
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == migrate_to_db.SCHEMA_VERSION
+    assert migrate_to_db.apply_migrations(conn) == migrate_to_db.SCHEMA_VERSION
+
+    # 回填的日序号与触发器为新日期计算的一致
+    conn.execute("INSERT INTO dates(date) VALUES('2025-08-06')")
+    days = [d for (d,) in conn.execute('SELECT day FROM dates ORDER BY id')]
+    assert days == [migrate_to_db.date_day('2025-08-06')] * 2
+    indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {'idx_measurements_indicator_cover', 'idx_dates_day'} <= indexes
+
+
+def test_patient_migration_keeps_cycle_summaries(monkeypatch):
+    conn = sqlite3.connect(':memory:')
+    for ddl in migrate_to_db.SCHEMA['tables']:
+        conn.execute(ddl)
+    # 先升级到版本 5：单患者的汇总与排期依据
+    monkeypatch.setitem(migrate_to_db.SCHEMA, 'migrations', migrate_to_db.SCHEMA['migrations'][:5])
+    migrate_to_db.apply_migrations(conn)
+    conn.execute("INSERT INTO indicators(name, ref_lower) VALUES('白细胞计数', 3.5)")
+    conn.execute('INSERT INTO cycle_summaries VALUES(1, 1, 2, 1, 5, 2.0, 3, 1.5, NULL, 7.5, 3.5)')
+    conn.executemany('INSERT INTO meta(key, value) VALUES(?,?)',
+                     [('start_date', '2025-08-08'), ('cycle_summary_basis', '738740:21')])
+    conn.commit()
+    monkeypatch.undo()
+
+    migrate_to_db.apply_migrations(conn)
+    assert conn.execute('SELECT * FROM cycle_summaries').fetchall() == [(1, 1, 1, 2, 1, 5, 2.0, 3, 1.5, None, 7.5, 3.5)]
+    assert dict(conn.execute('SELECT key, value FROM patient_meta WHERE patient_id=1')) == {
+        'start_date': '2025-08-08', 'cycle_summary_basis': '738740:21'}
+    assert conn.execute('SELECT * FROM meta').fetchall() == []
+
+
+def test_date_days_agree_for_non_iso_dates(monkeypatch):
+    conn = sqlite3.connect(':memory:')
+    for ddl in migrate_to_db.SCHEMA['tables']:
+        conn.execute(ddl)
+    # 版本 6 的库：触发器为非 ISO 写法写入了 NULL 日序号
+    monkeypatch.setitem(migrate_to_db.SCHEMA, 'migrations', migrate_to_db.SCHEMA['migrations'][:6])
+    migrate_to_db.apply_migrations(conn)
+    conn.execute("INSERT INTO dates(date) VALUES('2025.08.09')")
+    conn.execute("INSERT INTO patient_meta(patient_id, key, value) VALUES(1, 'cycle_summary_basis', '738740:21')")
+    conn.commit()
+    assert conn.execute('SELECT day FROM dates').fetchone() == (None,)
+    monkeypatch.undo()
+
+    migrate_to_db.apply_migrations(conn)
+    assert conn.execute('SELECT day FROM dates').fetchone() == (migrate_to_db.date_day('2025-08-09'),)
+    # 日序号变化后周期汇总需重建、缓存需失效
+    assert conn.execute("SELECT value FROM patient_meta WHERE key='cycle_summary_basis'").fetchall() == []
+    assert conn.execute('SELECT generation FROM patients WHERE id=1').fetchone() == (1,)
+
+    # 写入路径在 Python 中计算 day，与回填一致
+    date_id = migrate_to_db.upsert_date(conn, '2025-8-10')
+    assert conn.execute('SELECT day FROM dates WHERE id=?', (date_id,)).fetchone() == (
+        migrate_to_db.date_day('2025-08-10'),)
@@ -0,0 +1,84 @@
+import sqlite3
+
+import import_csvs_to_db
+import migrate_to_db
+import normalize_db_indicators
+
+
+def test_merge_keeps_preference_rules(tmp_path, monkeypatch):
+    db_path = tmp_path / 'zhl.sqlite3'
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.executemany('INSERT INTO dates(id, date) VALUES(?,?)',
+                     [(1, '2025-09-01'), (2, '2025-09-02'), (3, '2025-09-03'), (4, '2025-09-04')])
+    conn.executemany('INSERT INTO indicators(id, name, unit, ref_lower, ref_upper) VALUES(?,?,?,?,?)', [
+        (1, '血小板计数', '', None, None),
+        (2, '★血小板计数', '10^9/L', 125, 350),
+        (3, 'PLT(新版)', 'x', 1, 2),
+    ])
+    conn.executemany('INSERT INTO measurements(indicator_id, date_id, value, status, flag) VALUES(?,?,?,?,?)', [
+        (1, 1, 150, '', '-'), (2, 1, 90, '↓', '↓'),         # 来源为数值：覆盖
+        (1, 2, 160, '', '-'), (2, 2, '未检出', '', '-'),    # 目标为数值、来源不是：保留目标
+        (1, 3, '溶血', '', '-'), (2, 3, '偏低', '↓', '↓'),  # 都非数值：优先带箭头
+        (2, 4, 200, '', '-'), (3, 4, 210, '', '-'),         # 两个别名同日：按指标顺序，后者覆盖
+    ])
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(normalize_db_indicators, 'DB_PATH', db_path)
+
+    normalize_db_indicators.normalize_db()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        # 单位与参考范围取第一个提供它们的别名
+        assert conn.execute('SELECT name, unit, ref_lower, ref_upper FROM indicators').fetchall() == [
+            ('血小板计数', '10^9/L', 125, 350)]
+        assert conn.execute('SELECT date_id, value, flag FROM measurements ORDER BY date_id').fetchall() == [
+            (1, 90, '↓'), (2, 160, '-'), (3, '偏低', '↓'), (4, 210, '-')]
+    finally:
+        conn.close()
+
+
+def test_merge_keeps_file_provenance_and_touches_patients(tmp_path, monkeypatch):
+    db_path = tmp_path / 'zhl.sqlite3'
+    csv_dir = tmp_path / 'csv'
+    csv_dir.mkdir()
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.execute("INSERT INTO patients(id, code) VALUES(2, 'p2')")
+    conn.executemany('INSERT INTO dates(id, date) VALUES(?,?)', [(1, '2025-09-01'), (2, '2025-09-02')])
+    conn.executemany('INSERT INTO indicators(id, name, unit, ref_lower, ref_upper) VALUES(?,?,?,?,?)', [
+        (1, '血小板计数', '', None, None),
+        (2, '★血小板计数', '10^9/L', 125, 350),
+    ])
+    # 患者 1 的别名记录来自 a.csv；患者 2 只有标准指标的测量
+    conn.execute("INSERT INTO imported_files(id, path, size, mtime, sha256, patient_id) VALUES(1, 'a.csv', 0, 0, '', 1)")
+    conn.execute('INSERT INTO file_records(file_id, patient_id, indicator_id, date_id, value, flag) VALUES(1, 1, 2, 1, 90, ?)',
+                 ('↓',))
+    conn.executemany('INSERT INTO measurements(patient_id, indicator_id, date_id, value, flag, source_file_id) VALUES(?,?,?,?,?,?)',
+                     [(1, 2, 1, 90, '↓', 1), (2, 1, 2, 150, '-', None)])
+    conn.commit()
+    generations = dict(conn.execute('SELECT id, generation FROM patients'))
+    conn.close()
+    monkeypatch.setattr(normalize_db_indicators, 'DB_PATH', db_path)
+
+    normalize_db_indicators.normalize_db()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT patient_id, indicator_id, date_id, source_file_id FROM measurements ORDER BY patient_id').fetchall() == [
+        (1, 1, 1, 1), (2, 1, 2, None)]
+    assert conn.execute('SELECT file_id, indicator_id, date_id FROM file_records').fetchall() == [(1, 1, 1)]
+    # 患者 2 的指标补全了单位与参考范围：其缓存同样失效
+    assert all(g > generations[p] for p, g in conn.execute('SELECT id, generation FROM patients'))
+    conn.close()
+
+    # a.csv 改动后重新导入：按文件撤回的是合并后的标准指标记录
+    monkeypatch.setattr(import_csvs_to_db, 'CSV_DIR', csv_dir)
+    monkeypatch.setattr(import_csvs_to_db, 'DB_PATH', db_path)
+    (csv_dir / 'a.csv').write_text('报告日期,检测指标,结果,单位,参考值,状态\n2025-09-02,血小板计数,200,10^9/L,125-350,\n',
+                                   encoding='utf-8')
+    import_csvs_to_db.import_csvs()
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT patient_id, indicator_id, date_id, value FROM measurements ORDER BY patient_id').fetchall() == [
+        (1, 1, 2, 200), (2, 1, 2, 150)]
+    conn.close()
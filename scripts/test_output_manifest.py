@@ -0,0 +1,26 @@
+import json
+import os
+
+from output_manifest import load_manifest, manifest_key, write_outputs
+
+
+def test_unchanged_outputs_are_left_alone(tmp_path):
+    a, b = tmp_path / 'dashboard' / 'data.json', tmp_path / 'docs' / 'data.json'
+    manifest = tmp_path / 'manifest.json'
+    assert write_outputs([a, b], ['{"x": ', b'1}'], manifest) == [a, b]
+    os.utime(a, ns=(0, 0))
+    before = manifest.read_bytes()
+
+    # 内容相同：不替换、不改 mtime，清单也不重写
+    assert write_outputs([a, b], ['{"x": 1}'], manifest) == []
+    assert a.stat().st_mtime_ns == 0
+    assert manifest.read_bytes() == before
+    assert sorted(tmp_path.rglob('*.tmp')) == []
+
+    # 只有内容不同的目标被重写
+    b.write_text('stale', encoding='utf-8')
+    assert write_outputs([a, b], ['{"x": 1}'], manifest) == [b]
+    entry = load_manifest(manifest)[manifest_key(a)]
+    assert entry['size'] == 8
+    assert entry['md5'] == '27958648a9e57fcd66ae5e31ff3359e9'
+    assert json.loads(manifest.read_text(encoding='utf-8'))['files'][manifest_key(b)] == entry
@@ -0,0 +1,62 @@
+import sqlite3
+
+import import_csvs_to_db
+import migrate_to_db
+from patients import list_patients
+from payload_builder import PayloadCache, build_payload
+
+HEADER = '报告日期,检测指标,结果,单位,参考值,状态\n'
+
+
+def import_two_patients(tmp_path, monkeypatch):
+    csv_dir = tmp_path / 'csv'
+    (csv_dir / 'p2').mkdir(parents=True)
+    db_path = tmp_path / 'zhl.sqlite3'
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.close()
+    monkeypatch.setattr(import_csvs_to_db, 'CSV_DIR', csv_dir)
+    monkeypatch.setattr(import_csvs_to_db, 'DB_PATH', db_path)
+    # 顶层文件属于默认患者，p2/ 下的属于患者 p2；同日同项目互不覆盖
+    (csv_dir / 'a.csv').write_text(HEADER + '2025-09-02,白细胞计数,2.1,10^9/L,3.5-9.5,↓\n', encoding='utf-8')
+    (csv_dir / 'p2' / 'a.csv').write_text(HEADER + '2025-09-02,白细胞计数,6.0,10^9/L,3.5-9.5,\n'
+                                          '2025-09-05,血小板计数,200,10^9/L,125-350,\n', encoding='utf-8')
+    import_csvs_to_db.import_csvs()
+    return csv_dir, db_path
+
+
+def test_import_partitions_measurements_by_patient(tmp_path, monkeypatch):
+    _csv_dir, db_path = import_two_patients(tmp_path, monkeypatch)
+    conn = sqlite3.connect(db_path)
+    assert list_patients(conn) == [{'id': 1, 'code': 'default', 'name': None}, {'id': 2, 'code': 'p2', 'name': 'p2'}]
+    p1, p2 = build_payload(conn), build_payload(conn, patient_id=2)
+    # 日期轴与指标只含本人的测量
+    assert (p1['dates'], list(p1['indicators'])) == (['2025-09-02'], ['白细胞计数'])
+    assert p2['dates'] == ['2025-09-02', '2025-09-05']
+    assert p1['indicators']['白细胞计数']['series'][0]['value'] == 2.1
+    assert p2['indicators']['白细胞计数']['series'][0]['value'] == 6.0
+    conn.close()
+
+
+def test_payload_cache_invalidates_only_the_changed_patient(tmp_path, monkeypatch):
+    csv_dir, db_path = import_two_patients(tmp_path, monkeypatch)
+    conn = sqlite3.connect(db_path)
+    cache = PayloadCache(db_path)
+    builds = []
+
+    def get(patient_id):
+        def build():
+            builds.append(patient_id)
+            return build_payload(conn, patient_id=patient_id)
+        return cache.get(build, 'full', patient_id)
+
+    e1, e2 = get(1), get(2)
+    assert (get(1), get(2), builds) == (e1, e2, [1, 2])
+
+    # 只有患者 p2 的新报告：默认患者的缓存保留
+    (csv_dir / 'p2' / 'b.csv').write_text(HEADER + '2025-09-09,白细胞计数,5.0,10^9/L,3.5-9.5,\n', encoding='utf-8')
+    import_csvs_to_db.import_csvs()
+    assert get(1) is e1
+    assert get(2) is not e2
+    assert builds == [1, 2, 2]
+    conn.close()
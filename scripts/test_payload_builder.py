@@ -0,0 +1,135 @@
+import json
+import sqlite3
+
+import pytest
+
+import export_from_db
+import migrate_to_db
+from export_from_db import iter_full_json, with_trends
+from payload_builder import build_payload, from_columnar, indicator_index, to_columnar
+
+
+def make_db():
+    conn = sqlite3.connect(':memory:')
+    migrate_to_db.ensure_schema(conn)
+    cur = conn.cursor()
+    cur.execute("INSERT INTO patient_meta(patient_id, key, value) VALUES(1, 'start_date', '2025-08-08')")
+    cur.execute("INSERT INTO patient_meta(patient_id, key, value) VALUES(1, 'cycle_length_days', '21')")
+    for d in ('2025-08-12', '2025-8-6', '2025-08-28'):
+        cur.execute('INSERT INTO dates(date) VALUES(?)', (d,))
+    cur.execute("INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES('中性粒细胞计数', '', NULL, NULL)")
+    cur.execute("INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES('中性粒细胞绝对值', '10^9/L', 2.0, 7.0)")
+    cur.execute("INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES('血小板计数', '10^9/L', 300, -125)")
+    rows = [
+        # 标准名与别名同日冲突：别名带箭头的数值应胜出
+        (1, 1, 3.0, '-', '-', None),
+        (2, 1, 1.5, '↓', '↓L', None),
+        (2, 2, 4.0, None, None, '首次化疗前'),
+        (1, 3, None, '', '', None),
+        (3, 1, 100.0, None, None, None),
+    ]
+    cur.executemany('INSERT INTO measurements(indicator_id, date_id, value, status, flag, phase) VALUES(?,?,?,?,?,?)', rows)
+    conn.commit()
+    return conn
+
+
+def test_dates_normalized_and_sorted():
+    payload = build_payload(make_db())
+    assert payload['dates'] == ['2025-08-06', '2025-08-12', '2025-08-28']
+    assert payload['start_date'] == '2025-08-08'
+    assert payload['cycle_length_days'] == 21
+
+
+def test_aliases_merged_into_canonical_name():
+    inds = build_payload(make_db())['indicators']
+    assert '中性粒细胞绝对值' not in inds
+    neut = inds['中性粒细胞计数']
+    assert neut['unit'] == '10^9/L'
+    assert neut['ref'] == {'lower': 2.0, 'upper': 7.0}
+    by_date = {pt['date']: pt for pt in neut['series']}
+    assert [pt['date'] for pt in neut['series']] == ['2025-08-06', '2025-08-12', '2025-08-28']
+    assert by_date['2025-08-12']['value'] == 1.5
+    assert by_date['2025-08-12']['flag'] == '↓'
+    # 缺失标记时按参考范围推断
+    assert by_date['2025-08-06']['flag'] == '-'
+
+
+def test_reversed_ref_fixed_and_flag_derived():
+    plt = build_payload(make_db())['indicators']['血小板计数']
+    assert plt['ref'] == {'lower': 125, 'upper': 300}
+    assert plt['series'][0]['flag'] == '↓'
+    assert plt['series'][0]['status'] == '↓'
+
+
+def test_columnar_round_trip():
+    payload = build_payload(make_db())
+    col = to_columnar(payload)
+    assert col['format'] == 'columnar'
+    assert col['flags'][:4] == [None, '-', '↑', '↓']
+    neut = col['indicators']['中性粒细胞计数']
+    assert [col['dates'][i] for i in neut['d']] == ['2025-08-06', '2025-08-12', '2025-08-28']
+    assert from_columnar(col) == payload
+
+
+def test_filtered_build_and_indicator_index():
+    conn = make_db()
+    part = build_payload(conn, names=['中性粒细胞绝对值'], date_from='2025-8-10')
+    assert list(part['indicators']) == ['中性粒细胞计数']
+    assert part['dates'] == ['2025-08-12', '2025-08-28']
+    assert [pt['date'] for pt in part['indicators']['中性粒细胞计数']['series']] == ['2025-08-12', '2025-08-28']
+    index = indicator_index(build_payload(conn))
+    assert index['indicators']['中性粒细胞计数']['count'] == 3
+    assert index['indicators']['中性粒细胞计数']['first'] == '2025-08-06'
+    assert 'series' not in index['indicators']['血小板计数']
+
+
+def test_streaming_export_matches_payload(monkeypatch):
+    conn = make_db()
+    conn.execute("INSERT INTO indicators(name, unit, ref_lower, ref_upper) VALUES('红细胞数', NULL, NULL, NULL)")
+    expected = json.dumps(with_trends(build_payload(conn)), ensure_ascii=False, indent=2)
+    # 分组临时表用完即删，可重复导出
+    assert ''.join(iter_full_json(conn)) == expected
+    assert ''.join(iter_full_json(conn)) == expected
+
+    # trends 段经临时文件分块回读，而非在内存中累积
+    spools = []
+    temporary_file = export_from_db.tempfile.TemporaryFile
+
+    def spy(*args, **kwargs):
+        spools.append(temporary_file(*args, **kwargs))
+        return spools[-1]
+
+    monkeypatch.setattr(export_from_db.tempfile, 'TemporaryFile', spy)
+    monkeypatch.setattr(export_from_db, 'SPOOL_CHUNK', 7)
+    chunks = list(iter_full_json(conn))
+    assert ''.join(chunks) == expected
+    assert len(spools) == 1 and spools[0].closed
+    monkeypatch.setattr(export_from_db, 'SPOOL_CHUNK', 1 << 16)
+    assert len(chunks) > len(list(iter_full_json(conn)))
+
+
+def test_export_refuses_outdated_schema(tmp_path, monkeypatch):
+    db_path = tmp_path / 'zhl.sqlite3'
+    conn = sqlite3.connect(db_path)
+    for ddl in migrate_to_db.SCHEMA['tables']:
+        conn.execute(ddl)
+    conn.commit()
+    conn.close()
+    dash, docs = tmp_path / 'dash.json', tmp_path / 'docs.json'
+    monkeypatch.setattr(export_from_db, 'DB_PATH', db_path)
+    monkeypatch.setattr(export_from_db, 'OUT_JSON_DASH', dash)
+    monkeypatch.setattr(export_from_db, 'OUT_JSON_DOCS', docs)
+    monkeypatch.setattr(export_from_db, 'MANIFEST_PATH', tmp_path / 'manifest.json')
+    # 导出只读：旧库报错且不被迁移，也不写出任何文件
+    with pytest.raises(RuntimeError, match='version 0, expected %d' % migrate_to_db.SCHEMA_VERSION):
+        export_from_db.export_to_json()
+    with pytest.raises(RuntimeError, match='version 0'):
+        export_from_db.export_payload()
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 0
+    assert not dash.exists() and not docs.exists()
+
+    migrate_to_db.apply_migrations(conn)
+    conn.close()
+    export_from_db.export_to_json()
+    assert json.loads(dash.read_text(encoding='utf-8'))['indicators'] == {}
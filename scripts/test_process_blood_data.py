@@ -0,0 +1,89 @@
+import contextlib
+import csv
+import functools
+import io
+import json
+
+import pytest
+
+import output_manifest
+import process_blood_data
+
+ROWS = [
+    ['R1', '2025-08-12', '中性粒细胞绝对值', '1.5', '↓', '2.0~7.0', '10^9/L'],
+    ['R1', '2025-08-12', '血小板计数', '阴性', '↑H', '', '10^9/L'],
+    ['R2', '2025.8.6', '中性粒细胞计数', '9.0', '-', '2.0~7.0', '10^9/L'],
+    # 同一 (指标, 日期) 的后一行覆盖前一行
+    ['R3', '2025-08-12', '中性粒细胞计数', '3.0', '-', '2.0~7.0', '10^9/L'],
+    ['R3', '2025-08-12', '血小板计数', '-', '↓', ' 125~350 ', '10^9/L'],
+]
+
+
+def run(tmp_path, monkeypatch, rows=ROWS):
+    src = tmp_path / 'source.csv'
+    with open(src, 'w', encoding='utf-8-sig', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(process_blood_data.FIELDS)
+        w.writerows(rows)
+    monkeypatch.setattr(process_blood_data, 'SRC_PATH', str(src))
+    monkeypatch.setattr(process_blood_data, 'OUT_DIR', str(tmp_path))
+    monkeypatch.setattr(process_blood_data, 'DASHBOARD_DATA_PATH', str(tmp_path / 'data.json'))
+    monkeypatch.setattr(process_blood_data, 'write_outputs', functools.partial(
+        output_manifest.write_outputs, manifest_path=tmp_path / 'manifest.json'))
+    with contextlib.redirect_stdout(io.StringIO()):
+        process_blood_data.process()
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_outputs_from_matrix(tmp_path, monkeypatch):
+    run(tmp_path, monkeypatch)
+    assert read_csv(tmp_path / '化疗周期血常规数据_透视表.csv') == [
+        ['检测指标', '2025-08-06', '2025-08-12'],
+        ['中性粒细胞计数', '9.0', '3.0'],
+        ['血小板计数', '', 'None'],
+    ]
+    # 数值按统一参考区间判定，无法比较时沿用原始状态（非 ↑/↓ 记为 -）
+    assert read_csv(tmp_path / '化疗周期血常规数据_异常标记.csv') == [
+        ['检测指标', '2025-08-06', '2025-08-12'],
+        ['中性粒细胞计数', '↑', '-'],
+        ['血小板计数', '', '↓'],
+    ]
+
+    text = (tmp_path / 'data.json').read_text(encoding='utf-8')
+    dash = json.loads(text)
+    assert text == json.dumps(dash, ensure_ascii=False, indent=2)
+    assert dash['dates'] == ['2025-08-06', '2025-08-12']
+    neut = dash['indicators']['中性粒细胞计数']
+    assert neut['ref'] == {'lower': 2.0, 'upper': 7.0}
+    assert neut['series'] == [
+        {'date': '2025-08-06', 'value': 9.0, 'status': '-', 'flag': '↑', 'phase': '首次化疗前'},
+        {'date': '2025-08-12', 'value': 3.0, 'status': '-', 'flag': '-', 'phase': '第1次化疗d5'},
+    ]
+    assert dash['indicators']['血小板计数']['series'] == [
+        {'date': '2025-08-12', 'value': None, 'status': '↓', 'flag': '↓', 'phase': '第1次化疗d5'},
+    ]
+
+
+def test_without_numpy_same_bytes(tmp_path, monkeypatch):
+    pytest.importorskip('numpy')
+    (tmp_path / 'np').mkdir()
+    run(tmp_path / 'np', monkeypatch)
+    monkeypatch.setattr(process_blood_data, '_HAS_NUMPY', False)
+    (tmp_path / 'py').mkdir()
+    run(tmp_path / 'py', monkeypatch)
+    for name in ('化疗周期血常规数据_透视表.csv', '化疗周期血常规数据_异常标记.csv', '参考区间标准化.csv', 'data.json'):
+        assert (tmp_path / 'np' / name).read_bytes() == (tmp_path / 'py' / name).read_bytes()
+
+
+@pytest.mark.parametrize('has_numpy', [True, False])
+def test_header_only_source(tmp_path, monkeypatch, has_numpy):
+    monkeypatch.setattr(process_blood_data, '_HAS_NUMPY', has_numpy and process_blood_data._HAS_NUMPY)
+    run(tmp_path, monkeypatch, rows=[])
+    text = (tmp_path / 'data.json').read_text(encoding='utf-8')
+    assert text == json.dumps(json.loads(text), ensure_ascii=False, indent=2)
+    assert json.loads(text)['indicators'] == {}
+    assert read_csv(tmp_path / '化疗周期血常规数据_透视表.csv') == [['检测指标']]
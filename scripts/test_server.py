@@ -0,0 +1,133 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+import migrate_to_db
+import server
+from patients import touch_patients
+from payload_builder import PayloadCache
+
+
+def make_db(db_path):
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.executemany('INSERT INTO patient_meta(patient_id, key, value) VALUES(1,?,?)',
+                     [('start_date', '2025-08-08'), ('cycle_length_days', '21')])
+    ind_id = migrate_to_db.upsert_indicator(conn, '白细胞计数', '10^9/L', {'lower': 3.5, 'upper': 9.5})
+    for d, v in (('2025-08-12', 2.0), ('2025-08-30', 4.0)):
+        conn.execute('INSERT INTO measurements(indicator_id, date_id, value) VALUES(?,?,?)',
+                     (ind_id, migrate_to_db.upsert_date(conn, d), v))
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    db_path = tmp_path / 'zhl.sqlite3'
+    make_db(db_path)
+    monkeypatch.setattr(server, 'DB_PATH', db_path)
+    monkeypatch.setattr(server, 'payload_cache', PayloadCache(db_path))
+    server.app.config['TESTING'] = True
+    with server.app.test_client() as c:
+        yield c
+
+
+def add_point(db_path, date, value):
+    # 另一连接提交一次导入：写入测量并推进患者 generation
+    conn = sqlite3.connect(db_path)
+    ind_id = conn.execute("SELECT id FROM indicators WHERE name='白细胞计数'").fetchone()[0]
+    conn.execute('INSERT INTO measurements(indicator_id, date_id, value) VALUES(?,?,?)',
+                 (ind_id, migrate_to_db.upsert_date(conn, date), value))
+    touch_patients(conn, [1])
+    conn.commit()
+    conn.close()
+
+
+def test_matching_if_none_match_returns_304(client):
+    first = client.get('/api/data')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    again = client.get('/api/data', headers={'If-None-Match': etag})
+    assert (again.status_code, again.data) == (304, b'')
+    assert again.headers['ETag'] == etag
+    assert client.get('/api/data', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_etag_changes_after_db_write(client):
+    first = client.get('/api/data')
+    etag = first.headers['ETag']
+    add_point(server.DB_PATH, '2025-09-02', 5.0)
+    resp = client.get('/api/data', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert resp.get_json()['dates'] == ['2025-08-12', '2025-08-30', '2025-09-02']
+    assert client.get('/api/data', headers={'If-None-Match': resp.headers['ETag']}).status_code == 304
+
+
+def test_replaced_db_file_is_served(client, tmp_path):
+    first = client.get('/api/data')
+    etag = first.headers['ETag']
+    # 整库替换（新 inode）：缓存与请求连接都要换到新文件
+    new_db = tmp_path / 'new.sqlite3'
+    make_db(new_db)
+    add_point(new_db, '2025-09-02', 5.0)
+    os.replace(new_db, server.DB_PATH)
+    resp = client.get('/api/data', headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert resp.get_json()['dates'] == ['2025-08-12', '2025-08-30', '2025-09-02']
+
+
+def test_gzip_body_and_etag_pair(client):
+    plain = client.get('/api/data')
+    resp = client.get('/api/data', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(resp.data) == plain.data
+    # 编码表示的 ETag 带编码后缀，且与 identity 的互认
+    assert resp.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+    again = client.get('/api/data', headers={'Accept-Encoding': 'identity', 'If-None-Match': resp.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_brotli_preferred_when_available(client, monkeypatch):
+    brotli = pytest.importorskip('brotli')
+    monkeypatch.setattr(server, 'CODINGS', ('gzip', 'br'))
+    plain = client.get('/api/data')
+    resp = client.get('/api/data', headers={'Accept-Encoding': 'gzip, br'})
+    assert resp.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(resp.data) == plain.data
+    assert resp.headers['ETag'] == plain.headers['ETag'][:-1] + '-br"'
+    assert 'Content-Encoding' not in client.get('/api/data', headers={'Accept-Encoding': 'gzip;q=0, br;q=0'}).headers
+
+
+def test_falls_back_to_gzip_without_brotli(client, monkeypatch):
+    # 未安装 brotli 时 CODINGS 只有 gzip
+    monkeypatch.setattr(server, 'CODINGS', ('gzip',))
+    resp = client.get('/api/data', headers={'Accept-Encoding': 'br, gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['ETag'].endswith('-gzip"')
+    resp = client.get('/api/data', headers={'Accept-Encoding': 'br'})
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.get_json()['dates'] == ['2025-08-12', '2025-08-30']
+
+
+def test_patient_parameter_selects_patient(client):
+    conn = sqlite3.connect(server.DB_PATH)
+    conn.execute("INSERT INTO patients(id, code, name) VALUES(2, 'p2', 'p2')")
+    conn.execute('INSERT INTO measurements(patient_id, indicator_id, date_id, value) VALUES(2, 1, ?, 6.0)',
+                 (migrate_to_db.upsert_date(conn, '2025-09-02'),))
+    conn.commit()
+    conn.close()
+    default = client.get('/api/series?names=白细胞计数').get_json()
+    p2 = client.get('/api/series?names=白细胞计数&patient=2').get_json()
+    assert default['dates'] == ['2025-08-12', '2025-08-30']
+    assert p2['dates'] == ['2025-09-02']
+    assert client.get('/api/indicators?patient=2').get_json()['indicators']['白细胞计数']['count'] == 1
+    assert client.get('/api/indicators').get_json()['indicators']['白细胞计数']['count'] == 2
+    assert client.get('/api/trends?patient=2').status_code == 200
+    assert client.get('/api/cycles?patient=2').status_code == 200
+    assert client.get('/api/trends?patient=9').status_code == 404
+    assert client.get('/api/cycles?patient=x').status_code == 400
@@ -0,0 +1,184 @@
+import base64
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+import build_scf_zip
+import http_encoding
+import migrate_to_db
+import server_scf
+
+
+def make_db(db_path):
+    conn = sqlite3.connect(db_path)
+    migrate_to_db.ensure_schema(conn)
+    conn.executemany('INSERT INTO patient_meta(patient_id, key, value) VALUES(1,?,?)',
+                     [('start_date', '2025-08-08'), ('cycle_length_days', '21')])
+    ind_id = migrate_to_db.upsert_indicator(conn, '白细胞计数', '10^9/L', {'lower': 3.5, 'upper': 9.5})
+    for d, v in (('2025-08-12', 2.0), ('2025-08-30', 4.0)):
+        conn.execute('INSERT INTO measurements(indicator_id, date_id, value) VALUES(?,?,?)',
+                     (ind_id, migrate_to_db.upsert_date(conn, d), v))
+    conn.commit()
+    # 与打包副本一致：rollback journal，函数端以 immutable 只读打开
+    conn.execute('PRAGMA journal_mode=DELETE')
+    conn.close()
+
+
+@pytest.fixture
+def scf(tmp_path, monkeypatch):
+    """server_scf pointed at a bundle laid out like dist/scf.zip (DB + prebuilt responses)."""
+    db_path = tmp_path / 'db' / 'zhl.sqlite3'
+    db_path.parent.mkdir()
+    make_db(db_path)
+    for arc, data, _compressed in build_scf_zip.prebuilt_files(build_scf_zip.render_api_data(db_path)):
+        (tmp_path / arc).write_bytes(data)
+    prebuilt = server_scf._load_prebuilt(db_path.parent)
+    monkeypatch.setattr(server_scf, 'DB_PATH', db_path)
+    monkeypatch.setattr(server_scf, '_PREBUILT', prebuilt)
+    monkeypatch.setattr(server_scf, '_HAS_PREBUILT', bool(prebuilt))
+    monkeypatch.setattr(server_scf, '_STATE', dict(server_scf._STATE, conn=None, conn_path=None, payload=None,
+                                                   formats={}, queries={}, invocations=0,
+                                                   conn_ms=None))
+    yield server_scf
+    if server_scf._STATE['conn'] is not None:
+        server_scf._STATE['conn'].close()
+
+
+def call(path, headers=None, **params):
+    return server_scf.main_handler({'httpMethod': 'GET', 'path': path, 'headers': headers or {},
+                                   'queryString': params}, None)
+
+
+def test_db_backed_route_keeps_prebuilt_bodies(scf):
+    first = call('/api/data')
+    assert first['statusCode'] == 200
+    # 打开 DB 连接的路由不应丢弃冷启动时载入的预渲染响应
+    assert call('/api/patients')['statusCode'] == 200
+    assert call('/api/series', names='白细胞计数')['statusCode'] == 200
+    again = call('/api/data')
+    assert (again['statusCode'], again['body']) == (200, first['body'])
+    assert call('/api/indicators')['statusCode'] == 200
+    assert call('/api/trends')['statusCode'] == 200
+    assert call('/api/data', format='columnar')['statusCode'] == 200
+    assert json.loads(again['body'])['dates'] == ['2025-08-12', '2025-08-30']
+
+
+def metrics(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_cold_start_serves_prebuilt_without_db(scf, capsys):
+    resp = call('/api/data')
+    assert resp['statusCode'] == 200
+    assert resp['body'] == scf._PREBUILT['full']['bodies'][None]
+    assert resp['headers']['ETag'] == '"%s"' % scf._PREBUILT['full']['etag']
+    # 预渲染路由不打开 DB 连接
+    assert call('/api/indicators')['statusCode'] == 200
+    assert scf._STATE['conn'] is None
+    logged = metrics(capsys)
+    assert [m['start'] for m in logged] == ['cold', 'warm']
+    # 冷启动附带初始化耗时；未打开 DB 时没有连接耗时
+    assert set(logged[0]['init']) == {'import_ms', 'prebuilt_ms', 'since_load_ms'}
+    assert 'init' not in logged[1]
+
+
+def test_warm_invocations_reuse_bodies_and_connection(scf, capsys):
+    first = call('/api/series', names='白细胞计数')
+    conn = scf._STATE['conn']
+    state = scf._STATE['queries'][('full', ('白细胞计数',), None, None, 1)]
+    again = call('/api/series', names='白细胞计数')
+    assert again['body'] == first['body']
+    assert scf._STATE['conn'] is conn
+    assert scf._STATE['queries'][('full', ('白细胞计数',), None, None, 1)] is state
+    logged = metrics(capsys)
+    assert [m['start'] for m in logged] == ['cold', 'warm']
+    assert logged[0]['init']['conn_ms'] >= 0
+    assert 'init' not in logged[1]
+
+
+def test_db_backed_routes_without_prebuilt_bodies(scf, monkeypatch):
+    prebuilt = scf._PREBUILT
+    monkeypatch.setattr(scf, '_PREBUILT', {})
+    monkeypatch.setattr(scf, '_HAS_PREBUILT', False)
+    for path, fmt in (('/api/data', 'full'), ('/api/indicators', 'indicators'), ('/api/trends', 'trends')):
+        resp = call(path)
+        assert resp['statusCode'] == 200
+        # 从 DB 构建的响应与构建时预渲染的一致
+        assert resp['body'] == prebuilt[fmt]['bodies'][None]
+        assert resp['headers']['ETag'] == '"%s"' % prebuilt[fmt]['etag']
+    formats = dict(scf._STATE['formats'])
+    assert set(formats) == {'full', 'indicators', 'trends'}
+    assert call('/api/data')['body'] == prebuilt['full']['bodies'][None]
+    assert all(scf._STATE['formats'][fmt] is state for fmt, state in formats.items())
+    assert call('/api/data', format='nope')['statusCode'] == 400
+    assert call('/api/patients/1/data')['body'] == prebuilt['full']['bodies'][None]
+    assert call('/api/patients/9/data')['statusCode'] == 404
+
+
+def decoded(resp):
+    assert resp['isBase64Encoded']
+    return base64.b64decode(resp['body'])
+
+
+def test_encoded_prebuilt_body_and_etag_pair(scf):
+    plain = call('/api/data')
+    resp = call('/api/data', {'Accept-Encoding': 'gzip'})
+    assert resp['headers']['Content-Encoding'] == 'gzip'
+    assert resp['headers']['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(decoded(resp)).decode('utf-8') == plain['body']
+    assert resp['headers']['ETag'] == plain['headers']['ETag'][:-1] + '-gzip"'
+    # 任一编码表示的 ETag 都命中 304
+    assert call('/api/data', {'If-None-Match': resp['headers']['ETag']})['statusCode'] == 304
+    if 'br' in scf._PREBUILT['full']['bodies']:
+        import brotli
+        resp = call('/api/data', {'Accept-Encoding': 'gzip, br'})
+        assert resp['headers']['Content-Encoding'] == 'br'
+        assert brotli.decompress(decoded(resp)).decode('utf-8') == plain['body']
+        assert resp['headers']['ETag'] == plain['headers']['ETag'][:-1] + '-br"'
+
+
+def test_falls_back_to_gzip_without_brotli(scf, monkeypatch):
+    # 构建环境未装 brotli 时包内没有 .json.br
+    for state in scf._PREBUILT.values():
+        state['bodies'].pop('br', None)
+    resp = call('/api/data', {'Accept-Encoding': 'br, gzip'})
+    assert resp['headers']['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in call('/api/data', {'Accept-Encoding': 'br'})['headers']
+
+    # 无预渲染文件时从 DB 构建，同样只生成可用的编码
+    monkeypatch.setattr(scf, '_PREBUILT', {})
+    monkeypatch.setattr(scf, '_HAS_PREBUILT', False)
+    monkeypatch.setattr(http_encoding, 'brotli_available', lambda: False)
+    resp = call('/api/data', {'Accept-Encoding': 'br, gzip'})
+    assert resp['headers']['Content-Encoding'] == 'gzip'
+    assert set(scf._STATE['formats']['full']['bodies']) == {None, 'gzip'}
+    resp = call('/api/series', {'Accept-Encoding': 'br;q=1, gzip;q=0.5'}, names='白细胞计数')
+    assert resp['headers']['Content-Encoding'] == 'gzip'
+    assert resp['headers']['ETag'].endswith('-gzip"')
+
+
+def add_patient(db_path):
+    # 第二位患者：同一指标的另一组测量（在函数首次打开 DB 前写入）
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO patients(id, code, name) VALUES(2, 'p2', 'p2')")
+    conn.execute('INSERT INTO measurements(patient_id, indicator_id, date_id, value) VALUES(2, 1, ?, 6.0)',
+                 (migrate_to_db.upsert_date(conn, '2025-09-02'),))
+    conn.commit()
+    conn.close()
+
+
+def test_patient_parameter_selects_patient(scf):
+    add_patient(scf.DB_PATH)
+    default = json.loads(call('/api/series', names='白细胞计数')['body'])
+    p2 = json.loads(call('/api/series', names='白细胞计数', patient='2')['body'])
+    assert default['dates'] == ['2025-08-12', '2025-08-30']
+    assert p2['dates'] == ['2025-09-02']
+    assert json.loads(call('/api/indicators', patient='2')['body'])['indicators']['白细胞计数']['count'] == 1
+    assert call('/api/trends', patient='2')['statusCode'] == 200
+    # 默认患者仍走预渲染响应
+    assert call('/api/indicators', patient='1')['body'] == scf._PREBUILT['indicators']['bodies'][None]
+    assert call('/api/cycles', patient='2')['statusCode'] == 200
+    assert call('/api/indicators', patient='9')['statusCode'] == 404
+    assert call('/api/series', names='白细胞计数', patient='x')['statusCode'] == 400
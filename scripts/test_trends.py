@@ -0,0 +1,53 @@
+import pytest
+
+import trends
+
+
+def make_series(values, start=1):
+    return [{'date': '2025-09-%02d' % (start + i), 'value': v} for i, v in enumerate(values)]
+
+
+def js_loess(points, span=0.6):
+    # 原 app.js computeTrendLoess 的逐行移植，作为对照
+    valid = [(x, y) for x, y in points if isinstance(y, float)]
+    k = max(3, int(span * len(valid)))
+    out = []
+    for x0, _y in points:
+        dist = sorted(((abs(x - x0), i) for i, (x, _) in enumerate(valid)), key=lambda t: t[0])[:k]
+        dmax = dist[-1][0] or 1e-6
+        sw = swx = swx2 = swy = swxy = 0.0
+        for d, i in dist:
+            w = (1 - (d / dmax) ** 3) ** 3
+            x, y = valid[i]
+            sw += w
+            swx += w * x
+            swx2 += w * x * x
+            swy += w * y
+            swxy += w * x * y
+        denom = sw * swx2 - swx * swx
+        b = (sw * swxy - swx * swy) / denom
+        out.append((swy - b * swx) / sw + b * x0)
+    return out
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_loess_matches_former_browser_fit(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    monkeypatch.setattr(trends, '_HAS_NUMPY', use_numpy)
+    values = [5.1, 6.3, None, 4.2, 3.9, 'x', 7.7, 8.0, 2.5, 3.3, 4.4, 6.1]
+    series = make_series(values)
+    expected = js_loess([(i, float(v) if isinstance(v, float) else v) for i, v in enumerate(values)])
+    loess = trends.indicator_trend(series)['loess']
+    assert [d for d, _y in loess] == [pt['date'] for pt in series]
+    assert [y for _d, y in loess] == pytest.approx(expected, abs=1e-4)
+
+
+def test_linear_and_short_series():
+    t = trends.indicator_trend(make_series([1.0, 3.0, 5.0]))
+    assert t['slope_per_day'] == pytest.approx(2.0)
+    assert [y for _d, y in t['linear']] == [1.0, 3.0, 5.0]
+    assert [y for _d, y in t['loess']] == [1.0, 3.0, 5.0]
+    short = trends.indicator_trend(make_series([1.0, None, 2.0]))
+    assert short['loess'] == [] and len(short['linear']) == 3
+    assert trends.indicator_trend([]) == {'loess': [], 'linear': [], 'slope_per_day': None}
@@ -0,0 +1,145 @@
+"""
+Trend lines for the dashboard, computed once per data version.
+
+The dashboard used to fit a LOESS curve in the browser for every chart on
+every update (O(n^2) per indicator on the main thread). trends_view() fits
+each indicator of a payload once and returns ready-to-plot [date, y] arrays:
+
+- loess: local linear regression with tricube weights over the nearest
+  max(3, floor(span * n)) numeric points (span 0.6), evaluated at every point
+  date -- the same fit as the former computeTrendLoess in app.js;
+- linear: least-squares line over the numeric points, evaluated at the same
+  dates, with its slope per day.
+
+x is days since the series' first date. Uses NumPy when it is installed and
+falls back to pure Python otherwise (the SCF zip ships without NumPy); both
+give the same results up to float rounding. Kept compatible with the SCF
+Python 3.7 runtime.
+"""
+from date_normalizer import UNPARSED_ORDINAL, date_ordinal
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+LOESS_SPAN = 0.6
+MIN_LOESS_POINTS = 3
+# 仅用于绘图：保留 4 位小数以控制 data.json 体积
+TREND_DECIMALS = 4
+# 与 app.js 原实现一致的退化阈值
+EPS = 1e-12
+ZERO_BANDWIDTH = 1e-6
+
+
+def _round(y):
+    return None if y is None else round(float(y), TREND_DECIMALS)
+
+
+def loess_window(n: int, span: float = LOESS_SPAN) -> int:
+    """Number of nearest points in each local fit."""
+    return max(MIN_LOESS_POINTS, int(span * n))
+
+
+def linear_fit(xs, ys):
+    """(slope, intercept) of the least-squares line, or None for fewer than
+    two points or when all x are equal."""
+    n = len(ys)
+    if n < 2:
+        return None
+    sx = sum(xs)
+    sy = sum(ys)
+    sxy = sum(x * y for x, y in zip(xs, ys))
+    sxx = sum(x * x for x in xs)
+    denom = n * sxx - sx * sx
+    if denom == 0:
+        return None
+    k = (n * sxy - sx * sy) / denom
+    return k, (sy - k * sx) / n
+
+
+def _loess_at(xs, ys, k, x0):
+    dist = sorted(((abs(x - x0), i) for i, x in enumerate(xs)), key=lambda t: t[0])[:k]
+    dmax = dist[-1][0] or ZERO_BANDWIDTH
+    sw = swx = swx2 = swy = swxy = 0.0
+    for d, i in dist:
+        w = (1 - (d / dmax) ** 3) ** 3
+        x, y = xs[i], ys[i]
+        sw += w
+        swx += w * x
+        swx2 += w * x * x
+        swy += w * y
+        swxy += w * x * y
+    denom = sw * swx2 - swx * swx
+    if abs(denom) < EPS:
+        return swy / (sw or EPS)
+    b = (sw * swxy - swx * swy) / denom
+    return (swy - b * swx) / sw + b * x0
+
+
+def _loess_numpy(xs, ys, k, x_eval):
+    x = np.asarray(xs, dtype=float)
+    y = np.asarray(ys, dtype=float)
+    x0 = np.asarray(x_eval, dtype=float)[:, None]
+    d = np.abs(x[None, :] - x0)
+    # 第 k 近的距离即带宽；距离等于带宽的点权重为 0，与按距离截取前 k 个等价
+    dmax = np.partition(d, k - 1, axis=1)[:, k - 1:k]
+    dmax = np.where(dmax == 0, ZERO_BANDWIDTH, dmax)
+    u = d / dmax
+    w = np.where(u < 1, (1 - np.minimum(u, 1) ** 3) ** 3, 0.0)
+    sw = w.sum(axis=1)
+    swx = w @ x
+    swx2 = w @ (x * x)
+    swy = w @ y
+    swxy = w @ (x * y)
+    denom = sw * swx2 - swx * swx
+    degenerate = np.abs(denom) < EPS
+    b = (sw * swxy - swx * swy) / np.where(degenerate, 1.0, denom)
+    sw = np.where(sw == 0, EPS, sw)
+    return np.where(degenerate, swy / sw, (swy - b * swx) / sw + b * x0[:, 0]).tolist()
+
+
+def loess(xs, ys, x_eval, span: float = LOESS_SPAN) -> list:
+    """LOESS fit of (xs, ys) evaluated at x_eval; all None for fewer than
+    three points."""
+    if len(ys) < MIN_LOESS_POINTS:
+        return [None] * len(x_eval)
+    k = loess_window(len(ys), span)
+    if _HAS_NUMPY:
+        return _loess_numpy(xs, ys, k, x_eval)
+    return [_loess_at(xs, ys, k, x0) for x0 in x_eval]
+
+
+def indicator_trend(series, span: float = LOESS_SPAN) -> dict:
+    """Trend arrays for one indicator's series (list of point dicts)."""
+    dated = [(pt, date_ordinal(pt['date'])) for pt in series]
+    dated = [(pt, o) for pt, o in dated if o != UNPARSED_ORDINAL]
+    if not dated:
+        return {'loess': [], 'linear': [], 'slope_per_day': None}
+    base = dated[0][1]
+    dates = [pt['date'] for pt, _o in dated]
+    x_eval = [o - base for _pt, o in dated]
+    xs, ys = [], []
+    for pt, o in dated:
+        v = pt.get('value')
+        # bool 也是 int 的子类；与前端 typeof === 'number' 一致需排除
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            xs.append(o - base)
+            ys.append(float(v))
+    fit = linear_fit(xs, ys)
+    smooth = loess(xs, ys, x_eval, span)
+    return {
+        'loess': [[d, _round(y)] for d, y in zip(dates, smooth)] if len(ys) >= MIN_LOESS_POINTS else [],
+        'linear': [[d, _round(fit[0] * x + fit[1])] for d, x in zip(dates, x_eval)] if fit else [],
+        'slope_per_day': fit[0] if fit else None,
+    }
+
+
+def trends_view(payload: dict) -> dict:
+    """/api/trends view of a full payload: {name: indicator_trend(series)}."""
+    return {
+        'span': LOESS_SPAN,
+        'indicators': {name: indicator_trend(ind.get('series') or [])
+                       for name, ind in (payload.get('indicators') or {}).items()},
+    }